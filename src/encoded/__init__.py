@@ -31,6 +31,7 @@ from snovault.elasticsearch.interfaces import INVALIDATION_SCOPE_ENABLED
 
 from .appdefs import APP_VERSION_REGISTRY_KEY
 from .schema_formats import format_checker
+from .warm_up import warm_up_if_enabled
 from snovault.loadxl import load_all
 
 
@@ -241,8 +242,11 @@ def main(global_config, **local_config):
     config.include('.root')
     config.include('.types')
     config.include('.batch_download')
+    config.include('.export_jobs')
     config.include('snovault.loadxl')
     config.include('.visualization')
+    config.include('.provenance_cache')
+    config.include('.reference_item_cache')
     config.include('snovault.ingestion.ingestion_listener')
     config.include('.ingestion.ingestion_processors')
     config.include('snovault.ingestion.ingestion_message_handler_default')
@@ -289,6 +293,9 @@ def main(global_config, **local_config):
     if workbook_filename:
         load_workbook(app, workbook_filename, docsdir)
 
+    # prime caches and connections of the hot endpoints in the background, if enabled (web workers only)
+    warm_up_if_enabled(app, settings)
+
     return app
 
 
@@ -0,0 +1,65 @@
+"""
+Registry-scoped provider of boto3 clients, shared by all requests and threads of a process.
+
+Constructing a boto3 client loads and parses botocore data files, which is slow and allocation heavy, whereas
+clients are thread-safe; so one client per service and region is created on first use and reused after.
+Connection pool size and retries of the clients are configured with `aws_clients.max_pool_connections` and
+`aws_clients.max_attempts`.
+
+Tests may swap in a stub with `registry[AWS_CLIENTS] = stub`, given a `client(service_name, region_name=None)` method.
+"""
+
+import boto3
+import threading
+from botocore.config import Config
+
+
+AWS_CLIENTS = 'encoded.aws_clients'  # registry key
+
+DEFAULT_AWS_MAX_POOL_CONNECTIONS = 10
+DEFAULT_AWS_MAX_ATTEMPTS = 3
+
+
+class AWSClientProvider(object):
+    """ Creates, on first use, and holds one boto3 client per (service, region), all from a single session """
+
+    def __init__(self, max_pool_connections=DEFAULT_AWS_MAX_POOL_CONNECTIONS, max_attempts=DEFAULT_AWS_MAX_ATTEMPTS):
+        self.config = Config(max_pool_connections=max_pool_connections,
+                             retries={'max_attempts': max_attempts, 'mode': 'standard'})
+        self._session = None
+        self._clients = {}
+        self._lock = threading.Lock()  # boto3 sessions are not thread-safe
+
+    def client(self, service_name, region_name=None):
+        key = (service_name, region_name)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    if self._session is None:
+                        self._session = boto3.session.Session()
+                    client = self._clients[key] = self._session.client(service_name, region_name=region_name,
+                                                                       config=self.config)
+        return client
+
+
+_provider_lock = threading.Lock()
+
+
+def get_aws_client_provider(registry):
+    with _provider_lock:
+        provider = registry.get(AWS_CLIENTS)
+        if provider is None:
+            settings = registry.settings
+            provider = registry[AWS_CLIENTS] = AWSClientProvider(
+                max_pool_connections=int(settings.get('aws_clients.max_pool_connections',
+                                                      DEFAULT_AWS_MAX_POOL_CONNECTIONS)),
+                max_attempts=int(settings.get('aws_clients.max_attempts', DEFAULT_AWS_MAX_ATTEMPTS))
+            )
+    return provider
+
+
+def get_aws_client(registry, service_name, region_name=None):
+    """ Returns the shared boto3 client for `service_name` (and `region_name`, if given) """
+    return get_aws_client_provider(registry).client(service_name, region_name=region_name)
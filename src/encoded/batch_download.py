@@ -1,5 +1,4 @@
 from collections import OrderedDict
-from pyramid.compat import bytes_
 from pyramid.httpexceptions import (
     HTTPBadRequest,
     HTTPMovedPermanently
@@ -8,7 +7,7 @@ from base64 import b64decode
 from pyramid.view import view_config
 from pyramid.response import Response
 from snovault import TYPES
-from snovault.util import simple_path_ids, debug_log
+from snovault.util import debug_log
 from itertools import chain
 
 from urllib.parse import (
@@ -25,6 +24,8 @@ from .search import (
 import csv
 import io
 import json
+import time
+import zlib
 from datetime import datetime
 
 import structlog
@@ -128,6 +129,210 @@ EXTRA_FIELDS = {
 }
 
 
+class AccessionTripleIndex(object):
+    '''
+    Lookup structures compiled once from the (ExpSet Accession, Exp Accession, File Accession) triples
+    POSTed to /metadata/, so that each file row is matched in constant time rather than by scanning all triples.
+    A 'NONE' accession is a wildcard. Like a linear scan, `first_match` returns the first (in POSTed order)
+    triple matching a row.
+    '''
+
+    WILDCARD = 'NONE'
+
+    def __init__(self, accession_triples):
+        self.triples = accession_triples
+        self.file_accessions = set()
+        self.first_index_by_triple = {} # (set, exp, file) -> index of first such triple
+        self.first_index_by_set_exp = {} # (set, exp) -> index of first triple, any file; for reference files
+        for idx, (set_accession, exp_accession, file_accession) in enumerate(accession_triples):
+            self.file_accessions.add(file_accession)
+            self.first_index_by_triple.setdefault((set_accession, exp_accession, file_accession), idx)
+            self.first_index_by_set_exp.setdefault((set_accession, exp_accession), idx)
+
+    def has_file_accession(self, file_accession):
+        return file_accession in self.file_accessions
+
+    def first_match(self, column_vals_dict):
+        '''Returns the first triple matching the ExpSet, Exp and File accessions of a file row, or None.'''
+        set_candidates = [ self.WILDCARD ]
+        if 'Experiment Set Accession' in column_vals_dict:
+            set_candidates.append(column_vals_dict['Experiment Set Accession'])
+        exp_candidates = [ self.WILDCARD ]
+        if 'Experiment Accession' in column_vals_dict:
+            exp_candidates.append(column_vals_dict['Experiment Accession'])
+
+        indices = []
+        if column_vals_dict['Related File Relationship'] == 'reference file for': # Any file accession matches
+            for set_accession in set_candidates:
+                for exp_accession in exp_candidates:
+                    indices.append(self.first_index_by_set_exp.get((set_accession, exp_accession)))
+        else:
+            for set_accession in set_candidates:
+                for exp_accession in exp_candidates:
+                    for file_accession in (self.WILDCARD, column_vals_dict['File Accession']):
+                        indices.append(self.first_index_by_triple.get((set_accession, exp_accession, file_accession)))
+
+        indices = [ idx for idx in indices if idx is not None ]
+        return self.triples[min(indices)] if indices else None
+
+
+class ColumnExtractor(object):
+    '''
+    Compiles the dotted field paths of some TSV_MAPPING columns into a tree once per request, so that the values
+    of all of these columns are collected from an object (ExpSet, Exp or File) in a single traversal, rather than
+    walking every path separately with `simple_path_ids`. Values of each field are in same order as by
+    `simple_path_ids`; duplicates are removed with (insertion-ordered) dicts.
+
+    :param columns: List of TSV_MAPPING keys.
+    :param path_prefix: Prepended to every field path, e.g. 'experiments_in_set.' to get Exp values of an ExpSet.
+    '''
+
+    def __init__(self, columns, path_prefix=''):
+        self.columns = [ (column, TSV_MAPPING[column][1], TSV_MAPPING[column][2]) for column in columns ]
+        self.tree = {} # name -> (subtree, fields ending at this name)
+        for column, fields, remove_duplicates in self.columns:
+            for field in fields:
+                node = None
+                subtree = self.tree
+                for name in (path_prefix + field).split('.'):
+                    node = subtree.setdefault(name, ({}, []))
+                    subtree = node[0]
+                if field not in node[1]:
+                    node[1].append(field)
+        self.fields = { field for column, fields, remove_duplicates in self.columns for field in fields }
+
+    def get_values_by_field(self, item):
+        ''':returns Dictionary of field (without path_prefix) to list of values found in item, as strings.'''
+        values_by_field = { field: [] for field in self.fields }
+
+        def visit(subtree, obj):
+            for name, (child_subtree, fields) in subtree.items():
+                value = obj.get(name, None)
+                if value is None:
+                    continue
+                for member in (value if isinstance(value, list) else [value]):
+                    for field in fields:
+                        values_by_field[field].append(str(member))
+                    if child_subtree:
+                        visit(child_subtree, member)
+
+        visit(self.tree, item)
+        return values_by_field
+
+    def extract(self, item):
+        ''':returns Dictionary of column to TSV cell value.'''
+        values_by_field = self.get_values_by_field(item)
+        row_vals = {}
+        for column, fields, remove_duplicates in self.columns:
+            temp = []
+            for field in fields:
+                c_value = values_by_field[field]
+                if remove_duplicates:
+                    c_value = list(dict.fromkeys(c_value))
+                if len(temp):
+                    if len(c_value):
+                        temp = [ x + ' ' + c_value[0] for x in temp ]
+                else:
+                    temp = c_value
+            row_vals[column] = ', '.join(dict.fromkeys(temp) if remove_duplicates else temp)
+        return row_vals
+
+    def extract_joined_per_field(self, item):
+        ''':returns Dictionary of column to the deduplicated values of each of its fields, joined by ', '.'''
+        values_by_field = self.get_values_by_field(item)
+        return {
+            column: ', '.join([ ', '.join(dict.fromkeys(values_by_field[field])) for field in fields ])
+            for column, fields, remove_duplicates in self.columns
+        }
+
+
+def get_metadata_header_and_fields(search_type):
+    '''
+    Returns the TSV header (TSV_MAPPING keys) of /metadata/ output and the search `field`s needed to fill it in,
+    for ExperimentSet or File `search_type`.
+    '''
+    header = []
+    fields = []
+
+    def add_field(itemType, param_field):
+        if search_type[0:13] == 'ExperimentSet':
+            if itemType == EXP_SET:
+                fields.append(param_field)
+            elif itemType == EXP:
+                fields.append('experiments_in_set.' + param_field)
+            elif itemType == FILE:
+                fields.append('experiments_in_set.files.' + param_field)
+                fields.append('experiments_in_set.processed_files.' + param_field)
+                fields.append('experiments_in_set.other_processed_files.files.' + param_field)
+                fields.append('processed_files.' + param_field)
+                fields.append('other_processed_files.files.' + param_field)
+        elif search_type[0:4] == 'File' and search_type[4:7] != 'Set':
+            if itemType == EXP_SET:
+                fields.append('experiment_set.' + param_field)
+            elif itemType == EXP:
+                fields.append('experiment.' + param_field)
+            elif itemType == FILE or itemType == FILE_ONLY:
+                fields.append(param_field)
+        else:
+            raise HTTPBadRequest("Metadata can only be retrieved currently for Experiment Sets or Files. Received \"" + search_type + "\"")
+
+    for prop in TSV_MAPPING:
+        if search_type[0:4] == 'File' and search_type[4:7] != 'Set':
+            if TSV_MAPPING[prop][0] == FILE or TSV_MAPPING[prop][0] == FILE_ONLY:
+                header.append(prop)
+        elif TSV_MAPPING[prop][0] != FILE_ONLY:
+            header.append(prop)
+        for param_field in TSV_MAPPING[prop][1]:
+            add_field(TSV_MAPPING[prop][0], param_field)
+    for itemType in EXTRA_FIELDS:
+        for param_field in EXTRA_FIELDS[itemType]:
+            add_field(itemType, param_field)
+    return header, fields
+
+
+# ES fields holding accessions of files whose rows are output for an ExperimentSet; must cover every
+# file list iterated by format_experiment_set & format_experiment in metadata_tsv (extra files rows
+# carry the accession of their primary file). Reference files may be selected on their own,
+# from the Supplementary Files tab.
+EXP_SET_FILE_ACCESSION_FIELDS = [
+    'embedded.experiments_in_set.files.accession.raw',
+    'embedded.experiments_in_set.processed_files.accession.raw',
+    'embedded.experiments_in_set.other_processed_files.files.accession.raw',
+    'embedded.experiments_in_set.reference_files.accession.raw',
+    'embedded.processed_files.accession.raw',
+    'embedded.other_processed_files.files.accession.raw'
+]
+
+
+def get_accession_triple_filters(accession_triples, search_type):
+    '''
+    Builds ES filter clauses which exclude Items that cannot contain a file row matched by any of the
+    (ExpSet Accession, Exp Accession, File Accession) triples. Each accession level is filtered on
+    independently, and only if no triple has a wildcard ('NONE') for it, so that results are a superset
+    of what is needed.
+    '''
+    wildcard = AccessionTripleIndex.WILDCARD
+    set_accessions, exp_accessions, file_accessions = [ set(accessions) for accessions in zip(*accession_triples) ]
+    filters = []
+    if search_type[0:4] == 'File' and search_type[4:7] != 'Set':
+        if wildcard not in file_accessions:
+            filters.append({'terms': {'embedded.accession.raw': sorted(file_accessions)}})
+        return filters
+
+    if wildcard not in set_accessions:
+        filters.append({'terms': {'embedded.accession.raw': sorted(set_accessions)}})
+    if wildcard not in exp_accessions:
+        # ExpSet processed file rows list the accessions of all Exps in set, comma-separated.
+        exp_accessions = { acc for accessions in exp_accessions for acc in accessions.split(', ') }
+        filters.append({'terms': {'embedded.experiments_in_set.accession.raw': sorted(exp_accessions)}})
+    if wildcard not in file_accessions:
+        # Reference file rows match any File Accession, but are only output along with a raw file of same Exp.
+        filters.append({'bool': {'should': [
+            {'terms': {field: sorted(file_accessions)}} for field in EXP_SET_FILE_ACCESSION_FIELDS
+        ]}})
+    return filters
+
+
 def get_file_uuids(result_dict):
     file_uuids = []
     for item in result_dict['@graph']:
@@ -164,13 +369,154 @@ def get_peak_metadata_links(request):
     return [peak_metadata_tsv_link, peak_metadata_json_link]
 
 
-class DummyFileInterfaceImplementation(object):
+STREAM_CHUNK_SIZE = 64 * 1024 # approx. bytes per streamed response chunk
+STREAM_FLUSH_INTERVAL = 1.0 # seconds
+
+
+class BufferedChunkWriter(object):
+    '''
+    File-like text sink (e.g. for csv.writer) which batches written rows into UTF-8 encoded chunks of about
+    `chunk_size` bytes, so that streamed responses are not made of one tiny chunk per row.
+    A pending chunk is also handed out once `flush_interval` seconds have passed since the previous one, so that
+    bytes still go out regularly while rows trickle in. This is checked whenever `pop_chunk` is called, i.e. after
+    each row, as there is no way to be notified while waiting on the next row.
+    '''
+
+    def __init__(self, chunk_size=STREAM_CHUNK_SIZE, flush_interval=STREAM_FLUSH_INTERVAL):
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self._pieces = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, text):
+        self._pieces.append(text)
+        self._size += len(text)
+
+    def pop_chunk(self, force=False):
+        '''Returns pending output as bytes if chunk is full, flush interval has passed, or `force`; else None.'''
+        if not self._pieces:
+            return None
+        now = time.monotonic()
+        if force or self._size >= self.chunk_size or now - self._last_flush >= self.flush_interval:
+            chunk = ''.join(self._pieces).encode('utf-8')
+            self._pieces = []
+            self._size = 0
+            self._last_flush = now
+            return chunk
+        return None
+
+
+# format= values accepted by /metadata/ and /report.tsv -> (content type, file extension)
+OUTPUT_FORMATS = OrderedDict([
+    ('tsv',     ('text/tsv', 'tsv')),
+    ('tsv.gz',  ('application/gzip', 'tsv.gz')),
+    ('ndjson',  ('application/x-ndjson', 'ndjson')),
+    ('parquet', ('application/vnd.apache.parquet', 'parquet')), # requires pyarrow
+])
+PARQUET_RECORD_BATCH_SIZE = 10000 # rows per Parquet row group
+PARQUET_MIN_PYARROW_VERSION = (11, 0) # for ParquetWriter.add_key_value_metadata; see `parquet` extra in pyproject.toml
+
+
+def get_output_format(request):
+    '''Returns the validated `format` URI param, defaulting to 'tsv'.'''
+    output_format = request.GET.get('format', 'tsv').lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPBadRequest("Unsupported format \"" + output_format + "\". Use one of: " + ', '.join(OUTPUT_FORMATS))
+    if output_format == 'parquet':
+        try:
+            import pyarrow # noQA - optional dependency, only needed here
+        except ImportError:
+            pyarrow = None
+        if pyarrow is None or tuple(int(v) for v in pyarrow.__version__.split('.')[:2]) < PARQUET_MIN_PYARROW_VERSION:
+            raise HTTPBadRequest("format=parquet is not available on this server.")
+    return output_format
+
+
+def filename_for_output_format(filename, output_format):
+    if filename.endswith('.tsv'):
+        filename = filename[:-4]
+    return filename + '.' + OUTPUT_FORMATS[output_format][1]
+
+
+def gzip_stream(chunks):
+    '''Generator which gzip-compresses an iterable of byte strings, yielding output as soon as compressor emits some.'''
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def ndjson_stream(header, rows, get_summary_lines=None):
+    '''
+    Generator of one JSON object per row, keyed by (stripped) header, as newline-delimited bytes.
+    If given, summary lines are output last as {"summary": [...]}.
+    '''
+    keys = [ column.strip() for column in header ]
+    for row in rows:
+        yield (json.dumps(dict(zip(keys, row))) + '\n').encode('utf-8')
+    if get_summary_lines is not None:
+        yield (json.dumps({ 'summary': get_summary_lines() }) + '\n').encode('utf-8')
+
+
+class ChunkedOutputSink(io.RawIOBase):
+    '''Writable file-like object whose contents are drained piecewise while keeping track of the absolute position.'''
+
     def __init__(self):
-        self._line = None
-    def write(self, line):
-        self._line = line
-    def read(self):
-        return self._line
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        data = bytes(b)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def parquet_stream(header, rows, get_summary_lines=None, batch_size=PARQUET_RECORD_BATCH_SIZE):
+    '''
+    Generator of a Parquet file, with string columns named by (stripped) header, written in row groups of
+    `batch_size` rows. If given, summary lines are stored in the file's key-value metadata under 'summary'.
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    keys = [ column.strip() for column in header ]
+    schema = pa.schema([ pa.field(key, pa.string()) for key in keys ])
+    sink = ChunkedOutputSink()
+    writer = pq.ParquetWriter(sink, schema)
+
+    def write_batch(batch_rows):
+        columns = [ [ None if row[idx] is None else str(row[idx]) for row in batch_rows ] for idx in range(len(keys)) ]
+        writer.write_batch(pa.RecordBatch.from_arrays([ pa.array(column, pa.string()) for column in columns ], schema=schema))
+
+    batch_rows = []
+    for row in rows:
+        batch_rows.append(row)
+        if len(batch_rows) >= batch_size:
+            write_batch(batch_rows)
+            batch_rows = []
+            yield sink.drain()
+    if batch_rows:
+        write_batch(batch_rows)
+    if get_summary_lines is not None:
+        writer.add_key_value_metadata({ 'summary': '\n'.join(get_summary_lines()) })
+    writer.close()
+    yield sink.drain()
 
 
 @view_config(route_name='peak_metadata', request_method='GET')
@@ -225,7 +571,8 @@ def peak_metadata(context, request):
         content_disposition='attachment;filename="%s"' % 'peak_metadata.tsv'
     )
 
-# Local flag. TODO: Just perform some request to this endpoint after bin/pserve as part of deploy script.
+# Local flag. Web workers with warm_up.enabled do a first request at startup too (see warm_up.py), but this is
+# still needed for the processes which don't.
 endpoints_initialized = {
     "metadata" : False
 }
@@ -241,6 +588,8 @@ def metadata_tsv(context, request):
     '''
 
     search_params = request.GET.dict_of_lists() # Must use request.GET to get URI query params only (exclude POST params, etc.)
+    output_format = get_output_format(request)
+    search_params.pop('format', None)
     # If conditions are met (equal number of accession per Item type), will be a list with tuples: (ExpSetAccession, ExpAccession, FileAccession)
     accession_triples = None
     filename_to_suggest = None
@@ -258,58 +607,19 @@ def metadata_tsv(context, request):
         else: # List of dicts { 'accession', 'experiments_in_set.accession', ... } --- DEPRECATED
             accession_triples = [ (acc_dict.get('accession', 'NONE'), acc_dict.get('experiments_in_set.accession', 'NONE'), acc_dict.get('experiments_in_set.files.accession', 'NONE') ) for acc_dict in post_body['accession_triples'] ]
     filename_to_suggest = post_body.get('download_file_name', None)
+    accession_triple_index = AccessionTripleIndex(accession_triples) if accession_triples is not None else None
 
     if 'referrer' in search_params:
         search_path = '/{}/'.format(search_params.pop('referrer')[0])
     else:
         search_path = '/search/'
-    search_params['field'] = []
     search_params['sort'] = ['accession']
     search_params['type'] = search_params.get('type', ['ExperimentSetReplicate'])[0]
-    header = []
-
-    def add_field_to_search_params(itemType, field):
-        if search_params['type'][0:13] == 'ExperimentSet':
-            if itemType == EXP_SET:
-                search_params['field'].append(param_field)
-            elif itemType == EXP:
-                search_params['field'].append('experiments_in_set.' + param_field)
-            elif itemType == FILE:
-                search_params['field'].append('experiments_in_set.files.' + param_field)
-                search_params['field'].append('experiments_in_set.processed_files.' + param_field)
-                search_params['field'].append('experiments_in_set.other_processed_files.files.' + param_field)
-                search_params['field'].append('processed_files.' + param_field)
-                search_params['field'].append('other_processed_files.files.' + param_field)
-        elif search_params['type'][0:4] == 'File' and search_params['type'][4:7] != 'Set':
-            if itemType == EXP_SET:
-                search_params['field'].append('experiment_set.' + param_field)
-            elif itemType == EXP:
-                search_params['field'].append('experiment.' + param_field)
-            elif itemType == FILE or itemType == FILE_ONLY:
-                search_params['field'].append(param_field)
-        else:
-            raise HTTPBadRequest("Metadata can only be retrieved currently for Experiment Sets or Files. Received \"" + search_params['type'] + "\"")
-
-    for prop in TSV_MAPPING:
-        if search_params['type'][0:4] == 'File' and search_params['type'][4:7] != 'Set':
-            if TSV_MAPPING[prop][0] == FILE or TSV_MAPPING[prop][0] == FILE_ONLY:
-                header.append(prop)
-        elif TSV_MAPPING[prop][0] != FILE_ONLY:
-            header.append(prop)
-        for param_field in TSV_MAPPING[prop][1]:
-            add_field_to_search_params(TSV_MAPPING[prop][0], param_field)
-    for itemType in EXTRA_FIELDS:
-        for param_field in EXTRA_FIELDS[itemType]:
-            add_field_to_search_params(itemType, param_field)
-
-    # Ensure we send accessions to ES to help narrow initial result down.
-    # If too many accessions to include in /search/ URL (exceeds 2048 characters, aka accessions for roughly 20 files), we'll fetch search query as-is and then filter/narrow down.
-    #if accession_triples and len(accession_triples) < 20:
-    #    search_params['accession'] = [ triple[0] for triple in accession_triples ]
-    #    search_params['experiments_in_set.accession'] = [ triple[1] for triple in accession_triples ]
-    #    search_params['experiments_in_set.files.accession'] = [ triple[2] for triple in accession_triples ]
-
+    header, search_params['field'] = get_metadata_header_and_fields(search_params['type'])
 
+    # Send accessions to ES as filters (in request body rather than URL) to narrow initial result down.
+    # Rows are still matched against accession_triple_index exactly, below.
+    accession_filters = get_accession_triple_filters(accession_triples, search_params['type']) if accession_triples else None
 
     file_cache = {} # Exclude URLs of prev-encountered file(s).
     summary = {
@@ -330,33 +640,12 @@ def metadata_tsv(context, request):
     if filename_to_suggest is None:
         filename_to_suggest = 'metadata_' + datetime.utcnow().strftime('%Y-%m-%d-%Hh-%Mm') + '.tsv'
 
-    def get_values_for_field(item, field, remove_duplicates=True):
-        c_value = []
-
-        if remove_duplicates:
-            for value in simple_path_ids(item, field):
-                if str(value) not in c_value:
-                    c_value.append(str(value))
-            return list(set(c_value))
-        else:
-            for value in simple_path_ids(item, field):
-                c_value.append(str(value))
-            return c_value  
-
-    def get_value_for_column(item, col):
-        temp = []
-        for c in TSV_MAPPING[col][1]:
-            c_value = get_values_for_field(item, c, TSV_MAPPING[col][2])
-            if len(temp):
-                if len(c_value):
-                    temp = [x + ' ' + c_value[0] for x in temp]
-            else:
-                temp = c_value
-
-        if TSV_MAPPING[col][2]:   
-            return ', '.join(list(set(temp)))
-        else:
-            return ', '.join(temp)    
+    # Column plan, compiled once per request.
+    exp_set_extractor = ColumnExtractor([ col for col in header if TSV_MAPPING[col][0] == EXP_SET ])
+    exp_extractor = ColumnExtractor([ col for col in header if TSV_MAPPING[col][0] == EXP ])
+    file_extractor = ColumnExtractor([ col for col in header if TSV_MAPPING[col][0] == FILE or TSV_MAPPING[col][0] == FILE_ONLY ])
+    exp_col_names = [ k for k,v in TSV_MAPPING.items() if v[0] == EXP ]
+    all_exps_extractor = ColumnExtractor(exp_col_names, path_prefix='experiments_in_set.') # for processed files of ExpSet
 
     def get_correct_rep_no(column_name, column_vals_dict, experiment_set):
         '''Find which Replicate Exp our File Row Object belongs to, and return its replicate number.'''
@@ -386,27 +675,24 @@ def metadata_tsv(context, request):
         if accession_triples is None:
             return True
 
-        for set_accession, exp_accession, file_accession in accession_triples:
-            if (
-                (('Experiment Set Accession' in column_vals_dict and set_accession == column_vals_dict['Experiment Set Accession']) or set_accession == 'NONE') and
-                (('Experiment Accession' in column_vals_dict and exp_accession == column_vals_dict['Experiment Accession']) or exp_accession == 'NONE') and
-                (file_accession == column_vals_dict['File Accession'] or column_vals_dict['Related File Relationship'] == 'reference file for' or file_accession == 'NONE')
-            ):
-                # if the file is a raw file (actually if classification is not processed file, then we assume it as a raw file),
-                # then add the related exp to the exp_raw_file_cache dict. to check 
-                # whether to include exp's ref files since we will include ref files if at least one raw file
-                # is selected for download.
-                if exp_accession and len(column_vals_dict['File Classification']) > 0 and column_vals_dict['File Classification'] != 'processed file':
-                    exp_raw_file_cache[exp_accession] = True
-                
-                # include ref files if at least one raw file of the parent experiment is already selected for downloads, else discard it
-                if exp_accession and column_vals_dict['Related File Relationship'] == 'reference file for':
-                    if exp_accession not in exp_raw_file_cache:
-                        return False
- 
-                return True
-        
-        return False
+        matching_triple = accession_triple_index.first_match(column_vals_dict)
+        if matching_triple is None:
+            return False
+
+        set_accession, exp_accession, file_accession = matching_triple
+        # if the file is a raw file (actually if classification is not processed file, then we assume it as a raw file),
+        # then add the related exp to the exp_raw_file_cache dict. to check
+        # whether to include exp's ref files since we will include ref files if at least one raw file
+        # is selected for download.
+        if exp_accession and len(column_vals_dict['File Classification']) > 0 and column_vals_dict['File Classification'] != 'processed file':
+            exp_raw_file_cache[exp_accession] = True
+
+        # include ref files if at least one raw file of the parent experiment is already selected for downloads, else discard it
+        if exp_accession and column_vals_dict['Related File Relationship'] == 'reference file for':
+            if exp_accession not in exp_raw_file_cache:
+                return False
+
+        return True
 
     def flatten_other_processed_files(other_processed_files):
         flat_list = []
@@ -420,10 +706,7 @@ def metadata_tsv(context, request):
         :param exp_set: A dictionary representation of ExperimentSet as received from /search/ results.
         :returns Iterable of dictionaries which represent File item rows, with column headers as keys.
         '''
-        exp_set_row_vals = {}
-        exp_set_cols = [ col for col in header if TSV_MAPPING[col][0] == EXP_SET ]
-        for column in exp_set_cols:
-            exp_set_row_vals[column] = get_value_for_column(exp_set, column)
+        exp_set_row_vals = exp_set_extractor.extract(exp_set)
 
         def sort_files_from_expset_by_replicate_numbers(file_dict):
             try:
@@ -456,10 +739,7 @@ def metadata_tsv(context, request):
         '''
         :returns Iterable of dictionaries which represent File item rows, with column headers as keys.
         '''
-        exp_row_vals = {}
-        exp_cols = [ col for col in header if TSV_MAPPING[col][0] == EXP ]
-        for column in exp_cols:
-            exp_row_vals[column] = get_value_for_column(exp, column)
+        exp_row_vals = exp_extractor.extract(exp)
 
         return chain(
             chain.from_iterable(
@@ -484,10 +764,7 @@ def metadata_tsv(context, request):
         '''
         files_returned = [] # Function output
         f['href'] = request.host_url + f.get('href', '')
-        f_row_vals = {}
-        file_cols = [ col for col in header if TSV_MAPPING[col][0] == FILE or TSV_MAPPING[col][0] == FILE_ONLY ]
-        for column in file_cols:
-            f_row_vals[column] = get_value_for_column(f, column)
+        f_row_vals = file_extractor.extract(f)
 
         all_row_vals = dict(exp_set_row_vals, **dict(exp_row_vals, **f_row_vals)) # Combine data from ExpSet, Exp, and File
         
@@ -495,20 +772,20 @@ def metadata_tsv(context, request):
         #
         # IMPORTANT: since we add the Supplementary Files download option in Exp Set, users can download reference files directly.
         # So directly downloaded reference files should not be considered as 'reference file for' of an experiment)
-        if not any(triple[2] == f.get('accession', '') for triple in accession_triples) and 'reference_file_for' in f:
+        directly_selected = accession_triple_index is not None and accession_triple_index.has_file_accession(f.get('accession', ''))
+        if not directly_selected and 'reference_file_for' in f:
             all_row_vals['Related File Relationship'] = 'reference file for'
             all_row_vals['Related File'] = 'Experiment - ' + f.get('reference_file_for', '')
         if not all_row_vals.get('File Classification'):
             all_row_vals['File Classification'] = f.get('file_classification', '')
 
         # If no EXP properties, likely is processed file from an ExpSet, so show all Exps' values.
-        exp_col_names = [ k for k,v in TSV_MAPPING.items() if v[0] == EXP ]
+        all_exps_row_vals = None
         for column in exp_col_names:
             if all_row_vals.get(column) is None or ('Accession' in column and all_row_vals.get(column) == 'NONE'):
-                vals = []
-                for field in TSV_MAPPING[column][1]:
-                    vals.append(', '.join(get_values_for_field(exp_set, 'experiments_in_set.' + field)))
-                all_row_vals[column] = ', '.join(vals)
+                if all_exps_row_vals is None:
+                    all_exps_row_vals = all_exps_extractor.extract_joined_per_field(exp_set)
+                all_row_vals[column] = all_exps_row_vals[column]
 
         # Add Bio & Tech Rep Nos re: all_row_vals['Experiment Accession']
         all_row_vals['Tech Rep No'] = get_correct_rep_no('Tech Rep No', all_row_vals, exp_set)
@@ -641,25 +918,40 @@ def metadata_tsv(context, request):
         Generator which converts file-metatada dictionaries into a TSV stream.
         :param file_row_dictionaries: Iterable of dictionaries, each containing TSV_MAPPING keys and values from a file in ExperimentSet.
         '''
-        line = DummyFileInterfaceImplementation()
-        writer = csv.writer(line, delimiter='\t')
+        out = BufferedChunkWriter()
+        writer = csv.writer(out, delimiter='\t')
 
-        # Initial 2 lines: Intro, Headers
+        # Initial 2 lines: Intro, Headers. Sent right away so that download starts.
         writer.writerow([
             '###', 'N.B.: File summary located at bottom of TSV file.', '', '', '', '',
             'Suggested command to download: ', '', '', 'cut -f 1 ./{} | tail -n +3 | grep -v ^# | xargs -n 1 curl -O -L --user <access_key_id>:<access_key_secret>'.format(filename_to_suggest)
         ])
-        yield line.read().encode('utf-8')
         writer.writerow([column.strip() for column in header])
-        yield line.read().encode('utf-8')
+        yield out.pop_chunk(force=True)
 
         for file_row_dict in file_row_dictionaries:
             writer.writerow([ file_row_dict.get(column) or 'N/A' for column in header ])
-            yield line.read().encode('utf-8')
+            chunk = out.pop_chunk()
+            if chunk is not None:
+                yield chunk
 
         for summary_line in generate_summary_lines():
             writer.writerow(summary_line)
-            yield line.read().encode('utf-8')
+        yield out.pop_chunk(force=True)
+
+    def get_summary_text_lines():
+        '''Summary lines without the leading '###' and padding cells, for non-TSV formats.'''
+        return [ '\t'.join(summary_line[1:]).strip() for summary_line in generate_summary_lines() ]
+
+    def stream_output(file_row_dictionaries):
+        if output_format == 'tsv':
+            return stream_tsv_output(file_row_dictionaries)
+        if output_format == 'tsv.gz':
+            return gzip_stream(stream_tsv_output(file_row_dictionaries))
+        rows = ( [ file_row_dict.get(column) for column in header ] for file_row_dict in file_row_dictionaries )
+        if output_format == 'ndjson':
+            return ndjson_stream(header, rows, get_summary_text_lines)
+        return parquet_stream(header, rows, get_summary_text_lines)
 
     if not endpoints_initialized['metadata']: # For some reason first result after bootup returns empty, so we do once extra for first request.
         initial_path = '{}?{}'.format(search_path, urlencode(dict(search_params, limit=10), True))
@@ -672,7 +964,7 @@ def metadata_tsv(context, request):
             chain.from_iterable(
                 map(
                     format_experiment_set,
-                    get_iterable_search_results(request, search_path, search_params)
+                    get_iterable_search_results(request, search_path, search_params, extra_filters=accession_filters)
                 )
             )
         )
@@ -681,7 +973,7 @@ def metadata_tsv(context, request):
             chain.from_iterable(
                 map(
                     lambda f: format_file(f, {}, {}, {}, {}),
-                    get_iterable_search_results(request, search_path, search_params)
+                    get_iterable_search_results(request, search_path, search_params, extra_filters=accession_filters)
                 )
             )
         )
@@ -689,9 +981,9 @@ def metadata_tsv(context, request):
         raise HTTPBadRequest("Metadata can only be retrieved currently for Experiment Sets or Files. Received \"" + search_params['type'] + "\"")
 
     return Response(
-        content_type='text/tsv',
-        app_iter = stream_tsv_output(iterable_pipeline),
-        content_disposition='attachment;filename="%s"' % filename_to_suggest
+        content_type=OUTPUT_FORMATS[output_format][0],
+        app_iter = stream_output(iterable_pipeline),
+        content_disposition='attachment;filename="%s"' % filename_for_output_format(filename_to_suggest, output_format)
     )
 
 
@@ -706,36 +998,43 @@ def redirect_new_metadata_route(context, request):
 @view_config(route_name='batch_download', request_method='GET')
 @debug_log
 def batch_download(context, request):
+    '''
+    Streams a list of the download URLs of files of search results, paging through results with only
+    `files.href` and `files.file_type` fetched, rather than embedding all of them at once.
+    Output is gzip-compressed with `format=txt.gz`.
+    '''
+    output_format = request.GET.get('format', 'txt')
+    if output_format not in ('txt', 'txt.gz'):
+        raise HTTPBadRequest("Unsupported format \"" + output_format + "\". Use one of: txt, txt.gz")
     # adding extra params to get required columns
     param_list = parse_qs(request.matchdict['search_params'])
+    param_list.pop('format', None)
+    file_types = param_list.get('files.file_type')
     param_list['field'] = ['files.href', 'files.file_type']
-    param_list['limit'] = ['all']
-    path = '/search/?%s' % urlencode(param_list, True)
-    results = request.embed(path, as_user=True)
     metadata_link = '{host_url}/metadata/{search_params}/metadata.tsv'.format(
         host_url=request.host_url,
         search_params=request.matchdict['search_params']
     )
-    files = [metadata_link]
-    if 'files.file_type' in param_list:
-        for exp in results['@graph']:
-            for f in exp['files']:
-                if f['file_type'] in param_list['files.file_type']:
-                    files.append('{host_url}{href}'.format(
-                        host_url=request.host_url,
-                        href=f['href']
-                    ))
-    else:
-        for exp in results['@graph']:
-            for f in exp['files']:
-                files.append('{host_url}{href}'.format(
-                    host_url=request.host_url,
-                    href=f['href']
-                ))
+
+    def generate_lines():
+        out = BufferedChunkWriter()
+        out.write(metadata_link)
+        yield out.pop_chunk(force=True)
+        for exp in get_iterable_search_results(request, '/search/', param_list):
+            for f in exp.get('files', []):
+                if file_types is None or f.get('file_type') in file_types:
+                    out.write('\n{host_url}{href}'.format(host_url=request.host_url, href=f['href']))
+            chunk = out.pop_chunk()
+            if chunk is not None:
+                yield chunk
+        chunk = out.pop_chunk(force=True)
+        if chunk is not None:
+            yield chunk
+
     return Response(
-        content_type='text/plain',
-        body='\n'.join(files),
-        content_disposition='attachment; filename="%s"' % 'files.txt'
+        content_type='application/gzip' if output_format == 'txt.gz' else 'text/plain',
+        app_iter=gzip_stream(generate_lines()) if output_format == 'txt.gz' else generate_lines(),
+        content_disposition='attachment; filename="%s"' % ('files.txt.gz' if output_format == 'txt.gz' else 'files.txt')
     )
 
 
@@ -764,8 +1063,8 @@ def lookup_column_value(value, path):
 
 
 def format_row(columns):
-    """Format a list of text columns as a tab-separated byte string."""
-    return b'\t'.join([bytes_(c, 'utf-8') for c in columns]) + b'\r\n'
+    """Format a list of text columns as a tab-separated line (encoded by BufferedChunkWriter)."""
+    return '\t'.join(columns) + '\r\n'
 
 
 @view_config(route_name='report_download', request_method='GET')
@@ -776,22 +1075,43 @@ def report_download(context, request):
         msg = 'Report view requires specifying a single type.'
         raise HTTPBadRequest(explanation=msg)
     the_type = types[0]
+    output_format = get_output_format(request)
 
     # Make sure we get all results
     request.GET['limit'] = 'all'
 
-    the_schema = [request.registry[TYPES][the_type.schema]]
+    the_schema = [request.registry[TYPES][the_type].schema]
     columns = build_table_columns(request, the_schema, [the_type])
     header = [column.get('title') or field for field, column in columns.items()]
 
-    def generate_rows():
-        yield format_row(header)
+    def generate_values():
         for item in iter_search_results(context, request):
-            values = [lookup_column_value(item, path) for path in columns]
-            yield format_row(values)
+            yield [lookup_column_value(item, path) for path in columns]
+
+    def generate_rows():
+        out = BufferedChunkWriter()
+        out.write(format_row(header))
+        yield out.pop_chunk(force=True)
+        for values in generate_values():
+            out.write(format_row(values))
+            chunk = out.pop_chunk()
+            if chunk is not None:
+                yield chunk
+        chunk = out.pop_chunk(force=True)
+        if chunk is not None:
+            yield chunk
+
+    if output_format == 'tsv':
+        app_iter = generate_rows()
+    elif output_format == 'tsv.gz':
+        app_iter = gzip_stream(generate_rows())
+    elif output_format == 'ndjson':
+        app_iter = ndjson_stream(header, generate_values())
+    else:
+        app_iter = parquet_stream(header, generate_values())
 
     # Stream response using chunked encoding.
-    request.response.content_type = 'text/tsv'
-    request.response.content_disposition = 'attachment;filename="%s"' % 'report.tsv'
-    request.response.app_iter = generate_rows()
+    request.response.content_type = OUTPUT_FORMATS[output_format][0]
+    request.response.content_disposition = 'attachment;filename="%s"' % filename_for_output_format('report.tsv', output_format)
+    request.response.app_iter = app_iter
     return request.response
@@ -0,0 +1,116 @@
+"""\
+Record in `open_data_location` of released and archived files whether (and under which folder) they were
+transferred to the Open Data bucket, from a listing of that bucket. The `open_data_url` calculated property
+of files is computed from it, so this should be run after each transfer to the Open Data bucket.
+
+Examples
+
+To update on the production server:
+
+    %(prog)s production.ini
+
+For the development.ini you must supply the paster app name:
+
+    %(prog)s development.ini --app-name app
+
+"""
+
+import argparse
+import boto3
+import logging
+
+from collections import defaultdict
+from .add_date_created import internal_app
+from ..types.file import OPEN_DATA_BUCKET, OPEN_DATA_KEY_PREFIX, OPEN_DATA_LOCATIONS
+
+
+EPILOG = __doc__
+
+logger = logging.getLogger(__name__)
+
+OPEN_DATA_STATUSES = ('released', 'archived')
+
+
+def list_open_data_files(client, bucket=OPEN_DATA_BUCKET, key_prefix=OPEN_DATA_KEY_PREFIX,
+                         locations=OPEN_DATA_LOCATIONS):
+    """
+    Lists the Open Data bucket with ListObjectsV2 (1000 keys per request), returning
+    {uuid: {location: set of filenames}} for keys of the form <key_prefix>/<location>/<uuid>/<filename>.
+    """
+    open_data_files = defaultdict(lambda: defaultdict(set))
+    paginator = client.get_paginator('list_objects_v2')
+    for location in locations:
+        prefix = '{}/{}/'.format(key_prefix, location)
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', ()):
+                uuid, _, filename = obj['Key'][len(prefix):].partition('/')
+                if uuid and filename:
+                    open_data_files[uuid][location].add(filename)
+    return open_data_files
+
+
+def get_open_data_location(open_data_files, uuid, filename, locations=OPEN_DATA_LOCATIONS):
+    """ Returns the first of `locations` holding `filename` for the file with `uuid`, or None """
+    file_locations = open_data_files.get(uuid, {})
+    for location in locations:
+        if filename in file_locations.get(location, ()):
+            return location
+    return None
+
+
+def run(testapp, open_data_files, dry_run=False):
+    root = testapp.app.root_factory(testapp.app)
+    extensions = {}  # file format uuid -> standard file extension
+    count = 0
+    errors = 0
+    for uuid in root['file']:
+        item = root.get_by_uuid(uuid)
+        properties = item.properties
+        if properties.get('status') not in OPEN_DATA_STATUSES:
+            continue
+        file_format = properties.get('file_format')
+        if file_format not in extensions:
+            extensions[file_format] = root.get_by_uuid(file_format).properties.get('standard_file_extension', '')
+        filename = '{}.{}'.format(properties.get('accession'), extensions[file_format])
+        location = get_open_data_location(open_data_files, str(uuid), filename)
+        if location == properties.get('open_data_location'):
+            continue
+        path = '/{}/'.format(uuid)
+        logger.info('Setting open_data_location of %s to %s', path, location)
+        count += 1
+        if dry_run:
+            continue
+        try:
+            if location is None:
+                testapp.patch_json(path + '?delete_fields=open_data_location', {})
+            else:
+                testapp.patch_json(path, {'open_data_location': location})
+        except Exception:
+            logger.exception('Failed to set open_data_location of %s', path)
+            errors += 1
+    logger.info('Updated open_data_location of %d files (errors: %d)', count, errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(  # noqa - PyCharm wrongly thinks the formatter_class is invalid
+        description="Record Open Data locations of files", epilog=EPILOG,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--bucket', default=OPEN_DATA_BUCKET, help="Open Data bucket")
+    parser.add_argument('--app-name', help="Pyramid app name in configfile")
+    parser.add_argument(
+        '--dry-run', action='store_true', help="Don't patch files, just print")
+    parser.add_argument('config_uri', help="path to configfile")
+    args = parser.parse_args()
+
+    logging.basicConfig()
+    testapp = internal_app(args.config_uri, args.app_name)
+
+    # Loading app will have configured from config file. Reconfigure here:
+    logging.getLogger('encoded').setLevel(logging.DEBUG)
+    open_data_files = list_open_data_files(boto3.client('s3'), bucket=args.bucket)
+    run(testapp, open_data_files, args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,478 @@
+"""
+Asynchronous export jobs for large /metadata/ and /report.tsv downloads.
+
+Instead of holding a WSGI worker for the whole export, a client POSTs the same query (and, for /metadata/, the same
+`accession_triples` and `download_file_name`, as JSON) to /export-jobs/metadata/ or /export-jobs/report/ and gets
+back a job. A background thread runs the regular endpoint in a request of its own (as the same user) and writes its
+streamed output to a blob: an S3 object in `export_jobs.bucket`, or a file under `export_jobs.directory`, which
+defaults to a temporary directory in development and tests only, as it is local to the host. The client polls
+/export-jobs/{type}/{job_id}/ for progress and, once done, the download link.
+
+Job status is stored alongside the output, so that any process can report it. While a job is queued or running, its
+process records a heartbeat in its status; a job whose heartbeat stopped (e.g. its process was recycled) is reported
+as failed. Jobs expire, and their status and output are deleted, `export_jobs.retention` seconds after creation.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pyramid.events import ApplicationCreated, subscriber
+from pyramid.httpexceptions import HTTPBadRequest, HTTPNotFound, HTTPNotImplemented, HTTPTemporaryRedirect
+from pyramid.response import FileIter, Response
+from pyramid.settings import asbool
+from pyramid.view import view_config
+from snovault.util import debug_log
+from .aws_clients import get_aws_client
+
+import structlog
+
+
+log = structlog.getLogger(__name__)
+
+
+EXPORT_JOB_APP = 'encoded.export_job_app'  # registry key
+EXPORT_JOB_EXECUTOR = 'encoded.export_job_executor'  # registry key
+EXPORT_JOB_STORAGE = 'encoded.export_job_storage'  # registry key
+EXPORT_JOB_TRACKER = 'encoded.export_job_tracker'  # registry key
+
+# export type -> path of the endpoint which is run
+EXPORT_JOB_PATHS = {
+    'metadata': '/metadata/',
+    'report': '/report.tsv',
+}
+DEFAULT_EXPORT_JOB_MAX_WORKERS = 2
+EXPORT_JOB_PROGRESS_INTERVAL = 5  # seconds between two progress updates of job status
+EXPORT_JOB_DOWNLOAD_EXPIRATION = 24 * 60 * 60  # seconds, for presigned S3 URLs
+EXPORT_JOB_HEARTBEAT_INTERVAL = 60  # seconds between two heartbeats of queued and running jobs
+EXPORT_JOB_STALE_AFTER = 5 * EXPORT_JOB_HEARTBEAT_INTERVAL  # seconds without heartbeat after which a job has failed
+EXPORT_JOB_CLEANUP_INTERVAL = 60 * 60  # seconds between two deletions of expired jobs, per process
+DEFAULT_EXPORT_JOB_RETENTION = 7 * 24 * 60 * 60  # seconds
+
+ACTIVE_EXPORT_JOB_STATUSES = ('queued', 'running')
+
+
+def includeme(config):
+    config.add_route('export_job_create', '/export-jobs/{export_type}/')
+    config.add_route('export_job_status', '/export-jobs/{export_type}/{job_id}/')
+    config.add_route('export_job_download', '/export-jobs/{export_type}/{job_id}/download')
+    config.scan(__name__)
+    if not export_job_storage_is_configured(config.registry.settings):
+        log.error('Export jobs are disabled: export_jobs.bucket is not set')
+
+
+@subscriber(ApplicationCreated)
+def register_export_job_app(event):
+    """ Export jobs run their requests against the app itself, as they outlive the request creating them """
+    event.app.registry[EXPORT_JOB_APP] = event.app
+
+
+class LocalExportStorage(object):
+    """ Stores job status and output as files under `directory`; stand-in for S3 in local development """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, job_id, name):
+        return os.path.join(self.directory, job_id, name)
+
+    def write_status(self, job):
+        os.makedirs(os.path.join(self.directory, job['job_id']), exist_ok=True)
+        temp_path = self.path(job['job_id'], 'status.json.tmp')
+        with open(temp_path, 'w') as status_file:
+            json.dump(job, status_file)
+        os.replace(temp_path, self.path(job['job_id'], 'status.json'))
+
+    def read_status(self, job_id):
+        try:
+            with open(self.path(job_id, 'status.json')) as status_file:
+                return json.load(status_file)
+        except FileNotFoundError:
+            return None
+
+    def open_output(self, job_id):
+        os.makedirs(os.path.join(self.directory, job_id), exist_ok=True)
+        return open(self.path(job_id, 'output'), 'wb')
+
+    def finish_output(self, job_id, output):
+        output.close()
+
+    def download_response(self, request, job):
+        return Response(
+            content_type=job['content_type'],
+            app_iter=FileIter(open(self.path(job['job_id'], 'output'), 'rb')),
+            content_disposition=job['content_disposition']
+        )
+
+    def delete_expired(self, max_age):
+        """ Deletes status and output of jobs last written more than `max_age` seconds ago """
+        try:
+            job_ids = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        cutoff = time.time() - max_age
+        for job_id in job_ids:
+            job_directory = os.path.join(self.directory, job_id)
+            try:
+                last_written = max(os.path.getmtime(os.path.join(job_directory, name))
+                                   for name in os.listdir(job_directory) + ['.'])
+            except FileNotFoundError:
+                continue
+            if last_written < cutoff:
+                shutil.rmtree(job_directory, ignore_errors=True)
+
+
+class S3ExportStorage(object):
+    """ Stores job status and output as objects under `<job_id>/` in an S3 bucket """
+
+    def __init__(self, bucket, client=None):
+        self.bucket = bucket
+        if client is None:
+            import boto3
+            client = boto3.client('s3')
+        self.client = client
+
+    def write_status(self, job):
+        self.client.put_object(Bucket=self.bucket, Key=job['job_id'] + '/status.json',
+                               Body=json.dumps(job).encode('utf-8'), ContentType='application/json')
+
+    def read_status(self, job_id):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=job_id + '/status.json')
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return json.loads(response['Body'].read())
+
+    def open_output(self, job_id):
+        return tempfile.TemporaryFile()
+
+    def finish_output(self, job_id, output):
+        output.seek(0)
+        self.client.upload_fileobj(output, self.bucket, job_id + '/output')
+        output.close()
+
+    def download_response(self, request, job):
+        location = self.client.generate_presigned_url(
+            ClientMethod='get_object',
+            Params={
+                'Bucket': self.bucket,
+                'Key': job['job_id'] + '/output',
+                'ResponseContentType': job['content_type'],
+                'ResponseContentDisposition': job['content_disposition']
+            },
+            ExpiresIn=EXPORT_JOB_DOWNLOAD_EXPIRATION
+        )
+        return HTTPTemporaryRedirect(location=location)
+
+    def delete_expired(self, max_age):
+        """ Deletes objects (status and output of jobs) last written more than `max_age` seconds ago """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+        keys = []
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket):
+            keys.extend(obj['Key'] for obj in page.get('Contents', ()) if obj['LastModified'] < cutoff)
+        for start in range(0, len(keys), 1000):  # at most 1000 keys per DeleteObjects request
+            self.client.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': key} for key in keys[start:start + 1000]], 'Quiet': True
+            })
+
+
+def export_job_storage_is_configured(settings):
+    """ Local storage is per host, so it must be asked for explicitly outside of development and tests """
+    return bool(settings.get('export_jobs.bucket') or settings.get('export_jobs.directory')
+                or asbool(settings.get('testing', False)))
+
+
+def get_export_job_storage(registry):
+    storage = registry.get(EXPORT_JOB_STORAGE)
+    if storage is None:
+        settings = registry.settings
+        if not export_job_storage_is_configured(settings):
+            raise HTTPNotImplemented('Export jobs are not available on this server.')
+        bucket = settings.get('export_jobs.bucket')
+        if bucket:
+            storage = S3ExportStorage(bucket, client=get_aws_client(registry, 's3'))
+        else:
+            directory = settings.get('export_jobs.directory',
+                                     os.path.join(tempfile.gettempdir(), 'fourfront-export-jobs'))
+            storage = LocalExportStorage(directory)
+        storage = registry.setdefault(EXPORT_JOB_STORAGE, storage)
+    return storage
+
+
+def get_export_job_retention(registry):
+    return int(registry.settings.get('export_jobs.retention', DEFAULT_EXPORT_JOB_RETENTION))
+
+
+class ExportJobTracker(object):
+    """
+    Writes status of the jobs of this process, with a heartbeat. A daemon thread renews the heartbeat of queued
+    and running jobs every `heartbeat_interval` seconds, and deletes expired jobs every `cleanup_interval` seconds.
+    """
+
+    def __init__(self, storage, retention=DEFAULT_EXPORT_JOB_RETENTION,
+                 heartbeat_interval=EXPORT_JOB_HEARTBEAT_INTERVAL, cleanup_interval=EXPORT_JOB_CLEANUP_INTERVAL):
+        self.storage = storage
+        self.retention = retention
+        self.heartbeat_interval = heartbeat_interval
+        self.cleanup_interval = cleanup_interval
+        self.active_jobs = {}  # job_id -> job, for queued and running jobs
+        self._lock = threading.Lock()  # serializes status writes of a job by its worker and the heartbeat thread
+        self._thread = None
+
+    def write_status(self, job):
+        with self._lock:
+            self._write_status(job)
+            if job['status'] in ACTIVE_EXPORT_JOB_STATUSES:
+                self.active_jobs[job['job_id']] = job
+            else:
+                self.active_jobs.pop(job['job_id'], None)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name='export-job-heartbeat', daemon=True)
+                self._thread.start()
+
+    def _write_status(self, job):
+        job['heartbeat'] = now_isoformat()
+        self.storage.write_status(dict(job))  # a copy, as the worker of the job may add keys meanwhile
+
+    def beat(self):
+        with self._lock:
+            for job in list(self.active_jobs.values()):
+                try:
+                    self._write_status(job)
+                except Exception as exc:
+                    log.error('Export job heartbeat failed', job_id=job['job_id'], error=str(exc))
+
+    def run(self):
+        last_cleanup = None
+        while True:
+            if last_cleanup is None or time.monotonic() - last_cleanup >= self.cleanup_interval:
+                try:
+                    self.storage.delete_expired(self.retention)
+                except Exception as exc:
+                    log.error('Deleting expired export jobs failed', error=str(exc))
+                last_cleanup = time.monotonic()
+            time.sleep(self.heartbeat_interval)
+            self.beat()
+
+
+_tracker_lock = threading.Lock()
+
+
+def get_export_job_tracker(registry):
+    with _tracker_lock:
+        tracker = registry.get(EXPORT_JOB_TRACKER)
+        if tracker is None:
+            tracker = registry[EXPORT_JOB_TRACKER] = ExportJobTracker(get_export_job_storage(registry),
+                                                                      retention=get_export_job_retention(registry))
+    return tracker
+
+
+_executor_lock = threading.Lock()
+
+
+def get_export_job_executor(registry):
+    """ Thread pool running export jobs; size is configured with `export_jobs.max_workers` """
+    with _executor_lock:
+        executor = registry.get(EXPORT_JOB_EXECUTOR)
+        if executor is None:
+            max_workers = int(registry.settings.get('export_jobs.max_workers', DEFAULT_EXPORT_JOB_MAX_WORKERS))
+            executor = registry[EXPORT_JOB_EXECUTOR] = ThreadPoolExecutor(max_workers=max_workers,
+                                                                          thread_name_prefix='export-job')
+    return executor
+
+
+def now_isoformat():
+    return datetime.utcnow().isoformat() + '+00:00'
+
+
+def seconds_since(isoformat):
+    return (datetime.now(timezone.utc) - datetime.fromisoformat(isoformat)).total_seconds()
+
+
+def check_export_job(storage, job, retention=DEFAULT_EXPORT_JOB_RETENTION, stale_after=EXPORT_JOB_STALE_AFTER):
+    """
+    Returns `job`, marked as failed (in storage too) if it is queued or running but its heartbeat stopped,
+    or None if it has expired.
+    """
+    if seconds_since(job['created']) > retention:
+        return None
+    heartbeat = job.get('heartbeat', job['created'])
+    if job['status'] in ACTIVE_EXPORT_JOB_STATUSES and seconds_since(heartbeat) > stale_after:
+        job.update(status='failed', error='Export job stopped, as the server process running it went away.',
+                   updated=now_isoformat())
+        storage.write_status(job)
+    return job
+
+
+def run_export_job(tracker, job, get_response, progress_interval=EXPORT_JOB_PROGRESS_INTERVAL):
+    """
+    Writes the streamed body of the response returned by `get_response` to the job's output,
+    updating job status (through `tracker`) as it goes.
+    """
+    storage = tracker.storage
+    job.update(status='running', started=now_isoformat())
+    tracker.write_status(job)
+    output = None
+    try:
+        response = get_response()
+        if response.status_int >= 400:
+            raise Exception('Export request failed with status %s: %s' % (response.status, response.text[:1000]))
+        job.update(content_type=response.content_type,
+                   content_disposition=response.headers.get('Content-Disposition', 'attachment'))
+        output = storage.open_output(job['job_id'])
+        last_update = time.monotonic()
+        try:
+            for chunk in response.app_iter:
+                output.write(chunk)
+                job['bytes_written'] += len(chunk)
+                if time.monotonic() - last_update >= progress_interval:
+                    job['updated'] = now_isoformat()
+                    tracker.write_status(job)
+                    last_update = time.monotonic()
+        finally:
+            if hasattr(response.app_iter, 'close'):
+                response.app_iter.close()
+        storage.finish_output(job['job_id'], output)
+    except Exception as exc:
+        log.error('Export job failed', job_id=job['job_id'], error=str(exc))
+        if output is not None and not output.closed:
+            output.close()
+        job.update(status='failed', error=str(exc), updated=now_isoformat())
+        tracker.write_status(job)
+        return job
+    job.update(status='done', updated=now_isoformat(), finished=now_isoformat())
+    tracker.write_status(job)
+    return job
+
+
+def get_export_job_owner(request):
+    """
+    Owner of the jobs created by `request`: the `userid.<uuid>` principal of its user, whichever way they authenticated
+    (e.g. JWT or access key), else its authenticated userid, e.g. `remoteuser.TEST`; None if anonymous.
+    """
+    userid = request.authenticated_userid
+    if userid is None:
+        return None
+    for principal in request.effective_principals:
+        if principal.startswith('userid.'):
+            return principal
+    return userid
+
+
+def get_export_remote_user(request):
+    """
+    REMOTE_USER with which a request gets the principals of the user of `request`: the built-in remote users
+    (e.g. TEST) as such, others by the uuid of their user item (looked up by groupfinder), None if anonymous.
+    """
+    owner = get_export_job_owner(request)
+    if owner is None:
+        return None
+    namespace, _, localname = owner.partition('.')
+    if namespace in ('remoteuser', 'userid'):
+        return localname
+    return None
+
+
+def make_export_request(app, export_type, query_string, post_body, remote_user):
+    """
+    Standalone request for the endpoint of `export_type` with `query_string`, as `remote_user`; built in the
+    worker thread, as the request creating the job is done with by then.
+    """
+    path = EXPORT_JOB_PATHS[export_type]
+    if query_string:
+        path += '?' + query_string
+    environ = {'HTTP_ACCEPT': '*/*'}
+    if remote_user is not None:
+        environ['REMOTE_USER'] = remote_user
+    if export_type == 'metadata' and post_body:
+        # /metadata/ accepts form data, each value JSON-encoded.
+        form = {key: json.dumps(post_body[key])
+                for key in ('accession_triples', 'download_file_name') if key in post_body}
+        return app.request_factory.blank(path, environ=environ, POST=form)
+    return app.request_factory.blank(path, environ=environ)
+
+
+def export_job_response(request, job):
+    """ Job status, with links to itself and, if done, to its output """
+    result = dict(job, **{'@id': '/export-jobs/{}/{}/'.format(job['export_type'], job['job_id'])})
+    del result['userid']
+    if job['status'] == 'done':
+        result['download'] = result['@id'] + 'download'
+    return result
+
+
+def get_job_or_404(request):
+    job_id = request.matchdict['job_id']
+    try:
+        job_id = str(uuid.UUID(job_id))
+    except ValueError:
+        raise HTTPNotFound('Export job not found.')
+    storage = get_export_job_storage(request.registry)
+    job = storage.read_status(job_id)
+    if job is not None:
+        job = check_export_job(storage, job, retention=get_export_job_retention(request.registry))
+    if job is None or job['export_type'] != request.matchdict['export_type']:
+        raise HTTPNotFound('Export job not found.')
+    if job['userid'] is not None and job['userid'] != get_export_job_owner(request):
+        raise HTTPNotFound('Export job not found.')
+    return job
+
+
+@view_config(route_name='export_job_create', request_method='POST')
+@debug_log
+def export_job_create(context, request):
+    """
+    Starts an export job for /metadata/ or /report.tsv with the query params of this request. For /metadata/,
+    an optional JSON body may contain `accession_triples` and `download_file_name`, as otherwise POSTed as form.
+    """
+    export_type = request.matchdict['export_type']
+    if export_type not in EXPORT_JOB_PATHS:
+        raise HTTPBadRequest('Export type must be one of: ' + ', '.join(EXPORT_JOB_PATHS))
+    try:
+        post_body = request.json_body if request.body else {}
+    except ValueError:
+        raise HTTPBadRequest('Request body must be JSON.')
+    if not isinstance(post_body, dict):
+        raise HTTPBadRequest('Request body must be a JSON object.')
+
+    job = {
+        'job_id': str(uuid.uuid4()),
+        'export_type': export_type,
+        'status': 'queued',
+        'created': now_isoformat(),
+        'bytes_written': 0,
+        'userid': get_export_job_owner(request)
+    }
+    tracker = get_export_job_tracker(request.registry)
+    tracker.write_status(job)
+
+    app = request.registry[EXPORT_JOB_APP]
+    query_string = request.query_string
+    remote_user = get_export_remote_user(request)
+    get_export_job_executor(request.registry).submit(
+        run_export_job, tracker, dict(job),
+        lambda: make_export_request(app, export_type, query_string, post_body, remote_user).get_response(app)
+    )
+
+    request.response.status_int = 202
+    return export_job_response(request, job)
+
+
+@view_config(route_name='export_job_status', request_method='GET')
+@debug_log
+def export_job_status(context, request):
+    return export_job_response(request, get_job_or_404(request))
+
+
+@view_config(route_name='export_job_download', request_method='GET')
+@debug_log
+def export_job_download(context, request):
+    job = get_job_or_404(request)
+    if job['status'] != 'done':
+        raise HTTPNotFound('Export job output is not available; job status is "%s".' % job['status'])
+    return get_export_job_storage(request.registry).download_response(request, job)
@@ -1,10 +1,11 @@
 import time
 import json
 import socket
-import boto3
 import structlog
 import datetime
 
+from ..aws_clients import get_aws_client
+
 
 log = structlog.getLogger(__name__)
 
@@ -29,10 +30,7 @@ class IngestionQueueManager:
         if not self.env_name:  # replace with something usable
             backup = socket.gethostname()[:80].replace('.', '-')
             self.env_name = backup if backup else 'cgap-backup'
-        kwargs = {
-            'region_name': 'us-east-1'
-        }
-        self.client = boto3.client('sqs', **kwargs)
+        self.client = get_aws_client(registry, 'sqs', region_name='us-east-1')
         self.queue_name = override_name or (self.env_name + self.QUEUE_NAME_EXTENSION)
         self.queue_attrs = {
             self.queue_name: {
@@ -0,0 +1,206 @@
+"""
+Opt-in cache of traced provenance graphs (the steps returned by `trace_workflows`).
+
+Creating or modifying any Item evicts right away the entries which touched it, or which touched an
+Item it links to (e.g. a new WorkflowRun taking a traced File as input). As tracing reads Elasticsearch
+documents, which the indexer only rewrites some time after the change, traces touching an Item changed
+less than `provenance_cache.reindex_delay` seconds ago are not cached, so that traces of the previous
+documents are not cached anew. Entries otherwise live until evicted or `provenance_cache.ttl` expires;
+writes of unrelated Items (or their indexing) leave them in place.
+
+Entries live in an in-process LRU cache and, optionally, in Redis so that they are shared
+between processes. With Redis configured, an in-process entry is only served while its
+Redis counterpart still exists, so that evictions done by other processes are respected.
+"""
+
+import json
+import re
+from pyramid.settings import asbool
+from snovault import AfterModified, Created
+from .search_cache import ExpiringLRUCache, get_expiring_cache
+
+import structlog
+
+
+log = structlog.getLogger(__name__)
+
+
+PROVENANCE_CACHE = 'encoded.provenance_cache'  # registry key
+PROVENANCE_CACHE_SHARED_BACKEND = 'encoded.provenance_cache_shared_backend'  # registry key
+
+DEFAULT_PROVENANCE_CACHE_MAX_ENTRIES = 256
+DEFAULT_PROVENANCE_CACHE_TTL = 3600  # seconds
+DEFAULT_PROVENANCE_REINDEX_DELAY = 120  # seconds after a change during which traces touching the Item aren't cached
+PROVENANCE_CHANGED_MAX_UUIDS = 10000  # recently changed Items remembered per process
+
+UUID_PATTERN = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+
+def includeme(config):
+    config.add_subscriber(invalidate_provenance_on_change, AfterModified)
+    config.add_subscriber(invalidate_provenance_on_change, Created)
+
+
+class RedisProvenanceBackend(object):
+    """
+    Shared storage of provenance cache entries, as JSON. Alongside each entry, a set per touched
+    UUID holds the keys of the entries to evict when that Item changes. Changed UUIDs are also
+    marked for `reindex_delay` seconds (see module docstring).
+    """
+
+    KEY_PREFIX = 'encoded:provenance:'
+
+    def __init__(self, client, ttl, reindex_delay=DEFAULT_PROVENANCE_REINDEX_DELAY):
+        self.client = client
+        self.ttl = int(ttl)
+        self.reindex_delay = int(reindex_delay)
+
+    @classmethod
+    def from_url(cls, url, ttl, reindex_delay=DEFAULT_PROVENANCE_REINDEX_DELAY):
+        import redis  # installed along with dcicsnovault
+        return cls(redis.Redis.from_url(url), ttl, reindex_delay)
+
+    def entry_key(self, key):
+        return self.KEY_PREFIX + 'entry:' + key
+
+    def uuid_key(self, uuid):
+        return self.KEY_PREFIX + 'uuid:' + uuid
+
+    def changed_key(self, uuid):
+        return self.KEY_PREFIX + 'changed:' + uuid
+
+    def get(self, key):
+        value = self.client.get(self.entry_key(key))
+        if value is None:
+            return None
+        value = json.loads(value)
+        return value['steps'], frozenset(value['uuids'])
+
+    def exists(self, key):
+        return bool(self.client.exists(self.entry_key(key)))
+
+    def set(self, key, entry):
+        """ `entry` is a (steps, touched UUIDs) tuple """
+        pipeline = self.client.pipeline()
+        value = json.dumps({'steps': entry[0], 'uuids': sorted(entry[1])})
+        pipeline.set(self.entry_key(key), value, ex=self.ttl)
+        for uuid in entry[1]:
+            pipeline.sadd(self.uuid_key(uuid), key)
+            pipeline.expire(self.uuid_key(uuid), self.ttl)
+        pipeline.execute()
+
+    def invalidate(self, uuids):
+        for uuid in uuids:
+            keys = self.client.smembers(self.uuid_key(uuid))
+            if keys:
+                self.client.delete(*[self.entry_key(k.decode('utf-8') if isinstance(k, bytes) else k) for k in keys])
+            self.client.delete(self.uuid_key(uuid))
+            self.client.set(self.changed_key(uuid), '1', ex=self.reindex_delay)
+
+    def any_changed(self, uuids):
+        """ Whether any of `uuids` changed less than `reindex_delay` seconds ago """
+        return bool(uuids) and bool(self.client.exists(*[self.changed_key(uuid) for uuid in uuids]))
+
+
+def get_provenance_reindex_delay(registry):
+    return float(registry.settings.get('provenance_cache.reindex_delay', DEFAULT_PROVENANCE_REINDEX_DELAY))
+
+
+def get_provenance_shared_backend(registry):
+    """ Returns the Redis backend configured with `provenance_cache.redis_url`, if any """
+    if PROVENANCE_CACHE_SHARED_BACKEND not in registry:
+        url = registry.settings.get('provenance_cache.redis_url')
+        backend = None
+        if url:
+            ttl = float(registry.settings.get('provenance_cache.ttl', DEFAULT_PROVENANCE_CACHE_TTL))
+            backend = RedisProvenanceBackend.from_url(url, ttl, get_provenance_reindex_delay(registry))
+        registry.setdefault(PROVENANCE_CACHE_SHARED_BACKEND, backend)
+    return registry[PROVENANCE_CACHE_SHARED_BACKEND]
+
+
+class ProvenanceCache(object):
+    """
+    In-process (ExpiringLRUCache) + optional shared (Redis) cache of traced steps.
+    In-process values are (steps, touched UUIDs) tuples.
+    """
+
+    def __init__(self, local_cache, shared_backend=None, reindex_delay=DEFAULT_PROVENANCE_REINDEX_DELAY):
+        self.local_cache = local_cache
+        self.shared_backend = shared_backend
+        self.changed_uuids = ExpiringLRUCache(max_entries=PROVENANCE_CHANGED_MAX_UUIDS, ttl=reindex_delay)
+
+    def get(self, key):
+        entry = self.local_cache.get(key)
+        if entry is not None:
+            if self.shared_backend is None or self._shared_call('exists', key):
+                return entry[0]
+            return None
+        if self.shared_backend is not None:
+            entry = self._shared_call('get', key)
+            if entry is not None:
+                self.local_cache.set(key, entry)
+                return entry[0]
+        return None
+
+    def set(self, key, steps, uuids):
+        """ Caches `steps`, unless some of the touched `uuids` changed recently; returns whether cached """
+        entry = (steps, frozenset(uuids))
+        if any(self.changed_uuids.get(uuid) for uuid in entry[1]):
+            return False
+        if self.shared_backend is not None and self._shared_call('any_changed', entry[1]) is not False:
+            return False  # recently changed in another process, or unknown as Redis failed
+        self.local_cache.set(key, entry)
+        if self.shared_backend is not None:
+            self._shared_call('set', key, entry)
+        return True
+
+    def invalidate(self, uuids):
+        uuids = set(uuids)
+        for uuid in uuids:
+            self.changed_uuids.set(uuid, True)
+        self.local_cache.delete_where(lambda key, entry: not uuids.isdisjoint(entry[1]))
+        if self.shared_backend is not None:
+            self._shared_call('invalidate', uuids)
+
+    def _shared_call(self, method, *args):
+        try:
+            return getattr(self.shared_backend, method)(*args)
+        except Exception as exc:
+            log.warning('Provenance cache shared backend error', method=method, error=str(exc))
+            return None
+
+
+def get_provenance_cache(registry):
+    """
+    Returns the provenance cache, or None if not enabled via `provenance_cache.enabled`.
+    Size and TTL are configured with `provenance_cache.max_entries` and `provenance_cache.ttl`,
+    the optional shared backend with `provenance_cache.redis_url`.
+    """
+    if not asbool(registry.settings.get('provenance_cache.enabled', False)):
+        return None
+    cache = registry.get(PROVENANCE_CACHE)
+    if cache is None:
+        local_cache = get_expiring_cache(registry, PROVENANCE_CACHE + '.local', 'provenance_cache',
+                                         DEFAULT_PROVENANCE_CACHE_MAX_ENTRIES, DEFAULT_PROVENANCE_CACHE_TTL)
+        cache = registry.setdefault(PROVENANCE_CACHE, ProvenanceCache(
+            local_cache, get_provenance_shared_backend(registry), get_provenance_reindex_delay(registry)
+        ))
+    return cache
+
+
+def make_provenance_cache_key(context_uuid, options):
+    return str(context_uuid) + ':' + json.dumps(options, sort_keys=True)
+
+
+def linked_uuids(properties):
+    """ All UUIDs referenced anywhere within (linkTo values of) an Item's properties """
+    return set(UUID_PATTERN.findall(json.dumps(properties)))
+
+
+def invalidate_provenance_on_change(event):
+    cache = get_provenance_cache(event.request.registry)
+    if cache is None:
+        return
+    item = event.object
+    uuids = {str(item.uuid)} | linked_uuids(item.properties)
+    cache.invalidate(uuids)
@@ -0,0 +1,134 @@
+"""
+Opt-in, process-level cache of the object frames of small, rarely edited "reference" Items
+(FileFormat, ExperimentType, Organism, Enzyme, Lab by default), which are looked up by calculated
+properties on nearly every File / Experiment render (see get_item_object in types/base.py).
+
+An entry is only served while the `sid` of the Item, and of each Item it links to, is unchanged,
+so edits made by other processes are respected; edits made in this process also evict the entries
+of the edited Item right away. Only Items which, like every Item they link to, are viewable by everyone
+are cached, as calculated properties may show properties of linked Items (e.g. Lab.correspondence of Users).
+Entries are also keyed on the principals of the user the response is rendered for, so that a frame rendered
+for one user is never served to another with different principals.
+
+Enabled with `reference_item_cache.enabled`; types are configured with `reference_item_cache.types`
+(item type names separated by spaces or commas), size and TTL with `reference_item_cache.max_entries`
+and `reference_item_cache.ttl`.
+"""
+
+from pyramid.security import Everyone, principals_allowed_by_permission
+from snovault import AfterModified, CONNECTION
+from snovault.util import get_root_request
+from .search_cache import get_expiring_cache
+
+
+REFERENCE_ITEM_CACHE = 'encoded.reference_item_cache'  # registry key
+REFERENCE_ITEM_TYPES = 'encoded.reference_item_types'  # registry key
+
+DEFAULT_REFERENCE_ITEM_CACHE_MAX_ENTRIES = 2000
+DEFAULT_REFERENCE_ITEM_CACHE_TTL = 3600  # seconds
+DEFAULT_REFERENCE_ITEM_TYPES = ('FileFormat', 'ExperimentType', 'Organism', 'Enzyme', 'Lab')
+
+
+def includeme(config):
+    config.add_subscriber(invalidate_reference_item_on_change, AfterModified)
+
+
+def get_reference_item_cache(registry):
+    """ Returns the reference item cache, or None if not enabled via `reference_item_cache.enabled` """
+    return get_expiring_cache(registry, REFERENCE_ITEM_CACHE, 'reference_item_cache',
+                              DEFAULT_REFERENCE_ITEM_CACHE_MAX_ENTRIES, DEFAULT_REFERENCE_ITEM_CACHE_TTL)
+
+
+def get_reference_item_types(registry):
+    item_types = registry.get(REFERENCE_ITEM_TYPES)
+    if item_types is None:
+        setting = registry.settings.get('reference_item_cache.types')
+        if setting:
+            item_types = frozenset(setting.replace(',', ' ').split())
+        else:
+            item_types = frozenset(DEFAULT_REFERENCE_ITEM_TYPES)
+        item_types = registry.setdefault(REFERENCE_ITEM_TYPES, item_types)
+    return item_types
+
+
+def get_item_versions(connection, uuids):
+    """ Returns a tuple of (uuid, sid) for `uuids`, or None if any of the Items is missing """
+    versions = []
+    for uuid in sorted(uuids):
+        item = connection.get_by_uuid(uuid)
+        if item is None:
+            return None
+        versions.append((uuid, item.sid))
+    return tuple(versions)
+
+
+def get_dependency_uuids(item):
+    """ UUIDs whose Items the object frame of `item` is rendered from: itself and the Items it links to """
+    uuids = {str(item.uuid)}
+    for link_uuids in item.links(item.properties).values():
+        uuids.update(str(uuid) for uuid in link_uuids)
+    return uuids
+
+
+def get_viewer_principals(request):
+    """ Principals of the user a response is rendered for, i.e. of the root request (embeds run as EMBED) """
+    root = get_root_request() or request
+    return tuple(sorted(root.effective_principals))
+
+
+def is_public(item):
+    return Everyone in principals_allowed_by_permission(item, 'view')
+
+
+def get_cached_reference_object(request, path, indexing):
+    """
+    Returns the cached (object, linked uuids, rev links by item) entry for `path`, or None.
+    When indexing, entries cached without linked uuids (i.e. rendered outside of indexing) are not used.
+    """
+    cache = get_reference_item_cache(request.registry)
+    if cache is None:
+        return None
+    cache_key = (path, get_viewer_principals(request))
+    entry = cache.get(cache_key)
+    if entry is None or (indexing and entry['linked_uuids'] is None):
+        return None
+    versions = get_item_versions(request.registry[CONNECTION], [uuid for uuid, _sid in entry['versions']])
+    if versions != entry['versions']:
+        cache.delete_where(lambda key, _entry: key == cache_key)
+        return None
+    return entry['object'], entry['linked_uuids'], entry['rev_linked_uuids_by_item']
+
+
+def cache_reference_object(request, path, result, linked_uuids, rev_linked_uuids_by_item):
+    """
+    Caches the object frame `result` rendered for `path`, if it is that of a reference Item which,
+    like all Items it links to, is public
+    """
+    cache = get_reference_item_cache(request.registry)
+    if cache is None or 'uuid' not in result or not result.get('@type') or \
+            result['@type'][0] not in get_reference_item_types(request.registry):
+        return
+    connection = request.registry[CONNECTION]
+    item = connection.get_by_uuid(result['uuid'])
+    if item is None:
+        return
+    dependencies = [connection.get_by_uuid(uuid) for uuid in get_dependency_uuids(item)]
+    if any(dependency is None or not is_public(dependency) for dependency in dependencies):
+        return
+    versions = get_item_versions(connection, get_dependency_uuids(item))
+    if versions is None:
+        return
+    cache.set((path, get_viewer_principals(request)), {
+        'object': result,
+        'versions': versions,
+        'linked_uuids': linked_uuids,
+        'rev_linked_uuids_by_item': rev_linked_uuids_by_item
+    })
+
+
+def invalidate_reference_item_on_change(event):
+    cache = get_reference_item_cache(event.request.registry)
+    if cache is None:
+        return
+    uuid = str(event.object.uuid)
+    cache.delete_where(lambda key, entry: any(uuid == versioned_uuid for versioned_uuid, _sid in entry['versions']))
@@ -1,7 +1,10 @@
 import re
-import math
 import itertools
+import json
+import queue
+import threading
 from functools import reduce
+from pyramid.response import Response
 from pyramid.view import view_config
 from webob.multidict import MultiDict
 from snovault import (
@@ -22,6 +25,7 @@ from snovault.util import (
 from snovault.typeinfo import AbstractTypeInfo
 from elasticsearch.helpers import scan
 from elasticsearch_dsl import Search
+from elasticsearch_dsl.connections import get_connection
 from elasticsearch import (
     TransportError,
     RequestError,
@@ -37,6 +41,7 @@ from collections import OrderedDict
 from copy import deepcopy
 import uuid
 import structlog
+from .search_cache import get_facet_cache, make_facet_cache_key
 from .util import is_mobile_browser
 
 log = structlog.getLogger(__name__)
@@ -53,18 +58,37 @@ sanitize_search_string_re = re.compile(r'[\\\+\-\&\|\!\(\)\{\}\[\]\^\~\:\/\\\*\?
 COMMON_EXCLUDED_URI_PARAMS = [
     'frame', 'format', 'limit', 'sort', 'from', 'field',
     'mode', 'redirected_from', 'datastore', 'referrer',
-    'currentAction', 'additional_facet'
+    'currentAction', 'additional_facet', 'response'
 ]
 ES_MAX_HIT_TOTAL = 10000
+ALL_RESULTS_PAGE_SIZE = 100  # Hits per page fetched from ES for limit=all; see `search.all_results_page_size` setting.
+ALL_RESULTS_PIT_KEEP_ALIVE = '2m'  # Point-in-time is kept alive this long between two pages.
+ALL_RESULTS_MAX_PREFETCH_PAGES = 2  # Caps memory held by read-ahead to (2 + 1) * page size hits.
+ALL_RESULTS_PREFETCH_JOIN_TIMEOUT = 5  # Seconds to wait for the read-ahead thread to wind down on close.
+SEARCH_SKELETON_CACHE = 'encoded.search_skeleton_cache'  # registry key, see SearchSkeletonCache
+SEARCH_SKELETON_CACHE_SIZE = 256
+SEARCH_FIELD_SCHEMA_CACHE_SIZE = 4096
+TOP_LEVEL_SOURCE_FIELDS = ('validation_errors', 'aggregated_items')  # not within the frames of an ES document
+NDJSON_CHUNK_SIZE = 64 * 1024  # bytes of NDJSON lines per chunk written out with format=ndjson
 
 
 @view_config(route_name='search', request_method='GET', permission='search')
 @debug_log
-def search(context, request, search_type=None, return_generator=False, forced_type='Search', custom_aggregations=None):
+def search(context, request, search_type=None, return_generator=False, forced_type='Search', custom_aggregations=None, all_results_page_size=None, extra_filters=None):
     """
     Search view connects to ElasticSearch and returns the results
+
+    `extra_filters` is an optional list of ES filter clauses which, for programmatic (e.g. /metadata/)
+    sub-requests, narrow the results further than the URL query does. They are applied like any
+    other filter but are not reflected in result['filters'].
+
+    With `response=slim` (for programmatic clients paging through results), no facets, columns,
+    clear_filters, filters, sort or static section are built, so no aggregations are run in ES,
+    and the total is counted exactly instead. `format=ndjson` implies `response=slim` and streams
+    the results out as one JSON object per line, without the surrounding result.
     """
     types = request.registry[TYPES]
+    slim, ndjson = get_slim_response_mode(request)
     # list of item types used from the query
     doc_types = set_doc_types(request, types, search_type)
     # calculate @type. Exclude ItemSearchResults unless no other types selected.
@@ -91,7 +115,7 @@ def search(context, request, search_type=None, return_generator=False, forced_ty
     # Get static section (if applicable) when searching a single item type
     # Note: Because we rely on 'source', if the static_section hasn't been indexed
     # into Elasticsearch it will not be loaded
-    if (len(doc_types) == 1) and 'Item' not in doc_types:
+    if not slim and (len(doc_types) == 1) and 'Item' not in doc_types:
         search_term = 'search-info-header.' + doc_types[0]
         try:
             static_section = request.registry['collections']['StaticSection'].get(search_term)
@@ -108,33 +132,37 @@ def search(context, request, search_type=None, return_generator=False, forced_ty
 
     # get desired frame for this search
     search_frame = request.normalized_params.get('frame', 'embedded')
+    additional_facets = request.normalized_params.getall('additional_facet')
+
+    # doc_type-dependent structures which do not depend on the rest of the request
+    skeleton = get_search_skeleton(request, doc_types, search_frame, additional_facets, slim=slim)
 
     ### PREPARE SEARCH TERM
     prepared_terms = prepare_search_term(request)
 
-    schemas = [types[item_type].schema for item_type in doc_types]
+    schemas = skeleton['schemas']
 
     # set ES index based on doc_type (one type per index)
     # if doc_type is item, search all indexes by setting es_index to None
     # If multiple, search all specified
-    if 'Item' in doc_types:
-        es_index = get_namespaced_index(request, '*')
-    else:
-        es_index = find_index_by_doc_types(request, doc_types, ['Item'])
+    es_index = skeleton['es_index']
 
     # establish elasticsearch_dsl class that will perform the search
     search = Search(using=es, index=es_index)
 
     # set up clear_filters path
-    result['clear_filters'] = clear_filters_setup(request, doc_types, forced_type)
+    if not slim:
+        result['clear_filters'] = clear_filters_setup(request, doc_types, forced_type)
 
     ### SET TYPE FILTERS
     build_type_filters(result, request, doc_types, types)
 
     # get the fields that will be used as source for the search
-    # currently, supports frame=raw/object but live faceting does not work
-    # this is okay because the only non-embedded access will be programmatic
-    source_fields = sorted(list_source_fields(request, doc_types, search_frame))
+    # only the frame that is returned is fetched; frame=raw/object return no facets
+    if request.normalized_params.getall('field'):
+        source_fields = sorted(list_source_fields(request, doc_types, search_frame))
+    else:
+        source_fields = skeleton['source_fields']
 
     ### GET FILTERED QUERY
     # Builds filtered query which supports multiple facet selection
@@ -145,15 +173,29 @@ def search(context, request, search_type=None, return_generator=False, forced_ty
     # TODO: implement BOOST here?
 
     ### Set filters
-    search, query_filters, base_field_filters = set_filters(request, search, result, principals, doc_types)
+    search, query_filters, base_field_filters = set_filters(request, search, result, principals, doc_types, extra_filters)
 
     ### Set starting facets
-    additional_facets = request.normalized_params.getall('additional_facet')
-    facets = initialize_facets(request, doc_types, prepared_terms, schemas, additional_facets)
+    if slim:
+        facets = []
+        # no aggregations to derive the total from, so have ES count past ES_MAX_HIT_TOTAL
+        search = search.extra(track_total_hits=True)
+    else:
+        facets = initialize_facets(request, doc_types, prepared_terms, schemas, additional_facets,
+                                   schema_facets=skeleton['schema_facets'])
+
+    ### Look up previously formatted facets for this query, principals and index generation (opt-in).
+    facet_cache = get_facet_cache(request.registry) if from_ == 0 and not extra_filters and not slim else None
+    facet_cache_key = cached_facet_results = None
+    if facet_cache is not None:
+        facet_cache_key = make_facet_cache_key(request, es_index, size == 0, custom_aggregations)
+        if facet_cache_key is not None:
+            cached_facet_results = facet_cache.get(facet_cache_key)
 
     ### Adding facets, plus any optional custom aggregations.
     ### Uses 'size' and 'from_' to conditionally skip (no facets if from > 0; no aggs if size > 0).
-    search = set_facets(search, facets, query_filters, string_query, request, doc_types, custom_aggregations, base_field_filters, size, from_)
+    if cached_facet_results is None and not slim:
+        search = set_facets(search, facets, query_filters, string_query, request, doc_types, custom_aggregations, base_field_filters, size, from_)
 
     ### Add preference from session, if available
     search_session_id = None
@@ -166,22 +208,40 @@ def search(context, request, search_type=None, return_generator=False, forced_ty
         search = search.params(preference=search_session_id)
 
     ### Execute the query
-    if size == 'all':
-        es_results = execute_search_for_all_results(search)
+    if cached_facet_results is not None and size == 0:
+        # Only total + aggregations were requested, which we already have.
+        es_results = {'hits': {'total': {'value': cached_facet_results['total']}, 'hits': []}}
+    elif size == 'all':
+        es_results = execute_search_for_all_results(search,
+                                                    page_size=all_results_page_size or get_all_results_page_size(request),
+                                                    prefetch=get_all_results_prefetch_pages(request))
     else:
         size_search = search[from_:from_ + size]
         es_results = execute_search(size_search)
 
     ### Record total number of hits
     result['total'] = total = es_results['hits']['total']['value']
-    result['facets'] = format_facets(es_results, facets, total, additional_facets, result['filters'], search_frame)
-    result['aggregations'] = format_extra_aggregations(es_results)
+    if slim:
+        for key in ('filters', 'facets', 'sort'):
+            del result[key]
+    elif cached_facet_results is not None:
+        result['facets'] = deepcopy(cached_facet_results['facets'])
+        result['aggregations'] = deepcopy(cached_facet_results['aggregations'])
+    else:
+        result['facets'] = format_facets(es_results, facets, total, additional_facets, result['filters'], search_frame)
+        result['aggregations'] = format_extra_aggregations(es_results)
+        if facet_cache_key is not None:
+            facet_cache.set(facet_cache_key, {
+                'total': total,
+                'facets': deepcopy(result['facets']),
+                'aggregations': deepcopy(result['aggregations'])
+            })
 
     # After ES7 upgrade, 'total' does not return the exact count if it is >10000. This restriction
     # requires many UI components' and tests' update. So, we attempt to get a more precise result
     # from facets. (It is interesting that type=Item's doc_count is calculated correctly whereas the 'total'
     # is not.)
-    if total == ES_MAX_HIT_TOTAL:
+    if total == ES_MAX_HIT_TOTAL and not slim:
         result['total'] = total = get_total_from_facets(result['facets'], total)
 
     # Add batch actions
@@ -197,16 +257,19 @@ def search(context, request, search_type=None, return_generator=False, forced_ty
             result['all'] = '%s?%s' % (request.resource_path(context), urlencode(params))
 
     # add actions (namely 'add')
-    result['actions'] = get_collection_actions(request, types[doc_types[0]])
+    if not slim:
+        result['actions'] = get_collection_actions(request, types[doc_types[0]])
 
     if not result['total']:
+        if ndjson and not return_generator:
+            return Response(status=404, content_type='application/x-ndjson', body=b'')
         # http://googlewebmastercentral.blogspot.com/2014/02/faceted-navigation-best-and-5-of-worst.html
         request.response.status_code = 404
         result['notification'] = 'No results found'
         result['@graph'] = []
         return result if not return_generator else []
 
-    columns = build_table_columns(request, schemas, doc_types)
+    columns = skeleton['columns']
     if columns:
         result['columns'] = columns
 
@@ -215,6 +278,9 @@ def search(context, request, search_type=None, return_generator=False, forced_ty
     ### Format results for JSON-LD
     graph = format_results(request, es_results['hits']['hits'], search_frame)
 
+    if ndjson and not return_generator:
+        return Response(content_type='application/x-ndjson', app_iter=ndjson_results(graph))
+
     if request.__parent__ is not None or return_generator:
         if return_generator:
             return graph
@@ -227,7 +293,8 @@ def search(context, request, search_type=None, return_generator=False, forced_ty
         request.response.set_cookie('searchSessionID', search_session_id) # Save session ID for re-requests / subsequent pages.
 
     #misc
-    result['is_mobile_browser'] = is_mobile_browser(request)
+    if not slim:
+        result['is_mobile_browser'] = is_mobile_browser(request)
 
     return result
 
@@ -279,6 +346,39 @@ def collection_view(context, request):
     return search(context, request, context.type_info.name, False, forced_type='Search')
 
 
+def get_slim_response_mode(request):
+    """
+    Returns (slim, ndjson) for the `response=` and `format=` query params of a search, see search().
+    """
+    response_mode = request.params.get('response', 'full')
+    if response_mode not in ('full', 'slim'):
+        raise HTTPBadRequest('Search response must be one of: full, slim')
+    ndjson = request.params.get('format') == 'ndjson'
+    return response_mode == 'slim' or ndjson, ndjson
+
+
+def ndjson_results(graph, chunk_size=NDJSON_CHUNK_SIZE):
+    """
+    Yields the results of `graph` as NDJSON (one JSON object per line), in chunks of about `chunk_size` bytes.
+    """
+    lines = []
+    buffered = 0
+    try:
+        for item in graph:
+            line = (json.dumps(item) + '\n').encode('utf-8')
+            lines.append(line)
+            buffered += len(line)
+            if buffered >= chunk_size:
+                yield b''.join(lines)
+                lines = []
+                buffered = 0
+        if lines:
+            yield b''.join(lines)
+    finally:
+        if hasattr(graph, 'close'):
+            graph.close()
+
+
 def build_search_types(types, doc_types):
     """
     Builds `search_types` based on the requested search `type` in URI param (=> `doc_types`).
@@ -348,29 +448,205 @@ def get_pagination(request):
     return from_, size
 
 
-def get_all_subsequent_results(initial_search_result, search, extra_requests_needed_count, size_increment):
-    from_ = 0
-    while extra_requests_needed_count > 0:
-        # print(f"{extra_requests_needed_count} requests left to get all results.")
-        from_ = from_ + size_increment
-        subsequent_search = search[from_:from_ + size_increment]
-        subsequent_search_result = execute_search(subsequent_search)
-        extra_requests_needed_count -= 1
-        for hit in subsequent_search_result['hits'].get('hits', []):
-            yield hit
+def get_all_results_page_size(request):
+    """
+    Page size used when streaming `limit=all` results out of Elasticsearch.
+    Configurable via the `search.all_results_page_size` setting.
+    """
+    page_size = request.registry.settings.get('search.all_results_page_size', ALL_RESULTS_PAGE_SIZE)
+    try:
+        page_size = int(page_size)
+    except (TypeError, ValueError):
+        page_size = ALL_RESULTS_PAGE_SIZE
+    return page_size if page_size > 0 else ALL_RESULTS_PAGE_SIZE
 
 
-def execute_search_for_all_results(search):
-    chunk_size = 100  # Decrease this to like 5 or 10 to test.
+def get_all_results_prefetch_pages(request):
+    """
+    Number of `limit=all` pages fetched ahead in a background thread while the
+    current page is being consumed. Configurable via the `search.all_results_prefetch_pages`
+    setting; 0 (default) fetches each page synchronously.
+    """
+    try:
+        prefetch_pages = int(request.registry.settings.get('search.all_results_prefetch_pages', 0))
+    except (TypeError, ValueError):
+        prefetch_pages = 0
+    return min(max(prefetch_pages, 0), ALL_RESULTS_MAX_PREFETCH_PAGES)
 
-    first_search = search[0:chunk_size]  # get aggregations from here
-    es_result = execute_search(first_search)
 
-    total_results_expected = es_result['hits'].get('total', {}).get('value', 0)
-    extra_requests_needed_count = int(math.ceil(total_results_expected / chunk_size)) - 1  # Decrease by 1 (first es_result already happened)
+def open_point_in_time(es, index, keep_alive=ALL_RESULTS_PIT_KEEP_ALIVE):
+    """
+    Opens a point-in-time on the given index(es) so that subsequent pages of a
+    `search_after` iteration see a consistent snapshot.
+    Returns None if the cluster does not support point-in-time, in which case
+    callers should page with `search_after` against the live index instead.
+    """
+    try:
+        return es.open_point_in_time(index=index, keep_alive=keep_alive)['id']
+    except Exception as exc:
+        log.warning('Could not open point-in-time for %s, paging without it' % index, error=str(exc))
+        return None
+
+
+def close_point_in_time(es, pit_id):
+    if pit_id is None:
+        return
+    try:
+        es.close_point_in_time(body={'id': pit_id})
+    except Exception as exc:  # PIT will expire by itself after keep_alive anyway
+        log.warning('Could not close point-in-time', error=str(exc))
+
+
+def get_all_subsequent_pages(es, search_body, pit_id, search_after, page_size, index=None,
+                             keep_alive=ALL_RESULTS_PIT_KEEP_ALIVE):
+    """
+    Generator which pages through the remaining hits of a search using `search_after`
+    on the sort values of the last hit seen, yielding one list of hits per page.
+    Every page costs the same regardless of how deep into the result set we are,
+    unlike `from`/`size` pagination.
+    Closes the point-in-time (if any) once exhausted or when the generator is closed.
+
+    :param es: Elasticsearch client
+    :param search_body: dict of the search, without aggregations
+    :param pit_id: point-in-time id, or None to page against `index` directly
+    :param search_after: sort values of the last hit already returned
+    :param page_size: number of hits to request per page
+    """
+    try:
+        while search_after is not None:
+            body = dict(search_body, search_after=search_after, size=page_size, track_total_hits=False)
+            if pit_id is not None:
+                body['pit'] = {'id': pit_id, 'keep_alive': keep_alive}
+            subsequent_search = Search.from_dict(body).using(es)
+            if pit_id is None:
+                subsequent_search = subsequent_search.index(index)
+            subsequent_search_result = execute_search(subsequent_search)
+            pit_id = subsequent_search_result.get('pit_id', pit_id)
+            hits = subsequent_search_result['hits'].get('hits', [])
+            if hits:
+                yield hits
+            search_after = hits[-1].get('sort') if len(hits) == page_size else None
+    finally:
+        close_point_in_time(es, pit_id)
+
+
+_PREFETCH_DONE = object()
+
+
+def prefetch_pages(pages, max_pages_ahead, poll_interval=0.1):
+    """
+    Generator which consumes the `pages` iterator in a background thread, keeping at most
+    `max_pages_ahead` pages buffered (plus the one being fetched) so that fetching page N+1
+    from Elasticsearch overlaps with the caller formatting/writing page N.
+
+    Exceptions raised while fetching are re-raised in the consuming thread. Closing this
+    generator (e.g. client disconnected and the WSGI app_iter was closed) stops the worker,
+    which then closes `pages` in its own thread, releasing the point-in-time.
+    """
+    buffered = queue.Queue(maxsize=max_pages_ahead)
+    stop = threading.Event()
+
+    def put_until_stopped(item):
+        while not stop.is_set():
+            try:
+                buffered.put(item, timeout=poll_interval)
+                return True
+            except queue.Full:
+                continue
+        return False
 
-    if extra_requests_needed_count > 0:
-        es_result['hits']['hits'] = itertools.chain(es_result['hits']['hits'], get_all_subsequent_results(es_result, search, extra_requests_needed_count, chunk_size))
+    def fetch_pages():
+        try:
+            for page in pages:
+                if not put_until_stopped(page):
+                    break
+        except Exception as exc:
+            put_until_stopped(exc)
+        finally:
+            try:
+                pages.close()
+            finally:
+                put_until_stopped(_PREFETCH_DONE)
+
+    worker = threading.Thread(target=fetch_pages, name='search-prefetch', daemon=True)
+    worker.start()
+    try:
+        while True:
+            page = buffered.get()
+            if page is _PREFETCH_DONE:
+                return
+            if isinstance(page, Exception):
+                raise page
+            yield page
+    finally:
+        stop.set()
+        worker.join(timeout=ALL_RESULTS_PREFETCH_JOIN_TIMEOUT)
+
+
+def get_all_subsequent_results(es, search_body, pit_id, search_after, page_size, index=None,
+                               keep_alive=ALL_RESULTS_PIT_KEEP_ALIVE, prefetch=0):
+    """
+    Generator of the individual hits from get_all_subsequent_pages.
+    If `prefetch` > 0, up to that many pages are read ahead in a background thread.
+    """
+    pages = get_all_subsequent_pages(es, search_body, pit_id, search_after, page_size,
+                                     index=index, keep_alive=keep_alive)
+    if prefetch > 0:
+        pages = prefetch_pages(pages, prefetch)
+    try:
+        for page in pages:
+            yield from page
+    finally:
+        pages.close()
+
+
+def execute_search_for_all_results(search, page_size=ALL_RESULTS_PAGE_SIZE, keep_alive=ALL_RESULTS_PIT_KEEP_ALIVE,
+                                   prefetch=0):
+    """
+    Executes the search and returns an ES result whose `hits.hits` is an iterable
+    over *all* matching hits. The first page (which also carries the aggregations)
+    is fetched immediately; remaining pages are streamed lazily via point-in-time
+    + `search_after`, so that `index.max_result_window` does not apply.
+    If `prefetch` > 0, that many following pages are read ahead in a background thread.
+    """
+    es = get_connection(search._using)
+    index = ','.join(search._index) if search._index else None
+    pit_id = open_point_in_time(es, index, keep_alive)
+
+    search_body = search.to_dict()
+    sort = list(search_body.get('sort', []))
+    if pit_id is None and not any('_id' in s for s in sort if isinstance(s, dict)):
+        # Without a PIT there is no implicit `_shard_doc` tiebreaker, so add our own.
+        sort.append({'_id': {'order': 'asc'}})
+    search_body['sort'] = sort or ['_doc']
+
+    first_body = dict(search_body, size=page_size)
+    first_body.pop('from', None)
+    if pit_id is not None:
+        first_body['pit'] = {'id': pit_id, 'keep_alive': keep_alive}
+    first_search = Search.from_dict(first_body).using(es)
+    if pit_id is None:
+        first_search = first_search.index(index)
+    try:
+        es_result = execute_search(first_search)  # get aggregations from here
+    except Exception:
+        close_point_in_time(es, pit_id)
+        raise
+    pit_id = es_result.get('pit_id', pit_id)
+
+    first_hits = es_result['hits'].get('hits', [])
+    if len(first_hits) < page_size:
+        close_point_in_time(es, pit_id)
+        return es_result
+
+    # Aggregations have already been returned with the first page; don't recompute them for every page.
+    search_body.pop('aggs', None)
+    search_body.pop('from', None)
+    es_result['hits']['hits'] = itertools.chain(
+        first_hits,
+        get_all_subsequent_results(es, search_body, pit_id, first_hits[-1].get('sort'), page_size,
+                                   index=index, keep_alive=keep_alive, prefetch=prefetch)
+    )
     return es_result
 
 
@@ -591,24 +867,35 @@ def list_source_fields(request, doc_types, frame):
     Note that you must provide the full fieldname with embeds, such as:
     'field=biosample.biosource.individual.organism.name' and not just
     'field=name'
+
+    'validation_errors' and 'aggregated_items' are stored at the top level of
+    the ES document rather than within the embedded frame, so they are fetched
+    from there (and added to the result by format_results) only when requested.
     """
     fields_requested = request.normalized_params.getall('field')
     if fields_requested:
         fields = ['embedded.@id', 'embedded.@type']
         for field in fields_requested:
-            fields.append('embedded.' + field)
-    elif frame in ['embedded', 'object', 'raw']:
-        if frame != 'embedded':
-            # frame=raw corresponds to 'properties' in ES
-            if frame == 'raw':
-                frame = 'properties'
-            # let embedded be searched as well (for faceting)
-            fields = ['embedded.*', frame + '.*']
-        else:
-            fields = [frame + '.*']
-    else:
-        fields = ['embedded.*']
-    return fields
+            if field.split('.', 1)[0] in TOP_LEVEL_SOURCE_FIELDS:
+                fields.append(field)
+            else:
+                fields.append('embedded.' + field)
+        return fields
+    return list_default_source_fields(frame)
+
+
+def list_default_source_fields(frame):
+    """
+    Returns the source fields for the given frame when no `field=` is requested:
+    exactly the frame format_results will emit. Facets come from aggregations,
+    so other frames are not needed.
+    """
+    if frame == 'raw':
+        # frame=raw corresponds to 'properties' in ES
+        return ['properties.*']
+    if frame == 'object':
+        return ['object.*']
+    return ['embedded.*']
 
 
 def build_query(search, prepared_terms, source_fields):
@@ -759,9 +1046,9 @@ def set_sort_order(request, search, search_term, types, doc_types, result, schem
     return search
 
 
-def set_filters(request, search, result, principals, doc_types):
+def set_filters(request, search, result, principals, doc_types, extra_filters=None):
     """
-    Sets filters in the query
+    Sets filters in the query, plus any `extra_filters` clauses (see search())
     """
 
     # these next two dictionaries should each have keys equal to query_field
@@ -931,6 +1218,9 @@ def set_filters(request, search, result, principals, doc_types):
             'range' : { range_field : range_def }
         })
 
+    if extra_filters:
+        must_filters.extend(extra_filters)
+
     # To modify filters of elasticsearch_dsl Search, must call to_dict(),
     # modify that, then update from the new dict
     prev_search = search.to_dict()
@@ -989,19 +1279,13 @@ def initialize_additional_facets(request, doc_types, additional_facets, append_f
                 ))
 
 
-def initialize_facets(request, doc_types, prepared_terms, schemas, additional_facets):
+def initialize_schema_facets(request, doc_types, additional_facets):
     """
-    Initialize the facets used for the search. If searching across multiple
-    doc_types, only use the default 'Data Type' and 'Status' facets.
-    Add facets for custom url filters whether or not they're in the schema
-
-    Args:
-        doc_types (list): Item types (@type) for which we are performing a search for.
-        prepared_terms (dict): terms to match in ES, keyed by ES field name.
-        schemas (list): List of OrderedDicts of schemas for doc_types.
+    Builds the part of the facets which only depends on doc_types and additional_facets
+    (i.e. not on the filters of the current request), see initialize_facets.
 
     Returns:
-        list: tuples containing (0) ElasticSearch-formatted field name (e.g. `embedded.status`) and (1) list of terms for it.
+        tuple: (facets, append_facets, disabled_facets)
     """
 
     facets = [
@@ -1036,6 +1320,29 @@ def initialize_facets(request, doc_types, prepared_terms, schemas, additional_fa
                     continue  # Skip disabled facets.
                 facets.append(schema_facet)
 
+    return facets, append_facets, disabled_facets
+
+
+def initialize_facets(request, doc_types, prepared_terms, schemas, additional_facets, schema_facets=None):
+    """
+    Initialize the facets used for the search. If searching across multiple
+    doc_types, only use the default 'Data Type' and 'Status' facets.
+    Add facets for custom url filters whether or not they're in the schema
+
+    Args:
+        doc_types (list): Item types (@type) for which we are performing a search for.
+        prepared_terms (dict): terms to match in ES, keyed by ES field name.
+        schemas (list): List of OrderedDicts of schemas for doc_types.
+        schema_facets (tuple): Result of initialize_schema_facets, if already available (e.g. from the search skeleton).
+            Its lists are extended in place.
+
+    Returns:
+        list: tuples containing (0) ElasticSearch-formatted field name (e.g. `embedded.status`) and (1) list of terms for it.
+    """
+    if schema_facets is None:
+        schema_facets = initialize_schema_facets(request, doc_types, additional_facets)
+    facets, append_facets, disabled_facets = schema_facets
+
     # Add facets for any non-schema ?field=value filters requested in the search (unless already set)
     used_facets = [facet[0] for facet in facets + append_facets]
     used_facet_titles = used_facet_titles = [
@@ -1120,12 +1427,137 @@ def initialize_facets(request, doc_types, prepared_terms, schemas, additional_fa
     return facets
 
 
+class SchemaBoundLRUCache(object):
+    """
+    Thread-safe, bounded LRU mapping whose entries are only valid as long as the
+    schemas they were computed from are still the ones registered; an entry is
+    treated as missing once any of those schema objects has been replaced.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, schemas):
+        """ Returns tuple of (found, value) """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            entry_schemas, value = entry
+            if len(entry_schemas) != len(schemas) or any(a is not b for a, b in zip(entry_schemas, schemas)):
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, schemas, value):
+        with self._lock:
+            self._entries[key] = (tuple(schemas), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SearchSkeletonCache(object):
+    """
+    Process-level cache of the parts of a search which only depend on the doc_types
+    searched (plus frame, additional_facets and selection mode): facets from schemas,
+    table columns, default source fields, index string and `schema_for_field` lookups.
+
+    Lives on the registry, so a reloaded registry starts from an empty cache, and
+    entries computed from a schema which has since been replaced are ignored.
+    """
+
+    def __init__(self, max_skeletons=SEARCH_SKELETON_CACHE_SIZE, max_field_schemas=SEARCH_FIELD_SCHEMA_CACHE_SIZE):
+        self.skeletons = SchemaBoundLRUCache(max_skeletons)
+        self.field_schemas = SchemaBoundLRUCache(max_field_schemas)
+
+    def clear(self):
+        self.skeletons.clear()
+        self.field_schemas.clear()
+
+
+def get_search_skeleton_cache(registry):
+    cache = registry.get(SEARCH_SKELETON_CACHE)
+    if cache is None:
+        cache = registry.setdefault(SEARCH_SKELETON_CACHE, SearchSkeletonCache())
+    return cache
+
+
+def clear_search_skeleton_cache(registry):
+    """ To be called if schemas are reloaded in-place """
+    cache = registry.get(SEARCH_SKELETON_CACHE)
+    if cache is not None:
+        cache.clear()
+
+
+def get_search_skeleton(request, doc_types, search_frame, additional_facets, slim=False):
+    """
+    Returns the doc_type-dependent structures of a search, built once per
+    (doc_types, frame, additional_facets, selection mode) and cached in SearchSkeletonCache.
+    Request-specific filters and terms are layered on top of these by search().
+
+    Mutable parts (facets, columns) are copies, since they get modified per request.
+    For a `slim` search, facets and columns are neither built nor copied and are None.
+
+    Returns:
+        dict with keys 'schemas', 'es_index', 'source_fields', 'schema_facets', 'columns'
+    """
+    types = request.registry[TYPES]
+    schemas = [types[item_type].schema for item_type in doc_types]
+    current_action = request.normalized_params.get('currentAction')
+    is_selection = current_action in ('selection', 'multiselect')
+    key = (tuple(doc_types), search_frame, tuple(additional_facets), is_selection)
+
+    cache = get_search_skeleton_cache(request.registry).skeletons
+    found, skeleton = cache.get(key, schemas)
+    if not found and slim:
+        skeleton = {
+            'es_index': get_search_es_index(request, doc_types),
+            'source_fields': sorted(list_default_source_fields(search_frame))
+        }
+    elif not found:
+        skeleton = {
+            'es_index': get_search_es_index(request, doc_types),
+            'source_fields': sorted(list_default_source_fields(search_frame)),
+            'schema_facets': deepcopy(initialize_schema_facets(request, doc_types, additional_facets)),
+            'columns': deepcopy(build_table_columns(request, schemas, doc_types))
+        }
+        cache.set(key, schemas, skeleton)
+
+    return {
+        'schemas': schemas,
+        'es_index': skeleton['es_index'],
+        'source_fields': list(skeleton['source_fields']),
+        'schema_facets': None if slim else deepcopy(skeleton['schema_facets']),
+        'columns': None if slim else deepcopy(skeleton['columns'])
+    }
+
+
+def get_search_es_index(request, doc_types):
+    """
+    Returns the ES index(es) to search for doc_types; all indexes for 'Item'.
+    """
+    if 'Item' in doc_types:
+        return get_namespaced_index(request, '*')
+    return find_index_by_doc_types(request, doc_types, ['Item'])
+
+
 def schema_for_field(field, request, doc_types, should_log=False):
     '''
     Find the schema for the given field (in embedded '.' format). Uses
     ff_utils.crawl_schema from snovault and logs any cases where there is an
     error finding the field from the schema. Caches results based off of field
-    and doc types used
+    and doc types used, for the lifetime of the registry (see SearchSkeletonCache)
 
     Args:
         field (string): embedded field path, separated by '.'
@@ -1142,9 +1574,10 @@ def schema_for_field(field, request, doc_types, should_log=False):
     # We cannot hash dict by list (of doc_types) so we convert to unique ordered string
     doc_type_string = ','.join(doc_types)
 
-    cache = getattr(request, '_field_schema_cache', {})
-    if (field, doc_type_string) in cache:
-        return cache[(field, doc_type_string)]
+    cache = get_search_skeleton_cache(request.registry).field_schemas
+    found, field_schema = cache.get((field, doc_type_string), schemas)
+    if found:
+        return field_schema
 
     field_schema = None
 
@@ -1167,10 +1600,8 @@ def schema_for_field(field, request, doc_types, should_log=False):
                 if field_schema is not None:
                     break
 
-    # Cache result, even if not found, for this request.
-    cache[(field, doc_type_string)] = field_schema
-    if not hasattr(request, '_field_schema_cache'):
-        setattr(request, '_field_schema_cache', cache)
+    # Cache result, even if not found, for this process.
+    cache.set((field, doc_type_string), schemas, field_schema)
 
     return field_schema
 
@@ -1665,13 +2096,14 @@ def make_search_subreq(request, path):
 
 def get_iterable_search_results(request, search_path='/search/', param_lists=None, **kwargs):
     '''
-    Loops through search results, returns 100 (or search_results_chunk_row_size) results at a time. Pass it through itertools.chain.from_iterable to get one big iterable of results.
-    TODO: Maybe make 'limit=all', and instead of calling invoke_subrequest(subrequest), instead call iter_search_results!
+    Returns an iterable over all search results. Results are fetched from Elasticsearch lazily,
+    one page at a time, using a point-in-time and `search_after` (see execute_search_for_all_results).
 
     :param request: Only needed to pass to do_subreq to make a subrequest with.
     :param search_path: Root path to call, defaults to /search/ (can also use /browse/).
     :param param_lists: Dictionary of param:lists_of_vals which is converted to URL query.
-    :param search_results_chunk_row_size: Amount of results to get per chunk. Default should be fine.
+    :param all_results_page_size: Amount of results to get per page. Defaults to `search.all_results_page_size` setting.
+    :param extra_filters: List of additional ES filter clauses, see search().
     '''
     if param_lists is None:
         param_lists = deepcopy(DEFAULT_BROWSE_PARAM_LISTS)
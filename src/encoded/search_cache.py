@@ -0,0 +1,200 @@
+"""
+Opt-in, process-level caches for (mostly aggregation-only) search results and responses built from them.
+
+Cached values are only ever served for the same normalized query and the same set of
+effective principals, and are keyed on an index "generation" marker which changes
+whenever the indexer writes to the searched indexes, so that a commit by the indexer
+makes previously cached results unreachable.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from pyramid.settings import asbool
+from snovault.elasticsearch import ELASTIC_SEARCH
+
+import structlog
+
+
+log = structlog.getLogger(__name__)
+
+
+FACET_CACHE = 'encoded.facet_cache'  # registry key
+INDEX_GENERATION_TRACKER = 'encoded.index_generation_tracker'  # registry key
+
+DEFAULT_FACET_CACHE_MAX_ENTRIES = 256
+DEFAULT_FACET_CACHE_TTL = 300  # seconds
+DEFAULT_GENERATION_CHECK_INTERVAL = 5  # seconds between two index stats lookups for the same index(es)
+DEFAULT_GENERATION_SETTLE_TIME = 2  # seconds; must exceed ES refresh_interval (1s) so that cached results include the writes
+
+# URI params which do not influence facets, totals or extra aggregations.
+FACET_CACHE_IGNORED_PARAMS = {
+    'limit', 'from', 'sort', 'field', 'format', 'datastore', 'referrer',
+    'redirected_from', 'currentAction'
+}
+
+
+class ExpiringLRUCache(object):
+    """
+    Thread-safe, bounded LRU cache whose entries also expire `ttl` seconds after being set.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete_where(self, predicate):
+        """ Removes all entries for whose (key, value) `predicate` returns True """
+        with self._lock:
+            for key in [k for k, (_expiry, value) in self._entries.items() if predicate(k, value)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class IndexGenerationTracker(object):
+    """
+    Derives a "generation" marker for a (comma-separated) index string from the
+    indexing + deletion counters of its primaries. The counters only move when the
+    indexer writes, so the marker changes with every indexer commit.
+
+    A generation is only reported once it has been stable for `settle_time` seconds,
+    so that results are not cached under a generation whose writes are not yet visible
+    to search (i.e. before the next index refresh). Lookups are throttled to one stats
+    call per index string every `check_interval` seconds.
+    """
+
+    def __init__(self, check_interval=DEFAULT_GENERATION_CHECK_INTERVAL, settle_time=DEFAULT_GENERATION_SETTLE_TIME):
+        self.check_interval = check_interval
+        self.settle_time = settle_time
+        self._generations = {}  # index -> (checked_at, generation, first_seen_at)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fetch_generation(es, index):
+        stats = es.indices.stats(index=index, metric='indexing')
+        indexing = stats['_all']['primaries']['indexing']
+        return '%s-%s' % (indexing['index_total'], indexing['delete_total'])
+
+    def get_generation(self, es, index):
+        """ Returns the settled generation of `index`, or None if unknown / still changing """
+        now = time.monotonic()
+        with self._lock:
+            known = self._generations.get(index)
+        if known is None or now - known[0] >= self.check_interval:
+            try:
+                generation = self.fetch_generation(es, index)
+            except Exception as exc:
+                log.warning('Could not determine index generation for %s' % index, error=str(exc))
+                return None
+            first_seen = known[2] if known is not None and known[1] == generation else now
+            known = (now, generation, first_seen)
+            with self._lock:
+                self._generations[index] = known
+        _checked_at, generation, first_seen = known
+        if now - first_seen < self.settle_time:
+            return None
+        return generation
+
+
+def principals_fingerprint(principals):
+    """ Stable, short fingerprint of a set of effective principals """
+    return hashlib.sha1('\n'.join(sorted(set(principals))).encode('utf-8')).hexdigest()
+
+
+def get_index_generation_tracker(registry):
+    tracker = registry.get(INDEX_GENERATION_TRACKER)
+    if tracker is None:
+        settings = registry.settings
+        tracker = registry.setdefault(INDEX_GENERATION_TRACKER, IndexGenerationTracker(
+            check_interval=float(settings.get('search.index_generation.check_interval', DEFAULT_GENERATION_CHECK_INTERVAL)),
+            settle_time=float(settings.get('search.index_generation.settle_time', DEFAULT_GENERATION_SETTLE_TIME))
+        ))
+    return tracker
+
+
+def get_index_generation(request, index):
+    return get_index_generation_tracker(request.registry).get_generation(request.registry[ELASTIC_SEARCH], index)
+
+
+def get_expiring_cache(registry, registry_key, settings_prefix, default_max_entries, default_ttl):
+    """
+    Returns the ExpiringLRUCache stored on the registry under `registry_key`, creating it on first use,
+    or None if not enabled via `<settings_prefix>.enabled`. Size and TTL are configured with
+    `<settings_prefix>.max_entries` and `<settings_prefix>.ttl`.
+    """
+    settings = registry.settings
+    if not asbool(settings.get(settings_prefix + '.enabled', False)):
+        return None
+    cache = registry.get(registry_key)
+    if cache is None:
+        cache = registry.setdefault(registry_key, ExpiringLRUCache(
+            max_entries=int(settings.get(settings_prefix + '.max_entries', default_max_entries)),
+            ttl=float(settings.get(settings_prefix + '.ttl', default_ttl))
+        ))
+    return cache
+
+
+def get_facet_cache(registry):
+    """
+    Returns the facet result cache, or None if not enabled via `search.facet_cache.enabled`.
+    Size and TTL are configured with `search.facet_cache.max_entries` and `search.facet_cache.ttl`.
+    """
+    return get_expiring_cache(registry, FACET_CACHE, 'search.facet_cache',
+                              DEFAULT_FACET_CACHE_MAX_ENTRIES, DEFAULT_FACET_CACHE_TTL)
+
+
+def make_facet_cache_key(request, es_index, aggregations_only, custom_aggregations=None):
+    """
+    Builds the facet cache key for the current search request, or returns None if
+    results should not be cached (e.g. index generation not settled).
+
+    :param es_index: index string being searched
+    :param aggregations_only: whether extra (schema/custom) aggregations are requested too, i.e. limit=0
+    :param custom_aggregations: extra aggregations passed to search()
+    """
+    generation = get_index_generation(request, es_index)
+    if generation is None:
+        return None
+    normalized_query = sorted(
+        (k, v) for k, v in request.normalized_params.items() if k not in FACET_CACHE_IGNORED_PARAMS
+    )
+    return (
+        es_index,
+        generation,
+        json.dumps(normalized_query),
+        principals_fingerprint(request.effective_principals),
+        aggregations_only,
+        json.dumps(custom_aggregations, sort_keys=True) if custom_aggregations else None
+    )
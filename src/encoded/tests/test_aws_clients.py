@@ -0,0 +1,38 @@
+import pytest
+
+from unittest import mock
+from ..aws_clients import AWS_CLIENTS, AWSClientProvider, get_aws_client
+
+
+pytestmark = [pytest.mark.working, pytest.mark.unit]
+
+
+class FakeRegistry(dict):
+
+    def __init__(self, settings):
+        super().__init__()
+        self.settings = settings
+
+
+def test_aws_client_provider_reuses_clients():
+    with mock.patch('encoded.aws_clients.boto3') as boto3:
+        boto3.session.Session.return_value.client.side_effect = lambda *args, **kwargs: mock.Mock()
+        registry = FakeRegistry({'aws_clients.max_pool_connections': '50'})
+        s3 = get_aws_client(registry, 's3')
+        assert get_aws_client(registry, 's3') is s3
+        sqs = get_aws_client(registry, 'sqs', region_name='us-east-1')
+        assert sqs is not s3 and get_aws_client(registry, 'sqs', region_name='us-east-1') is sqs
+        assert get_aws_client(registry, 'sqs') is not sqs
+        boto3.session.Session.assert_called_once_with()
+        assert boto3.session.Session.return_value.client.call_count == 3
+        config = boto3.session.Session.return_value.client.call_args[1]['config']
+        assert config.max_pool_connections == 50
+        assert config.retries == {'max_attempts': 3, 'mode': 'standard'}
+
+
+def test_get_aws_client_uses_registered_provider():
+    stub = mock.Mock(spec=AWSClientProvider)
+    registry = FakeRegistry({})
+    registry[AWS_CLIENTS] = stub
+    assert get_aws_client(registry, 's3') is stub.client.return_value
+    stub.client.assert_called_once_with('s3', region_name=None)
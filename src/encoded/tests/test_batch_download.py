@@ -1,7 +1,17 @@
+import gzip
+import io
+import json
+import os
 import pytest
+import time
+import webtest
 
 from dcicutils.qa_utils import notice_pytest_fixtures
+from snovault.util import simple_path_ids
+from unittest import mock
+from ..export_jobs import EXPORT_JOB_APP, EXPORT_JOB_STORAGE, EXPORT_JOB_TRACKER, LocalExportStorage
 from ..util import delay_rerun
+from .test_access_key import auth_header
 # Use workbook fixture from BDD tests (including elasticsearch)
 #from .workbook_fixtures import es_app_settings, es_app, es_testapp, workbook
 
@@ -10,7 +20,8 @@ from ..util import delay_rerun
 #   See longer explanation at top of test_aggregation.py -kmp 28-Jun-2020
 # notice_pytest_fixtures(es_app_settings, es_app, es_testapp, workbook)
 
-pytestmark = [# pytest.mark.indexing,
+pytestmark = [pytest.mark.working,
+              # pytest.mark.indexing,
               pytest.mark.workbook,
               pytest.mark.flaky(rerun_filter=delay_rerun)]
 
@@ -41,3 +52,188 @@ def test_report_download(es_testapp, workbook):
         b'', b'', b'', b'', b'', b'', b''
     ]
     assert len(lines) == 44
+
+
+def test_report_download_output_formats(es_testapp, workbook):
+    """ /report.tsv in each format= gives the same rows """
+    notice_pytest_fixtures(es_testapp, workbook)
+
+    res = es_testapp.get('/report.tsv?type=Lab&sort=name')
+    assert res.headers['content-type'].startswith('text/tsv')
+    assert res.headers['content-disposition'] == 'attachment;filename="report.tsv"'
+    lines = res.body.decode('utf-8').split('\r\n')[:-1]
+    header = [column.strip() for column in lines[0].split('\t')]
+    rows = [line.split('\t') for line in lines[1:]]
+    assert len(rows) > 0 and all(len(row) == len(header) for row in rows)
+
+    gzipped_res = es_testapp.get('/report.tsv?type=Lab&sort=name&format=tsv.gz')
+    assert gzipped_res.headers['content-disposition'] == 'attachment;filename="report.tsv.gz"'
+    assert gzip.decompress(gzipped_res.body) == res.body
+
+    ndjson_res = es_testapp.get('/report.tsv?type=Lab&sort=name&format=ndjson')
+    assert ndjson_res.headers['content-type'].startswith('application/x-ndjson')
+    assert ndjson_res.headers['content-disposition'] == 'attachment;filename="report.ndjson"'
+    assert [json.loads(line) for line in ndjson_res.body.decode('utf-8').splitlines()] == [dict(zip(header, row)) for row in rows]
+
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        es_testapp.get('/report.tsv?type=Lab&sort=name&format=parquet', status=400)
+        return
+    parquet_res = es_testapp.get('/report.tsv?type=Lab&sort=name&format=parquet')
+    assert parquet_res.headers['content-disposition'] == 'attachment;filename="report.parquet"'
+    table = pq.ParquetFile(io.BytesIO(parquet_res.body)).read().to_pydict()
+    assert table == {column: [row[idx] for row in rows] for idx, column in enumerate(header)}
+
+
+def test_export_job_report_end_to_end(es_testapp, workbook):
+    """ An export job of /report.tsv runs in the background, as the same user, and its output is the same """
+    notice_pytest_fixtures(es_testapp, workbook)
+    expected = es_testapp.get('/report.tsv?type=Lab&sort=name').body
+
+    job = es_testapp.post('/export-jobs/report/?type=Lab&sort=name', status=202).json
+    assert job['status'] in ('queued', 'running', 'done')
+    for _ in range(120):
+        job = es_testapp.get(job['@id']).json
+        if job['status'] not in ('queued', 'running'):
+            break
+        time.sleep(0.5)
+    assert job['status'] == 'done', job.get('error')
+    assert job['bytes_written'] == len(expected)
+
+    res = es_testapp.get(job['download'])
+    assert res.headers['content-disposition'] == 'attachment;filename="report.tsv"'
+    assert res.body == expected
+    es_testapp.get('/export-jobs/metadata/{}/'.format(job['job_id']), status=404)
+
+
+def test_batch_download_streams_file_hrefs(es_testapp, workbook):
+    notice_pytest_fixtures(es_testapp, workbook)
+
+    res = es_testapp.get('/batch_download/type=ExperimentHiC')
+    assert res.headers['content-disposition'] == 'attachment; filename="files.txt"'
+    lines = res.text.split('\n')
+    assert lines[0].endswith('/metadata/type=ExperimentHiC/metadata.tsv')
+    assert len(lines) > 1 and all('/@@download/' in line for line in lines[1:])
+
+    gzipped_res = es_testapp.get('/batch_download/type=ExperimentHiC?format=txt.gz')
+    assert gzipped_res.headers['content-disposition'] == 'attachment; filename="files.txt.gz"'
+    assert gzip.decompress(gzipped_res.body).decode('utf-8') == res.text
+
+
+def matches_es_filters(item, filters):
+    """ Applies `terms` (and bool `should` of `terms`) filters on embedded.<path>.raw fields to an embedded item """
+    def matches_terms(clause):
+        (field, values), = clause['terms'].items()
+        path = field[len('embedded.'):-len('.raw')]
+        return not set(values).isdisjoint(str(value) for value in simple_path_ids(item, path))
+    return all(any(matches_terms(clause) for clause in f['bool']['should']) if 'bool' in f else matches_terms(f)
+               for f in filters or [])
+
+
+def make_metadata_file(accession, file_type, classification):
+    return {
+        'accession': accession, 'href': '/files-fastq/%s/@@download/%s.fastq.gz' % (accession, accession),
+        'file_type': file_type, 'file_classification': classification, 'status': 'released',
+        'file_format': {'display_title': 'fastq'}, 'md5sum': 'd41d8cd98f00b204e9800998ecf8427e', 'file_size': 1048576
+    }
+
+
+def test_metadata_tsv_reference_file_only_triple(testapp):
+    """ Reference files selected on their own (Supplementary Files tab) keep their ExperimentSet in ES results """
+    exp_set = {
+        'accession': '4DNESREF0001', 'status': 'released',
+        'experiments_in_set': [{
+            'accession': '4DNEXREF0001',
+            'files': [make_metadata_file('4DNFIRAW0001', 'reads', 'raw file')],
+            'reference_files': [make_metadata_file('4DNFIREF0001', 'genome assembly', 'ancillary file')]
+        }]
+    }
+
+    def search_results(request, search_path, search_params, extra_filters=None):
+        return [item for item in [exp_set] if matches_es_filters(item, extra_filters)]
+
+    with mock.patch('encoded.batch_download.get_iterable_search_results', side_effect=search_results):
+        res = testapp.post('/metadata/?type=ExperimentSetReplicate', {
+            'accession_triples': json.dumps([['4DNESREF0001', '4DNEXREF0001', '4DNFIREF0001']]),
+            'download_file_name': json.dumps('metadata_TEST.tsv')
+        })
+    rows = [row.split('\t') for row in res.text.split('\r\n') if row and not row.startswith('###')]
+    file_accession_index = [column.strip() for column in rows[0]].index('File Accession')
+    assert [row[file_accession_index] for row in rows[1:]] == ['4DNFIREF0001']
+
+
+@pytest.fixture
+def local_export_jobs(app, tmp_path):
+    """ Storage of the export jobs of `app` under `tmp_path`, with a tracker of their own """
+    registry = app.registry
+    saved = {key: registry.pop(key, None) for key in (EXPORT_JOB_STORAGE, EXPORT_JOB_TRACKER)}
+    storage = registry[EXPORT_JOB_STORAGE] = LocalExportStorage(str(tmp_path))
+    yield storage
+    for key, value in saved.items():
+        registry.pop(key, None)
+        if value is not None:
+            registry[key] = value
+
+
+def wait_for_export_job(testapp, job):
+    for _ in range(60):
+        job = testapp.get(job['@id']).json
+        if job['status'] not in ('queued', 'running'):
+            break
+        time.sleep(0.5)
+    return job
+
+
+def test_export_job_metadata_with_local_storage(app, testapp, local_export_jobs):
+    """ An export job of /metadata/ runs in a standalone request, as the same user, and its output is downloadable """
+    assert app.registry[EXPORT_JOB_APP] is app
+    exp_set = {
+        'accession': '4DNESJOB0001', 'status': 'released',
+        'experiments_in_set': [{
+            'accession': '4DNEXJOB0001',
+            'files': [make_metadata_file('4DNFIJOB0001', 'reads', 'raw file'),
+                      make_metadata_file('4DNFIJOB0002', 'reads', 'raw file')]
+        }]
+    }
+    remote_users = []
+
+    def search_results(request, search_path, search_params, extra_filters=None):
+        remote_users.append(request.remote_user)
+        return [item for item in [exp_set] if matches_es_filters(item, extra_filters)]
+
+    with mock.patch('encoded.batch_download.get_iterable_search_results', side_effect=search_results):
+        job = testapp.post_json('/export-jobs/metadata/?type=ExperimentSetReplicate', {
+            'accession_triples': [['4DNESJOB0001', '4DNEXJOB0001', '4DNFIJOB0002']],
+            'download_file_name': 'metadata_JOB.tsv'
+        }, status=202).json
+        assert 'userid' not in job
+        job = wait_for_export_job(testapp, job)
+    assert job['status'] == 'done', job.get('error')
+    assert remote_users and set(remote_users) == {'TEST'}
+    assert os.path.exists(local_export_jobs.path(job['job_id'], 'output'))
+
+    res = testapp.get(job['download'])
+    assert res.headers['content-disposition'] == 'attachment;filename="metadata_JOB.tsv"'
+    assert len(res.body) == job['bytes_written']
+    rows = [row.split('\t') for row in res.text.split('\r\n') if row and not row.startswith('###')]
+    file_accession_index = [column.strip() for column in rows[0]].index('File Accession')
+    assert [row[file_accession_index] for row in rows[1:]] == ['4DNFIJOB0002']
+
+
+def test_export_job_visible_to_its_user_only(app, testapp, anontestapp, submitter, access_key, local_export_jobs):
+    """ Jobs are owned by the user item of their creator, whether they use a JWT, an access key or REMOTE_USER """
+    submitter_testapp = webtest.TestApp(app, {'HTTP_ACCEPT': 'application/json', 'REMOTE_USER': submitter['uuid']})
+    access_key_headers = {'Authorization': auth_header(access_key)}
+    with mock.patch('encoded.export_jobs.get_export_job_executor'):  # jobs stay queued
+        job = submitter_testapp.post('/export-jobs/report/?type=Lab', status=202).json
+        test_job = testapp.post('/export-jobs/report/?type=Lab', status=202).json
+    assert local_export_jobs.read_status(job['job_id'])['userid'] == 'userid.' + submitter['uuid']
+
+    assert anontestapp.get(job['@id'], headers=access_key_headers).json['job_id'] == job['job_id']
+    assert submitter_testapp.get(job['@id']).json['status'] == 'queued'
+    testapp.get(job['@id'], status=404)
+    anontestapp.get(job['@id'], status=404)
+    submitter_testapp.get(test_job['@id'], status=404)
+    anontestapp.get(test_job['@id'], headers=access_key_headers, status=404)
+    submitter_testapp.get(job['@id'] + 'download', status=404)  # not done
@@ -0,0 +1,236 @@
+import gzip
+import io
+import json
+import pytest
+import random
+import sys
+import time
+
+from pyramid.httpexceptions import HTTPBadRequest
+from snovault.util import simple_path_ids
+from unittest import mock
+from ..batch_download import (
+    AccessionTripleIndex,
+    BufferedChunkWriter,
+    ColumnExtractor,
+    EXP,
+    EXP_SET,
+    FILE,
+    FILE_ONLY,
+    TSV_MAPPING,
+    filename_for_output_format,
+    get_accession_triple_filters,
+    get_output_format,
+    gzip_stream,
+    ndjson_stream,
+    parquet_stream,
+)
+
+
+pytestmark = [pytest.mark.working, pytest.mark.unit]
+
+
+def first_matching_triple_by_scan(accession_triples, column_vals_dict):
+    """ Reference implementation: the linear scan metadata_tsv used to do for every file row """
+    for set_accession, exp_accession, file_accession in accession_triples:
+        if (
+            (('Experiment Set Accession' in column_vals_dict and set_accession == column_vals_dict['Experiment Set Accession']) or set_accession == 'NONE') and
+            (('Experiment Accession' in column_vals_dict and exp_accession == column_vals_dict['Experiment Accession']) or exp_accession == 'NONE') and
+            (file_accession == column_vals_dict['File Accession'] or column_vals_dict['Related File Relationship'] == 'reference file for' or file_accession == 'NONE')
+        ):
+            return (set_accession, exp_accession, file_accession)
+    return None
+
+
+def test_accession_triple_index_matches_linear_scan():
+    rng = random.Random(4)
+    set_accs, exp_accs, file_accs = ['S1', 'S2', 'NONE'], ['E1', 'E2', 'E3', 'NONE'], ['F1', 'F2', 'F3', 'F4', 'NONE']
+    for _ in range(200):
+        triples = [(rng.choice(set_accs), rng.choice(exp_accs), rng.choice(file_accs)) for _ in range(rng.randint(1, 8))]
+        index = AccessionTripleIndex(triples)
+        for _ in range(20):
+            row = {
+                'File Accession': rng.choice(file_accs),
+                'Related File Relationship': rng.choice(['', 'reference file for', 'secondary file for'])
+            }
+            if rng.random() < 0.9:
+                row['Experiment Set Accession'] = rng.choice(set_accs)
+            if rng.random() < 0.9:
+                row['Experiment Accession'] = rng.choice(exp_accs)
+            assert index.first_match(row) == first_matching_triple_by_scan(triples, row)
+    assert AccessionTripleIndex([('S1', 'E1', 'F1')]).has_file_accession('F1')
+
+
+def test_accession_triple_filters():
+    filters = get_accession_triple_filters([('S1', 'E1', 'F1'), ('S2', 'E2, E3', 'F2')], 'ExperimentSetReplicate')
+    assert filters[0] == {'terms': {'embedded.accession.raw': ['S1', 'S2']}}
+    assert filters[1] == {'terms': {'embedded.experiments_in_set.accession.raw': ['E1', 'E2', 'E3']}}
+    assert {'terms': {'embedded.processed_files.accession.raw': ['F1', 'F2']}} in filters[2]['bool']['should']
+    assert {'terms': {'embedded.experiments_in_set.reference_files.accession.raw': ['F1', 'F2']}} \
+        in filters[2]['bool']['should']
+    # wildcards disable filtering on their level only
+    filters = get_accession_triple_filters([('S1', 'NONE', 'F1'), ('NONE', 'E2', 'F2')], 'ExperimentSetReplicate')
+    assert len(filters) == 1 and 'bool' in filters[0]
+    assert get_accession_triple_filters([('S1', 'E1', 'F1')], 'FileProcessed') == [{'terms': {'embedded.accession.raw': ['F1']}}]
+    assert get_accession_triple_filters([('S1', 'E1', 'NONE')], 'FileProcessed') == []
+
+
+def value_for_column_by_paths(item, col):
+    """ Column value as computed per-path, before ColumnExtractor; values ordering may differ when deduplicated. """
+    temp = []
+    for field in TSV_MAPPING[col][1]:
+        c_value = [str(value) for value in simple_path_ids(item, field)]
+        if TSV_MAPPING[col][2]:
+            c_value = list(set(c_value))
+        if len(temp):
+            if len(c_value):
+                temp = [x + ' ' + c_value[0] for x in temp]
+        else:
+            temp = c_value
+    return ', '.join(list(set(temp))) if TSV_MAPPING[col][2] else ', '.join(temp)
+
+
+def make_embedded_file(accession, file_type='fastq'):
+    return {
+        'accession': accession, 'href': '/files-fastq/%s/@@download/%s.fastq.gz' % (accession, accession),
+        'file_size': 1048576, 'md5sum': 'd41d8cd98f00b204e9800998ecf8427e', 'file_type': file_type,
+        'file_format': {'display_title': 'fastq'}, 'status': 'released', 'paired_end': '1',
+        'related_files': [{'relationship_type': 'paired with', 'file': {'accession': accession + 'P'}}],
+        'track_and_facet_info': {'experiment_type': 'in situ Hi-C', 'replicate_info': 'Biorep 1, Techrep 1',
+                                 'biosource_name': 'GM12878', 'lab_name': '4DN DCIC, HMS', 'dataset': 'Hi-C on GM12878',
+                                 'condition': 'DpnII', 'experiment_bucket': 'raw file', 'experimental_lab': '4DN DCIC, HMS'},
+        'contributing_labs': [{'display_title': 'Lab A'}, {'display_title': 'Lab B'}, {'display_title': 'Lab A'}],
+        'notes_to_tsv': ['note 1', 'note 2'], 'open_data_url': None, 'file_classification': 'raw file'
+    }
+
+
+def make_embedded_experiment_set(n_exps=4, n_files=6):
+    """ Shaped like a frame=embedded ExperimentSetReplicate search result with fields requested by /metadata/ """
+    experiments = [{
+        'accession': '4DNEX%05d' % e,
+        'biosample': {'biosource': [{'biosource_type': 'immortalized cell line', 'organism': {'name': 'human'}}]},
+        'files': [make_embedded_file('4DNFI%03d%03d' % (e, f)) for f in range(n_files)],
+        'processed_files': [make_embedded_file('4DNFP%03d' % e, 'pairs')],
+        'reference_files': [make_embedded_file('4DNFR%03d' % e, 'reference')]
+    } for e in range(n_exps)]
+    return {
+        'accession': '4DNES0000001', 'status': 'released', 'award': {'project': '4DN'},
+        'produced_in_pub': {'short_attribution': 'Someone et al. (2020)'},
+        'replicate_exps': [{'bio_rep_no': 1, 'tec_rep_no': e + 1, 'replicate_exp': {'accession': exp['accession']}}
+                           for e, exp in enumerate(experiments)],
+        'experiments_in_set': experiments,
+        'processed_files': [make_embedded_file('4DNFS%03d' % f, 'contact list-combined') for f in range(3)]
+    }
+
+
+def column_extractors_and_items():
+    exp_set = make_embedded_experiment_set()
+    exp = exp_set['experiments_in_set'][0]
+    return [
+        (ColumnExtractor([col for col, v in TSV_MAPPING.items() if v[0] == EXP_SET]), exp_set),
+        (ColumnExtractor([col for col, v in TSV_MAPPING.items() if v[0] == EXP]), exp),
+        (ColumnExtractor([col for col, v in TSV_MAPPING.items() if v[0] in (FILE, FILE_ONLY)]), exp['files'][0]),
+    ]
+
+
+def test_column_extractor_matches_per_path_values():
+    for extractor, item in column_extractors_and_items():
+        row_vals = extractor.extract(item)
+        for col, fields, remove_duplicates in extractor.columns:
+            expected = value_for_column_by_paths(item, col)
+            if remove_duplicates:  # dedupe order used to be arbitrary
+                assert sorted(row_vals[col].split(', ')) == sorted(expected.split(', '))
+            else:
+                assert row_vals[col] == expected
+    all_exps_extractor = ColumnExtractor(['Experiment Accession', 'Organism'], path_prefix='experiments_in_set.')
+    joined = all_exps_extractor.extract_joined_per_field(make_embedded_experiment_set(n_exps=2))
+    assert joined == {'Experiment Accession': '4DNEX00000, 4DNEX00001', 'Organism': 'human'}
+
+
+@pytest.mark.performance
+def test_column_extractor_benchmark():
+    """ Run with `pytest -s -m performance` to see timings """
+    items = column_extractors_and_items()
+    rounds = 2000
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for extractor, item in items:
+            {col: value_for_column_by_paths(item, col) for col, fields, remove_duplicates in extractor.columns}
+    per_path_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for extractor, item in items:
+            extractor.extract(item)
+    extractor_time = time.perf_counter() - start
+
+    # timings only, as wall clock comparisons are flaky; equivalence is tested above
+    print('\nper-path: %.3fs, ColumnExtractor: %.3fs (%d rounds)' % (per_path_time, extractor_time, rounds))
+
+
+def test_buffered_chunk_writer():
+    with mock.patch('encoded.batch_download.time.monotonic', return_value=100):
+        out = BufferedChunkWriter(chunk_size=10, flush_interval=5)
+        assert out.pop_chunk(force=True) is None
+        out.write('héllo')
+        assert out.pop_chunk() is None
+        out.write('\tworld\r\n')
+        assert out.pop_chunk() == 'héllo\tworld\r\n'.encode('utf-8')
+        out.write('x')
+    with mock.patch('encoded.batch_download.time.monotonic', return_value=106):
+        assert out.pop_chunk() == b'x'  # flush interval passed
+
+
+def test_gzip_stream_round_trip():
+    chunks = [('row %d\tvalue\r\n' % i).encode('utf-8') for i in range(1000)]
+    assert gzip.decompress(b''.join(gzip_stream(chunks))) == b''.join(chunks)
+
+
+def test_ndjson_stream_with_summary():
+    lines = list(ndjson_stream(['Experiment Set Accession ', 'File Accession'], [['S1', 'F1'], ['S1', None]],
+                               lambda: ['Summary']))
+    assert [json.loads(line) for line in lines] == [
+        {'Experiment Set Accession': 'S1', 'File Accession': 'F1'},
+        {'Experiment Set Accession': 'S1', 'File Accession': None},
+        {'summary': ['Summary']}
+    ]
+
+
+def test_filename_for_output_format():
+    assert filename_for_output_format('metadata_2020.tsv', 'tsv') == 'metadata_2020.tsv'
+    assert filename_for_output_format('metadata_2020.tsv', 'tsv.gz') == 'metadata_2020.tsv.gz'
+    assert filename_for_output_format('report.tsv', 'parquet') == 'report.parquet'
+
+
+def test_parquet_stream_batches_and_summary():
+    pq = pytest.importorskip('pyarrow.parquet')
+    rows = [['F%d' % i, str(i) if i % 2 else None] for i in range(25)]
+    data = b''.join(parquet_stream(['File Accession', 'Size (MB)'], iter(rows), lambda: ['Total Files: 25'], batch_size=10))
+    parquet_file = pq.ParquetFile(io.BytesIO(data))
+    assert parquet_file.metadata.num_row_groups == 3
+    assert parquet_file.metadata.metadata[b'summary'] == b'Total Files: 25'
+    assert parquet_file.read().to_pydict() == {'File Accession': [r[0] for r in rows], 'Size (MB)': [r[1] for r in rows]}
+
+
+def test_parquet_stream_without_rows():
+    pq = pytest.importorskip('pyarrow.parquet')
+    data = b''.join(parquet_stream(['File Accession', 'Size (MB)'], iter([])))
+    parquet_file = pq.ParquetFile(io.BytesIO(data))
+    assert parquet_file.schema_arrow.names == ['File Accession', 'Size (MB)']
+    assert parquet_file.metadata.num_rows == 0
+    assert b'summary' not in (parquet_file.metadata.metadata or {})
+
+
+@pytest.mark.parametrize('pyarrow_version, available', [('10.0.1', False), ('11.0.0', True), ('16.1.0', True)])
+def test_get_output_format_parquet_requires_pyarrow(pyarrow_version, available):
+    request = mock.Mock(GET={'format': 'Parquet'})
+    with mock.patch.dict(sys.modules, {'pyarrow': mock.Mock(__version__=pyarrow_version)}):
+        if available:
+            assert get_output_format(request) == 'parquet'
+        else:
+            with pytest.raises(HTTPBadRequest):
+                get_output_format(request)
+    with mock.patch.dict(sys.modules, {'pyarrow': None}):  # not installed
+        with pytest.raises(HTTPBadRequest):
+            get_output_format(request)
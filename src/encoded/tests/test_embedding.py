@@ -1,8 +1,11 @@
 import pytest
 
+from unittest import mock
 from snovault import TYPES
 from snovault.util import add_default_embeds, crawl_schemas_by_embeds
-from ..types.base import get_item_or_none
+from ..types.base import (
+    get_computed_memo, get_item_object, get_item_object_memo, get_item_or_none, get_memoized
+)
 from .datafixtures import ORDER
 
 
@@ -164,3 +167,88 @@ def test_get_item_or_none(content, dummy_request, threadlocals):
         assert res['name'] == used_item['name']
         assert '@id' in res
         assert '@type' in res
+
+
+def test_get_item_or_none_memoizes_object_frame(content, dummy_request, threadlocals):
+    used_item = sources[0]
+    memo = get_item_object_memo(dummy_request)
+    res1 = get_item_or_none(dummy_request, used_item['uuid'])
+    res2 = get_item_object(dummy_request, {'uuid': used_item['uuid']})
+    assert res2 is res1 and res1['name'] == used_item['name']
+    assert (memo.hits, memo.misses) == (1, 1)
+    assert dummy_request._stats['item_object_memo_hits'] == 1
+    assert get_item_or_none(dummy_request, '/testing-link-sources/not-an-item/') is None
+
+
+class FakeIndexingRequest(object):
+    method = 'POST'
+    _indexing_view = True
+
+    def __init__(self):
+        self.registry = mock.Mock(settings={})  # no reference item cache
+        self._linked_uuids = set()
+        self._rev_linked_uuids_by_item = {}
+        self.embedded_paths = []
+
+    def embed(self, path, frame):
+        self.embedded_paths.append(path)
+        self._linked_uuids.add((path.strip('/'), 'TestingLinkTarget'))
+        self._rev_linked_uuids_by_item[path.strip('/')] = {'reverse': ['some-uuid']}
+        return {'@id': path}
+
+
+def test_item_object_memo_replays_linked_uuids_when_indexing():
+    first, second = FakeIndexingRequest(), FakeIndexingRequest()
+    memo = get_item_object_memo(first)
+    second._item_object_memo = memo  # as if both were embeds within the same @@index-data request
+    assert get_item_object(first, 'abc') == get_item_object(second, 'abc') == {'@id': '/abc/'}
+    assert first.embedded_paths == ['/abc/'] and second.embedded_paths == []
+    assert second._linked_uuids == first._linked_uuids == {('abc', 'TestingLinkTarget')}
+    assert second._rev_linked_uuids_by_item == {'abc': {'reverse': ['some-uuid']}}
+
+
+class FakeIndexerRequest(object):
+    """ Request indexing a batch of Items, parent of their @@index-data requests """
+    _indexing_view = False
+
+
+def test_get_memoized_replays_linked_uuids_when_indexing():
+    first, second = FakeIndexingRequest(), FakeIndexingRequest()  # @@index-data requests of the same batch
+    first.__parent__ = second.__parent__ = FakeIndexerRequest()
+    memo = get_computed_memo(first)
+
+    def compute_for(request):
+        return lambda: {'experiment': get_item_object(request, 'abc')['@id']}
+
+    assert get_memoized(first, 'context', compute_for(first)) == {'experiment': '/abc/'}
+    assert get_memoized(second, 'context', compute_for(second)) == {'experiment': '/abc/'}
+    assert first.embedded_paths == ['/abc/'] and second.embedded_paths == []
+    assert memo.computed_misses == 1 and memo.computed_hits == 1
+    assert get_item_object_memo(first) is not get_item_object_memo(second)  # objects are not kept per batch
+    assert second._linked_uuids == first._linked_uuids == {('abc', 'TestingLinkTarget')}
+    assert second._rev_linked_uuids_by_item == {'abc': {'reverse': ['some-uuid']}}
+
+
+def test_item_object_memo_is_scoped_to_index_data_request():
+    indexer = FakeIndexerRequest()
+    index_data, other_index_data, embed = FakeIndexingRequest(), FakeIndexingRequest(), FakeIndexingRequest()
+    index_data.__parent__ = other_index_data.__parent__ = indexer
+    embed.__parent__ = index_data
+    memo = get_item_object_memo(embed)
+    assert get_item_object_memo(index_data) is memo
+    assert get_item_object_memo(other_index_data) is not memo
+    computed_memo = get_computed_memo(embed)
+    assert computed_memo is not memo and get_computed_memo(other_index_data) is computed_memo
+    assert get_computed_memo(FakeIndexingRequest()) is not computed_memo  # another batch
+
+
+def test_item_object_memo_is_bounded():
+    request = FakeIndexingRequest()
+    request.registry.settings['item_object_memo.capacity'] = '2'
+    memo = get_item_object_memo(request)
+    for name in ['a', 'b', 'c', 'd', 'e']:
+        get_item_object(request, name)
+    assert len(memo.entries) <= 3  # LRUCache of sqlalchemy lets size exceed capacity by half before pruning
+    get_item_object(request, 'e')
+    get_item_object(request, 'a')
+    assert request.embedded_paths == ['/a/', '/b/', '/c/', '/d/', '/e/', '/a/']
@@ -0,0 +1,180 @@
+import json
+import os
+import pytest
+import time
+
+from datetime import datetime, timedelta, timezone
+from pyramid.httpexceptions import HTTPNotImplemented
+from pyramid.registry import Registry
+from pyramid.request import Request
+from pyramid.response import Response
+from unittest import mock
+from ..export_jobs import (
+    EXPORT_JOB_STORAGE,
+    ExportJobTracker,
+    LocalExportStorage,
+    S3ExportStorage,
+    check_export_job,
+    get_export_job_owner,
+    get_export_job_storage,
+    get_export_remote_user,
+    make_export_request,
+    now_isoformat,
+    run_export_job,
+)
+
+
+pytestmark = [pytest.mark.working, pytest.mark.unit]
+
+
+def make_job(storage, job_id='0f2b37d9-0b4c-4b4e-9f55-2d3a0a9d5d6e'):
+    job = {'job_id': job_id, 'export_type': 'report', 'status': 'queued', 'created': now_isoformat(),
+           'bytes_written': 0, 'userid': None}
+    storage.write_status(job)
+    return job
+
+
+def test_run_export_job_writes_output_and_status(tmp_path):
+    storage = LocalExportStorage(str(tmp_path))
+    job = make_job(storage)
+    chunks = [b'ID\tAccession\r\n', b'/a/\tA\r\n', b'/b/\tB\r\n']
+    response = Response(content_type='text/tsv', app_iter=iter(chunks),
+                        content_disposition='attachment;filename="report.tsv"')
+
+    run_export_job(ExportJobTracker(storage), job, lambda: response, progress_interval=0)
+
+    status = storage.read_status(job['job_id'])
+    assert status['status'] == 'done'
+    assert status['bytes_written'] == sum(len(chunk) for chunk in chunks)
+    assert status['content_disposition'] == 'attachment;filename="report.tsv"'
+    with open(storage.path(job['job_id'], 'output'), 'rb') as output:
+        assert output.read() == b''.join(chunks)
+
+
+def test_run_export_job_records_failures(tmp_path):
+    storage = LocalExportStorage(str(tmp_path))
+    job = make_job(storage)
+
+    def failing_rows():
+        yield b'ID\r\n'
+        raise ValueError('ES went away')
+
+    tracker = ExportJobTracker(storage)
+    run_export_job(tracker, job, lambda: Response(app_iter=failing_rows()))
+    status = storage.read_status(job['job_id'])
+    assert status['status'] == 'failed' and 'ES went away' in status['error']
+
+    job = make_job(storage, job_id='5b4a4c0e-6c1a-4f2e-8d3e-1f7a2b9c0d11')
+    run_export_job(tracker, job, lambda: Response(status=400, body=b'Report view requires specifying a single type.'))
+    status = storage.read_status(job['job_id'])
+    assert status['status'] == 'failed' and 'single type' in status['error']
+
+
+def test_local_export_storage_missing_job(tmp_path):
+    assert LocalExportStorage(str(tmp_path)).read_status('0f2b37d9-0b4c-4b4e-9f55-2d3a0a9d5d6e') is None
+
+
+def test_export_job_tracker_heartbeat(tmp_path):
+    storage = LocalExportStorage(str(tmp_path))
+    tracker = ExportJobTracker(storage, heartbeat_interval=3600)
+    job = make_job(tracker)
+    assert list(tracker.active_jobs) == [job['job_id']]
+    first_heartbeat = storage.read_status(job['job_id'])['heartbeat']
+    time.sleep(0.01)
+    tracker.beat()
+    assert storage.read_status(job['job_id'])['heartbeat'] > first_heartbeat
+    job['status'] = 'done'
+    tracker.write_status(job)
+    assert tracker.active_jobs == {}
+
+
+def test_check_export_job_fails_stale_jobs_and_expires_old_ones(tmp_path):
+    storage = LocalExportStorage(str(tmp_path))
+    job = make_job(storage)
+    assert check_export_job(storage, dict(job, heartbeat=now_isoformat()))['status'] == 'queued'
+
+    stale_heartbeat = (datetime.utcnow() - timedelta(minutes=10)).isoformat() + '+00:00'
+    assert check_export_job(storage, dict(job, heartbeat=stale_heartbeat))['status'] == 'failed'
+    assert storage.read_status(job['job_id'])['status'] == 'failed'
+
+    created = (datetime.utcnow() - timedelta(days=8)).isoformat() + '+00:00'
+    assert check_export_job(storage, dict(job, status='done', created=created), retention=7 * 24 * 60 * 60) is None
+
+
+def test_local_export_storage_delete_expired(tmp_path):
+    storage = LocalExportStorage(str(tmp_path))
+    old_job, new_job = make_job(storage), make_job(storage, job_id='5b4a4c0e-6c1a-4f2e-8d3e-1f7a2b9c0d11')
+    old_directory = os.path.join(str(tmp_path), old_job['job_id'])
+    two_days_ago = time.time() - 2 * 24 * 60 * 60
+    for path in [old_directory, storage.path(old_job['job_id'], 'status.json')]:
+        os.utime(path, (two_days_ago, two_days_ago))
+    storage.delete_expired(24 * 60 * 60)
+    assert not os.path.exists(old_directory)
+    assert storage.read_status(new_job['job_id']) == new_job
+    LocalExportStorage(str(tmp_path / 'missing')).delete_expired(0)
+
+
+def test_s3_export_storage_delete_expired():
+    now = datetime.now(timezone.utc)
+    client = mock.Mock()
+    client.get_paginator.return_value.paginate.return_value = [
+        {'Contents': [{'Key': 'old/status.json', 'LastModified': now - timedelta(days=2)},
+                      {'Key': 'old/output', 'LastModified': now - timedelta(days=2)},
+                      {'Key': 'new/status.json', 'LastModified': now}]},
+        {},
+    ]
+    S3ExportStorage('export-bucket', client=client).delete_expired(24 * 60 * 60)
+    client.get_paginator.return_value.paginate.assert_called_once_with(Bucket='export-bucket')
+    client.delete_objects.assert_called_once_with(Bucket='export-bucket', Delete={
+        'Objects': [{'Key': 'old/status.json'}, {'Key': 'old/output'}], 'Quiet': True
+    })
+
+
+def test_get_export_job_storage_requires_bucket_outside_development(tmp_path):
+    registry = Registry()
+    registry.settings = {}
+    with pytest.raises(HTTPNotImplemented):
+        get_export_job_storage(registry)
+    registry.settings = {'export_jobs.directory': str(tmp_path)}
+    assert get_export_job_storage(registry).directory == str(tmp_path)
+    del registry[EXPORT_JOB_STORAGE]
+    registry.settings = {'testing': 'true'}
+    assert isinstance(get_export_job_storage(registry), LocalExportStorage)
+
+
+USER_UUID = '986b362f-4eb6-4a9c-8173-3ab267307e3a'
+
+
+def make_user_request(authenticated_userid, principals=()):
+    return mock.Mock(authenticated_userid=authenticated_userid,
+                     effective_principals=['system.Everyone', 'system.Authenticated'] + list(principals))
+
+
+def test_get_export_job_owner():
+    assert get_export_job_owner(mock.Mock(authenticated_userid=None)) is None
+    assert get_export_job_owner(make_user_request('remoteuser.TEST', ['group.admin'])) == 'remoteuser.TEST'
+    # same owner for the same user, whichever way they authenticated
+    for userid in ['accesskey.ABCDEFGH', 'auth0.encode_submitter@example.org', 'remoteuser.' + USER_UUID]:
+        assert get_export_job_owner(make_user_request(userid, [userid, 'userid.' + USER_UUID])) == 'userid.' + USER_UUID
+
+
+def test_get_export_remote_user():
+    assert get_export_remote_user(mock.Mock(authenticated_userid=None)) is None
+    assert get_export_remote_user(make_user_request('remoteuser.TEST', ['group.admin'])) == 'TEST'
+    request = make_user_request('accesskey.ABCDEFGH', ['userid.' + USER_UUID])
+    assert get_export_remote_user(request) == USER_UUID
+    assert get_export_remote_user(make_user_request('auth0.someone@example.org')) is None  # no user item
+
+
+def test_make_export_request():
+    app = mock.Mock(request_factory=Request)
+    request = make_export_request(app, 'report', 'type=Lab&sort=name', {}, None)
+    assert request.method == 'GET' and request.path_qs == '/report.tsv?type=Lab&sort=name'
+    assert 'REMOTE_USER' not in request.environ
+
+    triples = [['4DNESXP5VE8C', '4DNEXO67APU1', '4DNFIO67APU1']]
+    request = make_export_request(app, 'metadata', 'type=ExperimentSetReplicate', {'accession_triples': triples},
+                                  'TEST')
+    assert request.method == 'POST' and request.path_qs == '/metadata/?type=ExperimentSetReplicate'
+    assert request.environ['REMOTE_USER'] == 'TEST'
+    assert json.loads(request.POST['accession_triples']) == triples
@@ -317,15 +317,17 @@ def test_files_open_data_url_released_not_transferred(testapp, fastq_json_releas
 
 def test_files_open_data_url_released_and_transferred(testapp, fastq_json_released):
     """ Test S3 Open Data URL when a file has been released and has been transferred to Open Data"""
-    with mock.patch('encoded.types.file.File._head_s3', return_value=None):
-        res = testapp.post_json('/file_fastq', fastq_json_released, status=201)
-        bucket = '4dn-open-data-public' # the Open Data bucket, not the 4DN test bucket
-        resobj = res.json['@graph'][0]
-        # 1. check that initial download works
-        download_link = resobj['href']
-        direct_res = testapp.get(download_link, status=307)
-        # 2. check that the bucket in the redirect is the open data bucket, not 4DN test
-        assert bucket in [i[1] for i in direct_res.headerlist if i[0] == 'Location'][0]
+    fastq_json_released['open_data_location'] = 'wfoutput'  # as recorded by reconcile-open-data
+    res = testapp.post_json('/file_fastq', fastq_json_released, status=201)
+    bucket = '4dn-open-data-public' # the Open Data bucket, not the 4DN test bucket
+    resobj = res.json['@graph'][0]
+    assert resobj['open_data_url'] == ('https://4dn-open-data-public.s3.amazonaws.com/fourfront-webprod/wfoutput/'
+                                       + resobj['upload_key'])
+    # 1. check that initial download works
+    download_link = resobj['href']
+    direct_res = testapp.get(download_link, status=307)
+    # 2. check that the bucket in the redirect is the open data bucket, not 4DN test
+    assert bucket in [i[1] for i in direct_res.headerlist if i[0] == 'Location'][0]
 
 
 @pytest.mark.integrated
@@ -536,7 +538,7 @@ def test_create_file_request_proper_s3_resource(registry, fastq_json):
             # check that we would have called aws
             expected_s3_key = "1234567/%s.fastq.gz" % (fastq_json['accession'])
             external_creds.assert_called_once_with('test-wfout-bucket', expected_s3_key,
-                                                   fastq_json['filename'], 'test-profile')
+                                                   fastq_json['filename'], 'test-profile', registry=registry)
 
 
 def test_name_for_replaced_file_is_uuid(registry, fastq_json):
@@ -1,5 +1,4 @@
 import pytest
-from unittest import mock
 
 
 pytestmark = [pytest.mark.setone, pytest.mark.working]
@@ -19,6 +18,7 @@ def mcool_file_json(award, experiment, lab, file_formats):
         'content_md5sum': '00000000000000000000000000000000',
         'filename': 'my.cool.mcool',
         'status': 'released',
+        'open_data_location': 'wfoutput',
     }
     return item
 
@@ -41,6 +41,13 @@ def file(testapp, award, experiment, lab, file_formats):
     return res.json['@graph'][0]
 
 
+@pytest.fixture
+def open_data_file(testapp, file):
+    """ File above, as transferred to the Open Data bucket """
+    res = testapp.patch_json(file['@id'], {'open_data_location': 'wfoutput'})
+    return res.json['@graph'][0]
+
+
 def validate_drs_conversion(drs_obj, meta, uri=None):
     # import pdb; pdb.set_trace()
     """ Validates drs object structure against the metadata in the db """
@@ -59,42 +66,38 @@ def validate_drs_conversion(drs_obj, meta, uri=None):
 
 def test_processed_file_drs_view(testapp, mcool_file_json):
     """ Tests that processed mcool gives a valid DRS response """
-    with mock.patch('encoded.types.file.File._head_s3', return_value=None):
-        meta = testapp.post_json('/file_processed', mcool_file_json).json['@graph'][0]
-        drs_meta = testapp.get(meta['@id'] + '@@drs').json
-        validate_drs_conversion(drs_meta, meta)
-        drs_meta = testapp.get(f'{DRS_PREFIX}/{meta["uuid"]}').json
-        validate_drs_conversion(drs_meta, meta, uri=f'{DRS_PREFIX}/{meta["uuid"]}')
+    meta = testapp.post_json('/file_processed', mcool_file_json).json['@graph'][0]
+    drs_meta = testapp.get(meta['@id'] + '@@drs').json
+    validate_drs_conversion(drs_meta, meta)
+    drs_meta = testapp.get(f'{DRS_PREFIX}/{meta["uuid"]}').json
+    validate_drs_conversion(drs_meta, meta, uri=f'{DRS_PREFIX}/{meta["uuid"]}')
 
 
-def test_fastq_file_drs_view(testapp, file):
+def test_fastq_file_drs_view(testapp, open_data_file):
     """ Tests that a fastq file has valid DRS response """
-    with mock.patch('encoded.types.file.File._head_s3', return_value=None):
-        drs_meta = testapp.get(file['@id'] + '@@drs').json
-        validate_drs_conversion(drs_meta, file)
-        drs_meta = testapp.get(f'{DRS_PREFIX}/{file["uuid"]}').json
-        validate_drs_conversion(drs_meta, file, uri=f'{DRS_PREFIX}/{file["uuid"]}')
+    drs_meta = testapp.get(open_data_file['@id'] + '@@drs').json
+    validate_drs_conversion(drs_meta, open_data_file)
+    drs_meta = testapp.get(f'{DRS_PREFIX}/{open_data_file["uuid"]}').json
+    validate_drs_conversion(drs_meta, open_data_file, uri=f'{DRS_PREFIX}/{open_data_file["uuid"]}')
 
 
-def test_fastq_file_drs_access(testapp, file):
+def test_fastq_file_drs_access(testapp, open_data_file):
     """ Tests that access URLs are retrieved successfully """
-    with mock.patch('encoded.types.file.File._head_s3', return_value=None):
-        drs_meta = testapp.get(file['@id'] + '@@drs').json
-        drs_object_uri = drs_meta['id']
-        drs_object_download = testapp.get(f'/ga4gh/drs/v1/objects/{drs_object_uri}/access/').json
-        assert drs_object_download == {
-            'url': f'https://4dn-open-data-public.s3.amazonaws.com/fourfront-webprod/wfoutput/'
-                   f'96115074-b6bd-4a1e-9564-14b708607e4c/TSTFI2896250.fastq.gz'
-        }
+    drs_meta = testapp.get(open_data_file['@id'] + '@@drs').json
+    drs_object_uri = drs_meta['id']
+    drs_object_download = testapp.get(f'/ga4gh/drs/v1/objects/{drs_object_uri}/access/').json
+    assert drs_object_download == {
+        'url': f'https://4dn-open-data-public.s3.amazonaws.com/fourfront-webprod/wfoutput/'
+               f'96115074-b6bd-4a1e-9564-14b708607e4c/TSTFI2896250.fastq.gz'
+    }
 
 
-def test_drs_always_returns_json(htmltestapp, file):
+def test_drs_always_returns_json(htmltestapp, open_data_file):
     """ DRS is a JSON only API so should never not return html """
-    with mock.patch('encoded.types.file.File._head_s3', return_value=None):
-        drs_meta = htmltestapp.get(file['@id'] + '@@drs')
-        assert drs_meta.content_type == 'application/json'
+    drs_meta = htmltestapp.get(open_data_file['@id'] + '@@drs')
+    assert drs_meta.content_type == 'application/json'
 
 
 def test_drs_without_open_data_returns_404(testapp, file):
-    """ Tests that without open_data_url mocked, """
+    """ Tests that files not transferred to the Open Data bucket have no DRS access URLs """
     testapp.get(file['@id'] + '@@drs', status=404)
@@ -1,5 +1,8 @@
 import pytest
 
+from unittest import mock
+from snovault.elasticsearch import ELASTIC_SEARCH
+from ..visualization import get_file_higlass_information
 from .test_file import mcool_file_json, bedGraph_file_json, bigwig_file_json, bigbed_file_json, bed_beddb_file_json, beddb_file_json, chromsizes_file_json
 
 
@@ -1191,6 +1194,26 @@ def test_bogus_fileuuid(testapp, higlass_mcool_viewconf):
     assert_true("does not exist" in response.json["errors"])
 
 
+def test_get_file_higlass_information_batches_es_lookup():
+    """ Indexed files are found with one ES request; the others are looked up individually. """
+    es = mock.Mock()
+    es.search.return_value = {'hits': {'hits': [
+        {'_id': 'uuid-1', '_source': {'object': {'uuid': 'uuid-1', 'file_format': '/file-formats/mcool/'}}},
+        {'_id': 'uuid-2', '_source': {'object': {'uuid': 'uuid-2', 'file_format': '/file-formats/bw/'}}},
+    ]}}
+    request = mock.Mock(effective_principals=['system.Everyone'])
+    request.registry = {ELASTIC_SEARCH: es}
+    with mock.patch('encoded.visualization.get_namespaced_index', return_value='*'):
+        with mock.patch('encoded.visualization.get_item_or_none',
+                        return_value={'file_format': '/file-formats/bed/'}) as get_item:
+            files_info, errors = get_file_higlass_information(request, ['uuid-2', '4DNFIACCESSION', 'uuid-1'])
+    assert errors == ""
+    assert es.search.call_count == 1
+    get_item.assert_called_once_with(request, '4DNFIACCESSION')
+    assert [f['uuid'] for f in files_info] == ['uuid-2', '4DNFIACCESSION', 'uuid-1']
+    assert [f['file_format'] for f in files_info] == ['/file-formats/bw/', '/file-formats/bed/', '/file-formats/mcool/']
+
+
 def test_add_files_by_accession(testapp, mcool_file_json,
                                 higlass_blank_viewconf, bedGraph_file_json):
     """ Add files by the accession instead of the uuid.
@@ -0,0 +1,144 @@
+import pytest
+
+from unittest import mock
+from ..provenance_cache import (
+    ProvenanceCache,
+    RedisProvenanceBackend,
+    invalidate_provenance_on_change,
+    linked_uuids,
+    make_provenance_cache_key,
+)
+from ..search_cache import ExpiringLRUCache
+
+
+pytestmark = [pytest.mark.working, pytest.mark.unit]
+
+
+FILE_UUID = '4a6d10ee-2edb-4402-a98f-0edb1d58f5e9'
+WFR_UUID = 'a1c5bbd8-f2c2-4a5b-a7c5-6a4d6d0dc9ad'
+OTHER_UUID = '6f1e5a89-3ccf-4b3a-8c9b-8b4b0b7ee6f3'
+
+
+class FakeSharedBackend:
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def exists(self, key):
+        return key in self.entries
+
+    def set(self, key, entry):
+        self.entries[key] = entry
+
+    def invalidate(self, uuids):
+        for key, entry in list(self.entries.items()):
+            if not set(uuids).isdisjoint(entry[1]):
+                del self.entries[key]
+
+    def any_changed(self, uuids):
+        return False
+
+
+class FakeRedis:
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def exists(self, *keys):
+        return sum(key in self.values for key in keys)
+
+    def set(self, key, value, ex=None):
+        assert isinstance(value, str)  # stored as JSON
+        self.values[key] = value.encode('utf-8')
+
+    def sadd(self, key, member):
+        self.values.setdefault(key, set()).add(member.encode('utf-8'))
+
+    def smembers(self, key):
+        return self.values.get(key, set())
+
+    def expire(self, key, ttl):
+        pass
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def pipeline(self):
+        return mock.Mock(set=self.set, sadd=self.sadd, expire=self.expire)
+
+
+def test_redis_provenance_backend_stores_json():
+    backend = RedisProvenanceBackend(FakeRedis(), 60)
+    steps = [{'name': 'step-a', 'inputs': [{'meta': {}, 'run_data': {'file': [FILE_UUID]}}]}]
+    backend.set('a', (steps, frozenset({FILE_UUID, WFR_UUID})))
+    assert backend.get('a') == (steps, frozenset({FILE_UUID, WFR_UUID}))
+    assert backend.exists('a')
+    assert not backend.any_changed({FILE_UUID, WFR_UUID})
+    backend.invalidate({WFR_UUID})
+    assert backend.get('a') is None and not backend.exists('a')
+    assert backend.any_changed({FILE_UUID, WFR_UUID}) and not backend.any_changed({FILE_UUID})
+
+
+def test_provenance_cache_evicts_entries_touching_changed_items():
+    cache = ProvenanceCache(ExpiringLRUCache(max_entries=10, ttl=60))
+    cache.set('a', ['step-a'], {FILE_UUID, WFR_UUID})
+    cache.set('b', ['step-b'], {OTHER_UUID})
+    cache.invalidate({WFR_UUID})
+    assert cache.get('a') is None
+    assert cache.get('b') == ['step-b']
+
+
+def test_provenance_cache_respects_evictions_from_other_processes():
+    shared = FakeSharedBackend()
+    cache, other_process_cache = [ProvenanceCache(ExpiringLRUCache(max_entries=10, ttl=60), shared) for _ in range(2)]
+    cache.set('a', ['step-a'], {FILE_UUID})
+    assert other_process_cache.get('a') == ['step-a']  # From shared backend
+    other_process_cache.invalidate({FILE_UUID})
+    assert cache.get('a') is None
+
+
+def test_invalidate_provenance_on_change_includes_linked_items():
+    cache = ProvenanceCache(ExpiringLRUCache(max_entries=10, ttl=60))
+    cache.set('a', ['step-a'], {FILE_UUID})
+    new_workflow_run = mock.Mock(uuid=WFR_UUID, properties={'input_files': [{'value': FILE_UUID}]})
+    event = mock.Mock(object=new_workflow_run)
+    with mock.patch('encoded.provenance_cache.get_provenance_cache', return_value=cache):
+        invalidate_provenance_on_change(event)
+    assert cache.get('a') is None
+
+
+def test_provenance_cache_entry_kept_on_unrelated_write():
+    cache = ProvenanceCache(ExpiringLRUCache(max_entries=10, ttl=60))
+    cache.set('a', ['step-a'], {FILE_UUID, WFR_UUID})
+    unrelated_item = mock.Mock(uuid=OTHER_UUID, properties={'title': 'Unrelated'})
+    with mock.patch('encoded.provenance_cache.get_provenance_cache', return_value=cache):
+        invalidate_provenance_on_change(mock.Mock(object=unrelated_item))
+    assert cache.get('a') == ['step-a']
+
+
+def test_provenance_cache_skips_traces_of_recently_changed_items():
+    cache = ProvenanceCache(ExpiringLRUCache(max_entries=10, ttl=60), reindex_delay=60)
+    cache.invalidate({WFR_UUID})
+    # traced before the indexer rewrote the document of the changed WorkflowRun
+    assert cache.set('a', ['stale-step-a'], {FILE_UUID, WFR_UUID}) is False
+    assert cache.get('a') is None
+    assert cache.set('b', ['step-b'], {OTHER_UUID}) is True
+    assert cache.get('b') == ['step-b']
+
+    cache = ProvenanceCache(ExpiringLRUCache(max_entries=10, ttl=60), reindex_delay=0)
+    cache.invalidate({WFR_UUID})
+    assert cache.set('a', ['step-a'], {FILE_UUID, WFR_UUID}) is True  # after reindex_delay
+
+
+def test_provenance_cache_key_and_linked_uuids():
+    assert make_provenance_cache_key(FILE_UUID, {'b': 1, 'a': [2]}) == \
+        make_provenance_cache_key(FILE_UUID, {'a': [2], 'b': 1})
+    assert make_provenance_cache_key(FILE_UUID, {'a': [2]}) != make_provenance_cache_key(WFR_UUID, {'a': [2]})
+    assert linked_uuids({'workflow': WFR_UUID, 'output_files': [{'value': FILE_UUID}], 'title': 'x'}) == {WFR_UUID, FILE_UUID}
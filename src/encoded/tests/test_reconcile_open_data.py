@@ -0,0 +1,91 @@
+import pytest
+
+from unittest import mock
+from ..commands.reconcile_open_data import get_open_data_location, list_open_data_files, run
+
+
+pytestmark = [pytest.mark.working, pytest.mark.unit]
+
+
+FILE_UUID = '96115074-b6bd-4a1e-9564-14b708607e4c'
+
+
+def make_client(pages_by_prefix):
+    paginator = mock.Mock()
+    paginator.paginate.side_effect = lambda Bucket, Prefix: pages_by_prefix.get(Prefix, [])
+    return mock.Mock(get_paginator=mock.Mock(return_value=paginator))
+
+
+def test_list_open_data_files_and_get_location():
+    client = make_client({
+        'fourfront-webprod/wfoutput/': [
+            {'Contents': [{'Key': f'fourfront-webprod/wfoutput/{FILE_UUID}/4DNFIO67APU3.pairs.gz'},
+                          {'Key': f'fourfront-webprod/wfoutput/{FILE_UUID}/4DNFIO67APU3.pairs.gz.px2'}]},
+            {},  # page without Contents
+        ],
+        'fourfront-webprod/files/': [
+            {'Contents': [{'Key': f'fourfront-webprod/files/{FILE_UUID}/4DNFIO67APU3.pairs.gz'},
+                          {'Key': 'fourfront-webprod/files/4DNFIO67APU4.fastq.gz'}]},  # not under a uuid
+        ],
+    })
+    open_data_files = list_open_data_files(client)
+    client.get_paginator.assert_called_once_with('list_objects_v2')
+    assert list(open_data_files) == [FILE_UUID]
+    assert open_data_files[FILE_UUID]['wfoutput'] == {'4DNFIO67APU3.pairs.gz', '4DNFIO67APU3.pairs.gz.px2'}
+    # wfoutput takes precedence over files
+    assert get_open_data_location(open_data_files, FILE_UUID, '4DNFIO67APU3.pairs.gz') == 'wfoutput'
+    assert get_open_data_location(open_data_files, FILE_UUID, '4DNFIO67APU3.pairs.gz',
+                                  locations=('files', 'wfoutput')) == 'files'
+    assert get_open_data_location(open_data_files, FILE_UUID, '4DNFIO67APU3.hic') is None
+    assert get_open_data_location(open_data_files, 'ab6cc71c-8e1e-4ed2-a2ce-b6c0a9b2a7e4', 'x.hic') is None
+
+
+@pytest.fixture
+def open_data_fastqs(testapp, lab, award, file_formats):
+    """ FileFastq items by accession, as (status, open_data_location) given below """
+    files = {}
+    for accession, status, location in [('4DNFIODL1111', 'released', None),
+                                        ('4DNFIODL2222', 'archived', None),
+                                        ('4DNFIODL3333', 'released', 'files'),
+                                        ('4DNFIODL4444', 'uploaded', None),
+                                        ('4DNFIODL5555', 'released', 'wfoutput')]:
+        item = {
+            'accession': accession,
+            'award': award['uuid'],
+            'lab': lab['uuid'],
+            'file_format': file_formats.get('fastq').get('uuid'),
+            'md5sum': '0123456789abcdef0123456789abcde' + accession[-1],
+            'status': status,
+        }
+        if location is not None:
+            item['open_data_location'] = location
+        files[accession] = testapp.post_json('/file_fastq', item, status=201).json['@graph'][0]
+    return files
+
+
+def test_run_reconciles_open_data_location(testapp, open_data_fastqs):
+    def listed(accession, location):
+        return {open_data_fastqs[accession]['uuid']: {location: {accession + '.fastq.gz'}}}
+
+    open_data_files = {}
+    open_data_files.update(listed('4DNFIODL2222', 'wfoutput'))  # transferred
+    open_data_files.update(listed('4DNFIODL4444', 'files'))  # not released
+    open_data_files.update(listed('4DNFIODL5555', 'wfoutput'))  # unchanged
+    # 4DNFIODL1111 is not transferred, 4DNFIODL3333 no longer (so its location is cleared)
+
+    def open_data_locations():
+        return {accession: testapp.get(item['@id'] + '?frame=object').json.get('open_data_location')
+                for accession, item in open_data_fastqs.items()}
+
+    expected = {'4DNFIODL1111': None, '4DNFIODL2222': 'wfoutput', '4DNFIODL3333': None,
+                '4DNFIODL4444': None, '4DNFIODL5555': 'wfoutput'}
+    with mock.patch.object(testapp, 'patch_json', wraps=testapp.patch_json) as patch_json:
+        run(testapp, open_data_files, dry_run=True)
+        assert patch_json.call_count == 0
+        assert open_data_locations()['4DNFIODL3333'] == 'files'
+        run(testapp, open_data_files)
+        assert sorted(call.args for call in patch_json.call_args_list) == [
+            ('/%s/' % open_data_fastqs['4DNFIODL2222']['uuid'], {'open_data_location': 'wfoutput'}),
+            ('/%s/?delete_fields=open_data_location' % open_data_fastqs['4DNFIODL3333']['uuid'], {}),
+        ]
+    assert open_data_locations() == expected
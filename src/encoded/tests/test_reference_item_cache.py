@@ -0,0 +1,132 @@
+import pytest
+
+from unittest import mock
+from snovault import CONNECTION
+from ..reference_item_cache import (
+    cache_reference_object,
+    get_cached_reference_object,
+    get_reference_item_types,
+    invalidate_reference_item_on_change,
+)
+
+
+pytestmark = [pytest.mark.working, pytest.mark.unit]
+
+
+FORMAT_UUID = 'd13d06cf-218e-4f61-aaf0-91f226248b3c'
+EXTRA_FORMAT_UUID = 'd13d06cf-218e-4f61-aaf0-91f226248b2c'
+LAB_UUID = '828cd4fe-ebb0-4b36-a94a-d2e3a36cc989'
+PI_UUID = '986b362f-4eb6-4a9c-8173-3ab267307e3a'
+
+ANONYMOUS_PRINCIPALS = ['system.Everyone']
+ADMIN_PRINCIPALS = ['system.Everyone', 'system.Authenticated', 'group.admin', 'userid.' + PI_UUID]
+
+
+class FakeItem:
+
+    def __init__(self, uuid, sid, links=()):
+        self.uuid = uuid
+        self.sid = sid
+        self.properties = {}
+        self._links = list(links)
+
+    def links(self, properties):
+        return {'extrafile_formats': self._links}
+
+
+def principals_allowed_by_acl(item, permission):
+    """ Like USER ACLs, Users may only be viewed by themselves and admins; other test Items are public """
+    if item.uuid == PI_UUID:
+        return ['userid.' + PI_UUID, 'group.admin', 'remoteuser.INDEXER', 'remoteuser.EMBED']
+    return ['system.Everyone']
+
+
+class FakeConnection:
+
+    def __init__(self, items):
+        self.items = {item.uuid: item for item in items}
+
+    def get_by_uuid(self, uuid, default=None):
+        return self.items.get(uuid, default)
+
+
+class FakeRegistry(dict):
+
+    def __init__(self, settings, connection):
+        super().__init__()
+        self.settings = settings
+        self[CONNECTION] = connection
+
+
+def make_request(settings=None, principals=ANONYMOUS_PRINCIPALS, registry=None):
+    if registry is None:
+        items = [FakeItem(FORMAT_UUID, 10, links=[EXTRA_FORMAT_UUID]), FakeItem(EXTRA_FORMAT_UUID, 5),
+                 FakeItem(LAB_UUID, 3, links=[PI_UUID]), FakeItem(PI_UUID, 7)]
+        settings = {'reference_item_cache.enabled': 'true'} if settings is None else settings
+        registry = FakeRegistry(settings, FakeConnection(items))
+    return mock.Mock(registry=registry, effective_principals=principals)
+
+
+FILE_FORMAT_OBJECT = {'@id': '/file-formats/pairs/', '@type': ['FileFormat', 'Item'], 'uuid': FORMAT_UUID}
+
+
+def test_reference_object_cached_until_sid_changes():
+    request = make_request()
+    path = '/file-formats/pairs/'
+    cache_reference_object(request, path, FILE_FORMAT_OBJECT, {(FORMAT_UUID, 'FileFormat')}, {})
+    assert get_cached_reference_object(request, path, True)[0] is FILE_FORMAT_OBJECT
+    # a linked Item was edited (e.g. by another process)
+    request.registry[CONNECTION].items[EXTRA_FORMAT_UUID].sid = 6
+    assert get_cached_reference_object(request, path, False) is None
+
+
+def test_reference_object_not_cached_for_other_types_or_without_links_when_indexing():
+    request = make_request()
+    cache_reference_object(request, '/labs/some-lab/', {'@type': ['Lab', 'Item'], 'uuid': FORMAT_UUID}, None, None)
+    cache_reference_object(request, '/files/x/', dict(FILE_FORMAT_OBJECT, **{'@type': ['FileFastq']}), None, None)
+    assert get_cached_reference_object(request, '/files/x/', False) is None
+    # rendered outside of indexing, so linked uuids unknown
+    assert get_cached_reference_object(request, '/labs/some-lab/', True) is None
+    assert get_cached_reference_object(request, '/labs/some-lab/', False) is not None
+    assert get_cached_reference_object(make_request({}), '/labs/some-lab/', False) is None  # not enabled
+
+
+def test_reference_object_not_cached_when_not_public():
+    request = make_request()
+    with mock.patch('encoded.reference_item_cache.principals_allowed_by_permission', return_value=['group.admin']):
+        cache_reference_object(request, '/file-formats/pairs/', FILE_FORMAT_OBJECT, None, None)
+    assert get_cached_reference_object(request, '/file-formats/pairs/', False) is None
+
+
+def test_reference_object_invalidated_on_change():
+    request = make_request()
+    cache_reference_object(request, '/file-formats/pairs/', FILE_FORMAT_OBJECT, None, None)
+    invalidate_reference_item_on_change(mock.Mock(request=request, object=mock.Mock(uuid=EXTRA_FORMAT_UUID)))
+    assert get_cached_reference_object(request, '/file-formats/pairs/', False) is None
+
+
+def test_get_reference_item_types():
+    assert 'FileFormat' in get_reference_item_types(make_request().registry)
+    registry = make_request({'reference_item_cache.types': 'Organism, Enzyme'}).registry
+    assert get_reference_item_types(registry) == {'Organism', 'Enzyme'}
+
+
+@mock.patch('encoded.reference_item_cache.principals_allowed_by_permission', principals_allowed_by_acl)
+def test_reference_object_linking_private_user_not_served_to_anonymous():
+    admin_request = make_request(principals=ADMIN_PRINCIPALS)
+    anonymous_request = make_request(principals=ANONYMOUS_PRINCIPALS, registry=admin_request.registry)
+    lab_object = {'@id': '/labs/some-lab/', '@type': ['Lab', 'Item'], 'uuid': LAB_UUID, 'pi_name': 'Private Name',
+                  'correspondence': [{'@id': '/users/%s/' % PI_UUID, 'contact_email': 'cHJpdmF0ZUBleGFtcGxlLm9yZw=='}]}
+    # the Lab is public, but its frame shows properties of its (private) PI User
+    cache_reference_object(admin_request, '/labs/some-lab/', lab_object, None, None)
+    assert get_cached_reference_object(anonymous_request, '/labs/some-lab/', False) is None
+    assert get_cached_reference_object(admin_request, '/labs/some-lab/', False) is None
+
+
+@mock.patch('encoded.reference_item_cache.principals_allowed_by_permission', principals_allowed_by_acl)
+def test_reference_object_cached_per_viewer_principals():
+    admin_request = make_request(principals=ADMIN_PRINCIPALS)
+    anonymous_request = make_request(principals=ANONYMOUS_PRINCIPALS, registry=admin_request.registry)
+    cache_reference_object(admin_request, '/file-formats/pairs/', FILE_FORMAT_OBJECT, None, None)
+    assert get_cached_reference_object(anonymous_request, '/file-formats/pairs/', False) is None
+    assert get_cached_reference_object(admin_request, '/file-formats/pairs/', False)[0] is FILE_FORMAT_OBJECT
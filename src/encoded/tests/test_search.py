@@ -1,16 +1,29 @@
 import json
 import pytest
 import webtest
+from unittest import mock
 
 
 from datetime import datetime, timedelta
 from dcicutils.misc_utils import Retry, ignored, local_attrs
 from dcicutils.qa_utils import notice_pytest_fixtures
 from snovault import TYPES, COLLECTIONS
-from snovault.elasticsearch import create_mapping
+from elasticsearch_dsl import Search
+from pyramid.httpexceptions import HTTPBadRequest
+from snovault.elasticsearch import create_mapping, ELASTIC_SEARCH
 from snovault.elasticsearch.indexer_utils import get_namespaced_index
 from snovault.util import add_default_embeds
+from .. import visualization
 from ..commands.run_upgrader_on_inserts import get_inserts
+from ..search import (
+    SchemaBoundLRUCache,
+    clear_search_skeleton_cache,
+    execute_search_for_all_results,
+    get_search_skeleton_cache,
+    list_source_fields,
+    ndjson_results,
+    prefetch_pages,
+)
 # Use workbook fixture from BDD tests (including elasticsearch)
 #from .workbook_fixtures import es_app_settings, es_app, es_testapp, anon_es_testapp, html_es_testapp, workbook
 # from ..util import customized_delay_rerun
@@ -555,6 +568,134 @@ def test_collection_actions_filtered_by_permission(workbook, es_testapp, anon_es
     assert len(res.json['@graph']) == 0
 
 
+def test_execute_search_for_all_results_pages_with_search_after(workbook, es_testapp, es_app):
+    """ Small page size so that limit=all streams several search_after pages; all hits returned exactly once """
+    es = es_app.registry[ELASTIC_SEARCH]
+    index = get_namespaced_index(es_app, 'biosample')
+    search = Search(using=es, index=index).sort({'embedded.uuid.raw': {'order': 'asc'}})
+    search = search.update_from_dict({'query': {'match_all': {}}})
+    es_result = execute_search_for_all_results(search, page_size=2)
+    uuids = [hit['_id'] for hit in es_result['hits']['hits']]
+    assert len(uuids) > 2
+    assert len(uuids) == len(set(uuids)) == es_result['hits']['total']['value']
+    assert uuids == sorted(uuids)
+
+
+def test_search_skeleton_cache_reused_across_requests(workbook, es_testapp, es_app):
+    clear_search_skeleton_cache(es_app.registry)
+    res = es_testapp.get('/search/?type=Biosample').json
+    cache = get_search_skeleton_cache(es_app.registry)
+    assert len(cache.skeletons) == 1
+    assert len(cache.field_schemas) > 0
+    # Different filters, same doc_types -> same skeleton, and request filters still produce their facets
+    filtered_res = es_testapp.get('/search/?type=Biosample&biosource.biosource_type=immortalized+cell+line').json
+    assert len(cache.skeletons) == 1
+    assert filtered_res['columns'] == res['columns']
+    assert 'biosource.biosource_type' in [facet['field'] for facet in filtered_res['facets']]
+    # Facet dicts from the skeleton must not be shared between requests
+    assert es_testapp.get('/search/?type=Biosample').json['facets'] == res['facets']
+
+
+def test_search_slim_response(workbook, es_testapp):
+    full = es_testapp.get('/search/?type=Biosample&limit=all').json
+    slim = es_testapp.get('/search/?type=Biosample&limit=all&response=slim').json
+    for key in ('facets', 'columns', 'clear_filters', 'filters', 'sort', 'actions'):
+        assert key in full and key not in slim
+    assert slim['total'] == full['total']
+    assert [item['@id'] for item in slim['@graph']] == [item['@id'] for item in full['@graph']]
+    es_testapp.get('/search/?type=Biosample&response=fat', status=400)
+
+
+def test_search_ndjson_response(workbook, es_testapp):
+    total = es_testapp.get('/search/?type=Biosample&response=slim').json['total']
+    res = es_testapp.get('/search/?type=Biosample&limit=all&frame=object&format=ndjson')
+    assert res.content_type == 'application/x-ndjson'
+    items = [json.loads(line) for line in res.text.splitlines()]
+    assert len(items) == total
+    assert all(isinstance(item['biosource'][0], str) for item in items)
+    es_testapp.get('/search/?type=Biosample&status=no-such-status&format=ndjson', status=404)
+
+
+def test_ndjson_results_chunks_lines():
+    items = [{'@id': '/items/%s/' % i} for i in range(10)]
+    chunks = list(ndjson_results(iter(items), chunk_size=40))
+    assert len(chunks) > 1
+    assert [json.loads(line) for line in b''.join(chunks).decode('utf-8').splitlines()] == items
+
+
+def test_schema_bound_lru_cache():
+    schema_a, schema_b = {'title': 'A'}, {'title': 'B'}
+    cache = SchemaBoundLRUCache(max_entries=2)
+    cache.set('a', [schema_a], 1)
+    cache.set('b', [schema_b], 2)
+    assert cache.get('a', [schema_a]) == (True, 1)
+    # a replaced (reloaded) schema invalidates the entry, even if equal
+    assert cache.get('b', [{'title': 'B'}]) == (False, None)
+    cache.set('b', [schema_b], 2)
+    cache.set('c', [schema_a], 3)  # evicts least recently used, 'a'
+    assert cache.get('a', [schema_a]) == (False, None)
+    assert cache.get('c', [schema_a]) == (True, 3)
+    assert len(cache) == 2
+
+
+def test_list_source_fields_only_fetches_returned_frame():
+    from webob.multidict import MultiDict
+
+    def source_fields(query, frame='embedded'):
+        request = mock.Mock(normalized_params=MultiDict(query))
+        return list_source_fields(request, ['Experiment'], frame)
+
+    assert source_fields([]) == ['embedded.*']
+    assert source_fields([], 'object') == ['object.*']
+    assert source_fields([], 'raw') == ['properties.*']
+    assert source_fields([('field', 'status'), ('field', 'validation_errors.name')], 'object') == [
+        'embedded.@id', 'embedded.@type', 'embedded.status', 'validation_errors.name'
+    ]
+
+
+def test_search_object_and_raw_frames(workbook, es_testapp):
+    for frame, frame_fields in (('object', {'@id', '@type'}), ('raw', {'uuid'})):
+        res = es_testapp.get('/search/?type=Biosample&frame=%s&limit=5' % frame).json
+        assert res['@graph']
+        for item in res['@graph']:
+            assert frame_fields <= set(item)
+            # linkTos are not embedded
+            assert isinstance(item['biosource'][0], str)
+
+
+def test_prefetch_pages_keeps_order_and_closes_source():
+    closed = []
+
+    def pages():
+        try:
+            for i in range(5):
+                yield [i]
+        finally:
+            closed.append(True)
+
+    assert list(prefetch_pages(pages(), 2)) == [[0], [1], [2], [3], [4]]
+    assert closed == [True]
+
+    # Client disconnects after first page - source must still be closed (e.g. point-in-time released)
+    closed.clear()
+    prefetcher = prefetch_pages(pages(), 1)
+    assert next(prefetcher) == [0]
+    prefetcher.close()
+    assert closed == [True]
+
+
+def test_prefetch_pages_reraises_fetch_errors():
+
+    def pages():
+        yield [1]
+        raise HTTPBadRequest(explanation='The search failed.')
+
+    prefetcher = prefetch_pages(pages(), 2)
+    assert next(prefetcher) == [1]
+    with pytest.raises(HTTPBadRequest):
+        next(prefetcher)
+
+
 class ItemTypeChecker:
 
     @staticmethod
@@ -765,6 +906,89 @@ def test_barplot_aggregation_endpoint(workbook, es_testapp):
     # assert res["terms"]["CHIP-seq"]["terms"]["4DN"]["experiment_sets"] < count_exp_set_test_inserts
 
 
+def assert_only_rollup_counts_searched(search_calls):
+    """ Asserts that a single search was made, with rollup (sum) aggregations only, i.e. without fallback """
+    assert len(search_calls) == 1
+    aggregations = json.dumps(search_calls[0].kwargs['custom_aggregations'])
+    assert '"sum": {"field": "embedded.rollup_counts.' in aggregations
+    assert '"cardinality"' not in aggregations and '"value_count"' not in aggregations
+
+
+def test_barplot_aggregation_endpoint_with_rollup_counts(workbook, es_app, es_testapp):
+    """ Rollup (sum) aggregations give same set & experiment counts as cardinality ones, and sum up rollup_counts """
+    body = {
+        "search_query_params": {"type": ['ExperimentSetReplicate']},
+        "fields_to_aggregate_for": ["award.project"]
+    }
+    res = es_testapp.post_json('/bar_plot_aggregations', body).json
+    settings = es_app.registry.settings
+    with mock.patch.dict(settings, {'visualization.use_rollup_counts': 'true'}):
+        with mock.patch.object(visualization, 'perform_search_request',
+                               wraps=visualization.perform_search_request) as search:
+            rollup_res = es_testapp.post_json('/bar_plot_aggregations', body).json
+    assert_only_rollup_counts_searched(search.call_args_list)
+    assert rollup_res['total']['experiment_sets'] == res['total']['experiment_sets']
+    assert rollup_res['total']['experiments'] == res['total']['experiments']
+    assert rollup_res['terms'].keys() == res['terms'].keys()
+    # files are summed up from the per-set counts indexed in rollup_counts
+    expsets = es_testapp.get('/browse/?type=ExperimentSetReplicate&limit=all').json['@graph']
+    rollup_counts = [expset['rollup_counts'] for expset in expsets]
+    assert rollup_res['total']['files_raw'] == sum(counts['exp_raw_files'] for counts in rollup_counts)
+    assert rollup_res['total']['files_processed'] == sum(
+        counts['exp_processed_files'] + counts['expset_processed_files'] for counts in rollup_counts
+    )
+
+
+def test_date_histogram_aggregations_with_rollup_counts(workbook, es_app, es_testapp):
+    """ Rollup (sum) aggregations give same histogram buckets & experiment counts as cardinality ones """
+    url = '/date_histogram_aggregations/?type=ExperimentSetReplicate&experimentset_type=replicate'
+    res = es_testapp.get(url).json
+    with mock.patch.dict(es_app.registry.settings, {'visualization.use_rollup_counts': 'true'}):
+        with mock.patch.object(visualization, 'perform_search_request',
+                               wraps=visualization.perform_search_request) as search:
+            rollup_res = es_testapp.get(url).json
+    assert_only_rollup_counts_searched(search.call_args_list)
+    assert rollup_res['total'] == res['total']
+    for histogram in ['weekly_interval_public_release', 'weekly_interval_project_release']:
+        buckets = res['aggregations'][histogram]['buckets']
+        rollup_buckets = rollup_res['aggregations'][histogram]['buckets']
+        assert [b['key'] for b in rollup_buckets] == [b['key'] for b in buckets]
+        assert [b['doc_count'] for b in rollup_buckets] == [b['doc_count'] for b in buckets]
+        assert ([b['total_experiments']['value'] for b in rollup_buckets] ==
+                [b['total_experiments']['value'] for b in buckets])
+
+
+def test_recently_released_datasets_response_cache_and_etag(workbook, es_app, es_testapp):
+    settings = {'visualization.response_cache.enabled': 'true', 'search.index_generation.settle_time': '0'}
+    with mock.patch.dict(es_app.registry.settings, settings):
+        es_app.registry.pop('encoded.index_generation_tracker', None)
+        res = es_testapp.get('/recently_released_datasets?max_row_count=2')
+        assert res.etag
+        assert 'max-age' in res.headers['Cache-Control']
+        res2 = es_testapp.get('/recently_released_datasets?max_row_count=2')
+        assert res2.json['time_generated'] == res.json['time_generated']  # served from cache
+        es_testapp.get('/recently_released_datasets?max_row_count=2',
+                       headers={'If-None-Match': '"%s"' % res.etag}, status=304)
+    es_app.registry.pop('encoded.visualization_response_cache', None)
+    es_app.registry.pop('encoded.index_generation_tracker', None)
+
+
+def test_aggregate_etag_ignores_time_generated_and_varies_on_credentials(workbook, es_testapp):
+    """ Without the response cache, ETag is stable across calls; POSTs get no ETag or Cache-Control """
+    res = es_testapp.get('/recently_released_datasets?max_row_count=2')
+    res2 = es_testapp.get('/recently_released_datasets?max_row_count=2')
+    assert res.etag and res2.etag == res.etag
+    assert {'Cookie', 'Authorization'} <= {v.strip() for v in res.headers['Vary'].split(',')}
+    es_testapp.get('/recently_released_datasets?max_row_count=2',
+                   headers={'If-None-Match': '"%s"' % res.etag}, status=304)
+    res = es_testapp.post_json('/bar_plot_aggregations', {
+        "search_query_params": {"type": ['ExperimentSetReplicate']},
+        "fields_to_aggregate_for": ["award.project"]
+    })
+    assert res.etag is None
+    assert 'max-age' not in res.headers.get('Cache-Control', '')
+
+
 def test_recently_released_datasets_endpoint(workbook, es_testapp):
 
     max_row_count = 1
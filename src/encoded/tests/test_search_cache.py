@@ -0,0 +1,98 @@
+import pytest
+
+from unittest import mock
+from ..search_cache import (
+    ExpiringLRUCache,
+    IndexGenerationTracker,
+    get_expiring_cache,
+    principals_fingerprint,
+)
+
+
+pytestmark = [pytest.mark.working, pytest.mark.unit]
+
+
+class FakeIndicesClient:
+
+    def __init__(self):
+        self.index_total = 10
+        self.delete_total = 0
+        self.calls = 0
+
+    def stats(self, index, metric):
+        self.calls += 1
+        return {'_all': {'primaries': {'indexing': {
+            'index_total': self.index_total, 'delete_total': self.delete_total
+        }}}}
+
+
+class FakeES:
+
+    def __init__(self):
+        self.indices = FakeIndicesClient()
+
+
+class FakeRegistry(dict):
+
+    def __init__(self, settings):
+        super().__init__()
+        self.settings = settings
+
+
+def test_expiring_lru_cache_evicts_and_expires():
+    cache = ExpiringLRUCache(max_entries=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)  # 'b' is least recently used
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    with mock.patch('encoded.search_cache.time.monotonic', return_value=10 ** 9):
+        assert cache.get('a') is None
+    assert len(cache) == 1
+    assert (cache.hits, cache.misses) == (3, 2)
+
+
+def test_expiring_lru_cache_delete_where():
+    cache = ExpiringLRUCache(max_entries=10, ttl=60)
+    for i in range(4):
+        cache.set(i, i * 10)
+    cache.delete_where(lambda key, value: value >= 20)
+    assert len(cache) == 2 and cache.get(1) == 10
+
+
+def test_index_generation_tracker_settles_and_changes_on_writes():
+    es = FakeES()
+    tracker = IndexGenerationTracker(check_interval=0, settle_time=5)
+    with mock.patch('encoded.search_cache.time.monotonic', return_value=100):
+        assert tracker.get_generation(es, 'idx') is None  # just seen, not settled yet
+    with mock.patch('encoded.search_cache.time.monotonic', return_value=106):
+        first_generation = tracker.get_generation(es, 'idx')
+        assert first_generation is not None
+        es.indices.index_total += 1  # indexer wrote something
+        assert tracker.get_generation(es, 'idx') is None
+    with mock.patch('encoded.search_cache.time.monotonic', return_value=112):
+        assert tracker.get_generation(es, 'idx') not in (None, first_generation)
+
+
+def test_index_generation_tracker_throttles_stats_calls():
+    es = FakeES()
+    tracker = IndexGenerationTracker(check_interval=10, settle_time=0)
+    with mock.patch('encoded.search_cache.time.monotonic', return_value=100):
+        tracker.get_generation(es, 'idx')
+        tracker.get_generation(es, 'idx')
+    assert es.indices.calls == 1
+
+
+def test_principals_fingerprint_ignores_order():
+    assert principals_fingerprint(['system.Everyone', 'group.admin']) == \
+        principals_fingerprint(['group.admin', 'system.Everyone'])
+    assert principals_fingerprint(['system.Everyone']) != principals_fingerprint(['group.admin'])
+
+
+def test_get_expiring_cache_is_opt_in_and_shared():
+    assert get_expiring_cache(FakeRegistry({}), 'some.cache', 'some.cache', 10, 60) is None
+    registry = FakeRegistry({'some.cache.enabled': 'true', 'some.cache.max_entries': '3'})
+    cache = get_expiring_cache(registry, 'some.cache', 'some.cache', 10, 60)
+    assert (cache.max_entries, cache.ttl) == (3, 60)
+    assert get_expiring_cache(registry, 'some.cache', 'some.cache', 10, 60) is cache
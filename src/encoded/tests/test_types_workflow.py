@@ -2,7 +2,9 @@ import json
 import pytest
 
 from dcicutils.ff_utils import patch_metadata, purge_metadata
-from ..types.workflow import _wfoutput_bucket_for_env
+from snovault import CONNECTION, TYPES
+from unittest import mock
+from ..types.workflow import TracingItemCache, TracingStats, _wfoutput_bucket_for_env
 
 
 pytestmark = [pytest.mark.setone, pytest.mark.working]
@@ -94,3 +96,63 @@ def test_workflow_for_env():
     assert _wfoutput_bucket_for_env('fourfront-webdev') == 'elasticbeanstalk-fourfront-webdev-wfoutput'
     assert _wfoutput_bucket_for_env('fourfront-hotseat') == 'elasticbeanstalk-fourfront-hotseat-wfoutput'
 
+
+
+def test_tracing_item_cache_prefetches_frontier_in_bulk():
+    indexed_model = mock.Mock(uuid='uuid-es', source={'embedded': {'uuid': 'uuid-es'}})
+    db_model = mock.Mock(spec=['uuid', 'item_type', 'revs'], uuid='uuid-db', item_type='file_processed')
+    connection = mock.Mock()
+    connection.storage.get_by_uuid.side_effect = lambda uuid: db_model if uuid == 'uuid-db' else None
+    file_class = mock.Mock(rev={'workflow_run_inputs': ('WorkflowRun', 'input_files.value'),
+                                'experiments': ('Experiment', 'files')})
+    request = mock.Mock()
+    request.registry = {CONNECTION: connection, TYPES: mock.Mock(by_item_type={'file_processed': mock.Mock(factory=file_class)})}
+
+    cache = TracingItemCache(request)
+    with mock.patch('encoded.types.workflow.get_indexed_models_by_uuid', return_value={'uuid-es': indexed_model}) as get_indexed:
+        with mock.patch('encoded.types.workflow.get_rev_links_by_uuid',
+                        return_value={'uuid-db': {'input_files.value': ['uuid-wfr']}}) as get_rev_links:
+            cache.prefetch(['uuid-es', 'uuid-db', None])
+            cache.prefetch(['uuid-es', 'uuid-db'])  # Already cached
+    assert get_indexed.call_count == 1
+    get_rev_links.assert_called_once_with(request, mock.ANY, {'input_files.value'})
+    assert cache.get_embed('uuid-es') == {'uuid': 'uuid-es'}
+    assert cache.get_embed('uuid-db') is None
+    with mock.patch('encoded.types.workflow.item_model_to_object', return_value={'uuid': 'uuid-db'}) as to_object:
+        assert cache.get_object('uuid-db') is cache.get_object('uuid-db')
+    to_object.assert_called_once_with(db_model, request, {'input_files.value': ['uuid-wfr']})
+    assert connection.storage.get_by_uuid.call_count == 1
+    assert cache.stats.counters['es_bulk_fetches'] == 1
+    assert cache.stats.counters['storage_fetches'] == 1
+
+
+def test_tracing_stats_derives_assembly_time():
+    stats = TracingStats()
+    stats.count('nodes_visited')
+    stats.count('nodes_visited', 2)
+    stats.add_time('fetch', 0.5)
+    stats.add_time('grouping', 0.25)
+    stats.add_time('total', 1.0)
+    assert stats.as_dict() == {
+        'counters': {'nodes_visited': 3},
+        'timings_ms': {'fetch': 500.0, 'grouping': 250.0, 'total': 1000.0, 'assembly': 250.0}
+    }
+
+
+def test_trace_workflow_runs_reports_stats_on_provenance_cache_hit():
+    from pyramid.response import Response
+    from ..provenance_cache import ProvenanceCache, make_provenance_cache_key
+    from ..search_cache import ExpiringLRUCache
+    from ..types.workflow import DEFAULT_TRACING_OPTIONS
+    from ..visualization import trace_workflow_runs
+
+    context = mock.Mock(uuid='4a6d10ee-2edb-4402-a98f-0edb1d58f5e9')
+    request = mock.Mock(params={'tracing_stats': '1'}, registry=mock.Mock(settings={}), response=Response())
+    cache = ProvenanceCache(ExpiringLRUCache(max_entries=10, ttl=60))
+    options = dict(DEFAULT_TRACING_OPTIONS, track_stats=True)
+    cache.set(make_provenance_cache_key(context.uuid, options), ['step-a'], {str(context.uuid)})
+    with mock.patch('encoded.visualization.get_provenance_cache', return_value=cache):
+        with mock.patch('encoded.visualization.trace_workflows') as trace_workflows:
+            assert trace_workflow_runs(context, request) == ['step-a']
+    assert not trace_workflows.called
+    assert json.loads(request.response.headers['X-Tracing-Stats']) == {'counters': {'cache_hit': 1}, 'timings_ms': {}}
@@ -0,0 +1,40 @@
+import pytest
+
+from unittest import mock
+from ..warm_up import (
+    DEFAULT_WARM_UP_PATHS,
+    get_metadata_warm_up_path,
+    get_warm_up_paths,
+    warm_up_app,
+    warm_up_if_enabled,
+)
+
+
+pytestmark = [pytest.mark.working, pytest.mark.unit]
+
+
+def test_get_warm_up_paths():
+    paths = get_warm_up_paths({})
+    assert paths[:-1] == DEFAULT_WARM_UP_PATHS
+    assert paths[-1] == get_metadata_warm_up_path()
+    assert 'field=experiments_in_set.files.href' in paths[-1]
+    assert get_warm_up_paths({'warm_up.paths': '\n/search/?type=File\n  /browse/\n'}) == ['/search/?type=File',
+                                                                                        '/browse/']
+
+
+def test_warm_up_app_ignores_failures():
+    with mock.patch('encoded.warm_up.VirtualApp') as virtual_app:
+        virtual_app.return_value.get.side_effect = [Exception('ES not reachable'), mock.Mock(status_int=200)]
+        warm_up_app(None, ['/search/', '/browse/'])
+        assert [c[0][0] for c in virtual_app.return_value.get.call_args_list] == ['/search/', '/browse/']
+
+
+def test_warm_up_if_enabled():
+    with mock.patch('encoded.warm_up.warm_up_app') as warm_up:
+        assert warm_up_if_enabled(None, {'elasticsearch.server': 'localhost:9200'}) is None
+        assert warm_up_if_enabled(None, {'warm_up.enabled': 'true'}) is None  # no ES
+        thread = warm_up_if_enabled(None, {'warm_up.enabled': 'true', 'elasticsearch.server': 'localhost:9200',
+                                           'warm_up.paths': '/search/'})
+        assert thread.daemon
+        thread.join(timeout=10)
+        warm_up.assert_called_once_with(None, ['/search/'])
@@ -1,6 +1,5 @@
 """init.py lists all the collections that do not have a dedicated types file."""
 
-import boto3
 import transaction
 
 from mimetypes import guess_type
@@ -19,6 +18,7 @@ from snovault import (
     BLOBS
 )
 # from pyramid.traversal import find_root
+from ..aws_clients import get_aws_client
 from .base import (
     Item,
     set_namekey_from_title,
@@ -178,7 +178,7 @@ def download(context, request):
     # If blob is on s3, redirect us there
     blob_storage = request.registry[BLOBS]
     if 'bucket' in download_meta:
-        location = get_s3_presigned_url(download_meta, filename)
+        location = get_s3_presigned_url(request.registry, download_meta, filename)
         raise HTTPFound(location=location)
     elif hasattr(blob_storage, 'get_blob_url'):  # default fallback - filename is s3 blob id
         blob_url = blob_storage.get_blob_url(download_meta)
@@ -192,8 +192,8 @@ def download(context, request):
     return Response(body=blob, headers=headers)
 
 
-def get_s3_presigned_url(download_meta, filename):
-    conn = boto3.client('s3')
+def get_s3_presigned_url(registry, download_meta, filename):
+    conn = get_aws_client(registry, 's3')
     param_get_object = {
         'Bucket': download_meta['bucket'],
         'Key': download_meta['key'],
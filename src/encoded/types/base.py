@@ -9,10 +9,12 @@ from pyramid.security import (
     Everyone,
 )
 from pyramid.traversal import find_root
+from sqlalchemy.util import LRUCache
 import snovault
 # from ..schema_formats import is_accession
 # import snovalut default post / patch stuff so we can overwrite it in this file
 from snovault.interfaces import CONNECTION
+from ..reference_item_cache import cache_reference_object, get_cached_reference_object
 from ..server_defaults import get_userid, add_last_modified
 
 from datetime import date
@@ -49,7 +51,215 @@ from ..acl import (
 
 
 from snovault import Item as SnovaultItem
-from snovault.types.base import get_item_or_none, set_namekey_from_title, validate_item_type_of_linkto_field
+from snovault.types.base import set_namekey_from_title, validate_item_type_of_linkto_field
+from snovault.util import get_root_request
+
+
+ITEM_OBJECT_MEMO_METHODS = ('GET', 'HEAD')  # root request methods for which object frames are memoized
+DEFAULT_ITEM_OBJECT_MEMO_CAPACITY = 1000  # objects (and as many computed values); `item_object_memo.capacity`
+
+
+class ItemObjectMemo(object):
+    """
+    Object frames of Items looked up by calculated properties (through get_item_or_none and
+    get_item_object) while rendering one response, or indexing one Item, keyed by path.
+    Like the embed_cache of snovault, it is an LRU cache of bounded `capacity`.
+    Looked-up objects are shared (also between requests, for cached reference Items), so must not be modified.
+    Values computed from such objects, e.g. the experiment context of File.track_and_facet_info, may
+    be memoized alongside them, or for a whole indexing batch (see get_memoized).
+
+    When indexing, the linked uuids (and rev links) recorded by the lookup which rendered an object
+    are added to the request of every later lookup of it, so that invalidation is unaffected.
+    Hits and misses are counted, also in the stats of the root request (see X-Stats header).
+    """
+
+    def __init__(self, stats=None, capacity=DEFAULT_ITEM_OBJECT_MEMO_CAPACITY):
+        self.entries = LRUCache(capacity)
+        self.computed = LRUCache(capacity)
+        self.hits = 0
+        self.misses = 0
+        self.computed_hits = 0
+        self.computed_misses = 0
+        self.stats = stats
+
+    def count(self, name):
+        setattr(self, name, getattr(self, name) + 1)
+        if self.stats is not None:
+            key = 'item_object_memo_' + name
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def get(self, request, path):
+        indexing = getattr(request, '_indexing_view', False) is True
+        key = (path, indexing)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.count('misses')
+            entry = self.entries[key] = load_item_object(request, path, indexing)
+        else:
+            self.count('hits')
+            if indexing:
+                add_linked_uuids(request, entry[1], entry[2])
+        return entry[0]
+
+    def get_computed(self, request, key, compute):
+        """ Returns compute(), memoized under `key`; linked uuids it records are replayed like those of objects """
+        indexing = getattr(request, '_indexing_view', False) is True
+        memo_key = (key, indexing)
+        entry = self.computed.get(memo_key)
+        if entry is None:
+            self.count('computed_misses')
+            entry = self.computed[memo_key] = call_with_links(request, compute, indexing)
+        else:
+            self.count('computed_hits')
+            if indexing:
+                add_linked_uuids(request, entry[1], entry[2])
+        return entry[0]
+
+
+def get_item_object_memo_request(request):
+    """
+    Returns the request holding the ItemObjectMemo for `request`: when indexing, the @@index-data request of
+    the Item being indexed (the outermost indexing request, as its embeds are sub-requests of it), so that
+    objects are not kept for a whole indexing run; else the root request.
+    """
+    if getattr(request, '_indexing_view', False) is True:
+        while getattr(getattr(request, '__parent__', None), '_indexing_view', False) is True:
+            request = request.__parent__
+        return request
+    return get_root_request() or request
+
+
+def get_item_object_memo(request):
+    """
+    Returns the ItemObjectMemo for `request` (see get_item_object_memo_request),
+    or None if objects are not memoized for it, i.e. for requests which may modify Items.
+    """
+    memo_request = get_item_object_memo_request(request)
+    memo = getattr(memo_request, '_item_object_memo', None)
+    if memo is None:
+        indexing = getattr(request, '_indexing_view', False) is True
+        if not indexing and memo_request.method not in ITEM_OBJECT_MEMO_METHODS:
+            return None
+        capacity = int(request.registry.settings.get('item_object_memo.capacity', DEFAULT_ITEM_OBJECT_MEMO_CAPACITY))
+        memo = memo_request._item_object_memo = ItemObjectMemo(getattr(memo_request, '_stats', None), capacity)
+    return memo
+
+
+def get_computed_memo(request):
+    """
+    Returns the ItemObjectMemo holding values memoized with get_memoized for `request`. When indexing, it is
+    held by the request indexing the batch of Items (the parent of their @@index-data requests), whose embeds
+    all read the same READ ONLY REPEATABLE READ snapshot, so that values shared by several indexed Items (e.g.
+    the experiment context of the Files of an Experiment) are computed once per batch; it is bounded like
+    the memo of objects, and linked uuids are replayed on every indexed Item. Else see get_item_object_memo.
+    """
+    if getattr(request, '_indexing_view', False) is not True:
+        return get_item_object_memo(request)
+    memo_request = get_item_object_memo_request(request)
+    memo_request = getattr(memo_request, '__parent__', None) or memo_request
+    memo = getattr(memo_request, '_computed_memo', None)
+    if memo is None:
+        capacity = int(request.registry.settings.get('item_object_memo.capacity', DEFAULT_ITEM_OBJECT_MEMO_CAPACITY))
+        memo = memo_request._computed_memo = ItemObjectMemo(getattr(memo_request, '_stats', None), capacity)
+    return memo
+
+
+def add_linked_uuids(request, linked_uuids, rev_linked_uuids_by_item):
+    """ Records linked uuids and rev links on `request` as request.embed does """
+    request._linked_uuids.update(linked_uuids)
+    for item, rev_links in rev_linked_uuids_by_item.items():
+        request._rev_linked_uuids_by_item.setdefault(item, {}).update(rev_links)
+
+
+def call_with_links(request, func, indexing):
+    """
+    Returns (func(), linked uuids, rev links by item recorded by it). Linked uuids are
+    only collected (separately from those already on `request`) when indexing.
+    """
+    if not indexing:
+        return func(), None, None
+    linked_uuids, rev_linked_uuids_by_item = request._linked_uuids, request._rev_linked_uuids_by_item
+    request._linked_uuids, request._rev_linked_uuids_by_item = set(), {}
+    try:
+        result = func()
+        return result, request._linked_uuids, request._rev_linked_uuids_by_item
+    finally:
+        embed_links = request._linked_uuids, request._rev_linked_uuids_by_item
+        request._linked_uuids, request._rev_linked_uuids_by_item = linked_uuids, rev_linked_uuids_by_item
+        add_linked_uuids(request, *embed_links)
+
+
+def embed_object_with_links(request, path, indexing):
+    """ Returns (object, linked uuids, rev links by item) of the Item at `path` (see call_with_links) """
+    return call_with_links(request, lambda: request.embed(path, '@@object'), indexing)
+
+
+def load_item_object(request, path, indexing):
+    """
+    Returns (object, linked uuids, rev links by item) for `path` like embed_object_with_links,
+    from the reference item cache if it holds the Item (see reference_item_cache.py).
+    """
+    entry = get_cached_reference_object(request, path, indexing)
+    if entry is None:
+        entry = embed_object_with_links(request, path, indexing)
+        cache_reference_object(request, path, *entry)
+    elif indexing:
+        add_linked_uuids(request, entry[1], entry[2])
+    return entry
+
+
+def item_path(value, itype=None):
+    """ Path of an Item given as @id, uuid or unique key (within `itype` collection), or dict with uuid/@id """
+    if isinstance(value, dict):
+        if 'uuid' in value:
+            value = value['uuid']
+        elif '@id' in value:
+            value = value['@id']
+    path = str(value)
+    # Below case is for UUIDs & unique_keys such as accessions, but not @ids
+    if not path.startswith('/') and not path.endswith('/'):
+        path = '/' + path + '/'
+        if itype is not None:
+            path = '/' + itype + path
+    return path
+
+
+def get_item_object(request, value, itype=None):
+    """
+    Returns the object frame of the Item given by `value` (see item_path), memoized for the
+    response or indexed Item (see get_item_object_memo). Raises like request.embed if the Item cannot be found.
+    """
+    path = item_path(value, itype)
+    memo = get_item_object_memo(request)
+    if memo is None:
+        return request.embed(path, '@@object')
+    return memo.get(request, path)
+
+
+def get_memoized(request, key, compute):
+    """
+    Returns compute(), memoized under `key` for the response or indexing batch (see get_computed_memo and
+    ItemObjectMemo.get_computed). `compute` may only depend on Items it looks up through get_item_object.
+    """
+    memo = get_computed_memo(request)
+    if memo is None:
+        return compute()
+    return memo.get_computed(request, key, compute)
+
+
+def get_item_or_none(request, value, itype=None, frame='object'):
+    """
+    Return the view of an item with given frame, or None on failure. Same as
+    snovault.types.base.get_item_or_none, but object frames go through get_item_object.
+    """
+    path = item_path(value, itype)
+    try:
+        if frame == 'object':
+            return get_item_object(request, path)
+        # Use '@@' syntax instead of 'frame=' because these paths are cached in indexing
+        return request.embed(path, '@@' + frame)
+    except Exception:
+        return None
 
 ##
 ## Common lists of embeds to be re-used in certain files (similar to schema mixins)
@@ -28,6 +28,7 @@ from snovault.util import debug_log
 from .base import (
     Item,
     ALLOW_SUBMITTER_ADD_ACL,
+    get_item_object,
     get_item_or_none,
     lab_award_attribution_embed_list
 )
@@ -459,7 +460,7 @@ class Experiment(Item):
         if references:
             return references[0]
 
-        esets = [request.embed('/', str(uuid), '@@object') for uuid in
+        esets = [get_item_object(request, str(uuid)) for uuid in
                  self.experiment_sets(request)]
         # replicate experiment set is the boss
         reps = [eset for eset in esets if 'ExperimentSetReplicate' in eset['@type']]
@@ -477,7 +478,7 @@ class Experiment(Item):
         }
     })
     def publications_of_exp(self, request):
-        esets = [request.embed('/', str(uuid), '@@object') for uuid in
+        esets = [get_item_object(request, str(uuid)) for uuid in
                  self.experiment_sets(request)]
         pubs = list(set(itertools.chain.from_iterable([eset.get('publications_of_set', [])
                                                       for eset in esets])))
@@ -502,12 +503,12 @@ class Experiment(Item):
         elif targeted_factor:
             tstring = ''
             for tf in targeted_factor:
-                target_props = request.embed(tf, '@@object')
+                target_props = get_item_object(request, tf)
                 tstring += ', {}'.format(target_props['display_title'])
             out_dict['field'] = 'Target'
             out_dict['value'] = tstring[2:]
         elif digestion_enzyme:
-            obj = request.embed('/', digestion_enzyme, '@@object')
+            obj = get_item_object(request, digestion_enzyme)
             out_dict['field'] = 'Enzyme'
             out_dict['value'] = obj['display_title']
         if out_dict['value'] is not None:
@@ -542,12 +543,12 @@ class ExperimentHiC(Experiment):
         "type": "string",
     })
     def experiment_summary(self, request, experiment_type, biosample, digestion_enzyme=None):
-        sum_str = request.embed(experiment_type, '@@object')['display_title']
-        biosamp_props = request.embed(biosample, '@@object')
+        sum_str = get_item_object(request, experiment_type)['display_title']
+        biosamp_props = get_item_object(request, biosample)
         biosource = biosamp_props['biosource_summary']
         sum_str += (' on ' + biosource)
         if digestion_enzyme:
-            de_props = request.embed(digestion_enzyme, '@@object')
+            de_props = get_item_object(request, digestion_enzyme)
             de_name = de_props['name']
             sum_str += (' with ' + de_name)
         return sum_str
@@ -610,14 +611,14 @@ class ExperimentCaptureC(Experiment):
         "type": "string",
     })
     def experiment_summary(self, request, experiment_type, biosample, digestion_enzyme=None):
-        sum_str = request.embed(experiment_type, '@@object')['display_title']
+        sum_str = get_item_object(request, experiment_type)['display_title']
 
-        biosamp_props = request.embed(biosample, '@@object')
+        biosamp_props = get_item_object(request, biosample)
         biosource = biosamp_props['biosource_summary']
 
         sum_str += (' on ' + biosource)
         if digestion_enzyme:
-            de_props = request.embed(digestion_enzyme, '@@object')
+            de_props = get_item_object(request, digestion_enzyme)
             de_name = de_props['name']
             sum_str += (' with ' + de_name)
         return sum_str
@@ -638,7 +639,7 @@ class ExperimentCaptureC(Experiment):
             for tregion in targeted_regions:
                 targetfeats = tregion.get('target', [])
                 for feat in targetfeats:
-                    region = request.embed(feat, '@@object')['display_title']
+                    region = get_item_object(request, feat)['display_title']
                     regions.append(region)
             if regions:
                 value = ', '.join(sorted(regions))
@@ -683,8 +684,8 @@ class ExperimentRepliseq(Experiment):
         "type": "string",
     })
     def experiment_summary(self, request, experiment_type, biosample, cell_cycle_phase=None, stage_fraction=None):
-        sum_str = request.embed(experiment_type, '@@object')['display_title']
-        biosamp_props = request.embed(biosample, '@@object')
+        sum_str = get_item_object(request, experiment_type)['display_title']
+        biosamp_props = get_item_object(request, biosample)
         biosource = biosamp_props['biosource_summary']
         sum_str += (' on ' + biosource)
         if cell_cycle_phase:
@@ -741,8 +742,8 @@ class ExperimentAtacseq(Experiment):
         "type": "string",
     })
     def experiment_summary(self, request, experiment_type, biosample):
-        sum_str = request.embed(experiment_type, '@@object')['display_title']
-        biosamp_props = request.embed(biosample, '@@object')
+        sum_str = get_item_object(request, experiment_type)['display_title']
+        biosamp_props = get_item_object(request, biosample)
         biosource = biosamp_props['biosource_summary']
         sum_str += (' on ' + biosource)
         return sum_str
@@ -789,16 +790,16 @@ class ExperimentChiapet(Experiment):
         "type": "string",
     })
     def experiment_summary(self, request, experiment_type, biosample, targeted_factor=None):
-        sum_str = request.embed(experiment_type, '@@object')['display_title']
+        sum_str = get_item_object(request, experiment_type)['display_title']
 
         if targeted_factor:
             tstring = ''
             for tf in targeted_factor:
-                target_props = request.embed(tf, '@@object')
+                target_props = get_item_object(request, tf)
                 tstring += ', {}'.format(target_props['display_title'])
             sum_str += (' against ' + tstring[2:])
 
-        biosamp_props = request.embed(biosample, '@@object')
+        biosamp_props = get_item_object(request, biosample)
         biosource = biosamp_props['biosource_summary']
         sum_str += (' on ' + biosource)
         return sum_str
@@ -833,17 +834,17 @@ class ExperimentDamid(Experiment):
         "type": "string",
     })
     def experiment_summary(self, request, experiment_type, biosample, targeted_factor=None):
-        sum_str = request.embed(experiment_type, '@@object')['display_title']
+        sum_str = get_item_object(request, experiment_type)['display_title']
 
         if targeted_factor:
             if len(targeted_factor) == 1:
-                tname = request.embed(targeted_factor[0], '@@object')['display_title']
+                tname = get_item_object(request, targeted_factor[0])['display_title']
                 fusion = tname.split(' ')[0]
                 sum_str += (' with DAM-' + fusion)
             else:
                 sum_str += (' with mulitiple DAM fusions')
 
-        biosamp_props = request.embed(biosample, '@@object')
+        biosamp_props = get_item_object(request, biosample)
         biosource = biosamp_props['biosource_summary']
         sum_str += (' on ' + biosource)
         return sum_str
@@ -890,16 +891,16 @@ class ExperimentSeq(ItemWithAttachment, Experiment):
         "type": "string",
     })
     def experiment_summary(self, request, experiment_type, biosample, targeted_factor=None):
-        sum_str = request.embed(experiment_type, '@@object')['display_title']
+        sum_str = get_item_object(request, experiment_type)['display_title']
 
         if targeted_factor:
             tstring = ''
             for tf in targeted_factor:
-                target_props = request.embed(tf, '@@object')
+                target_props = get_item_object(request, tf)
                 tstring += ', {}'.format(target_props['display_title'])
             sum_str += (' against ' + tstring[2:])
 
-        biosamp_props = request.embed(biosample, '@@object')
+        biosamp_props = get_item_object(request, biosample)
         biosource = biosamp_props['biosource_summary']
         sum_str += (' on ' + biosource)
         return sum_str
@@ -949,16 +950,16 @@ class ExperimentTsaseq(ItemWithAttachment, Experiment):
         "type": "string",
     })
     def experiment_summary(self, request, experiment_type, biosample, targeted_factor=None):
-        sum_str = request.embed(experiment_type, '@@object')['display_title']
+        sum_str = get_item_object(request, experiment_type)['display_title']
 
         if targeted_factor:
             tstring = ''
             for tf in targeted_factor:
-                target_props = request.embed(tf, '@@object')
+                target_props = get_item_object(request, tf)
                 tstring += ', {}'.format(target_props['display_title'])
             sum_str += (' against ' + tstring[2:])
 
-        biosamp_props = request.embed(biosample, '@@object')
+        biosamp_props = get_item_object(request, biosample)
         biosource = biosamp_props['biosource_summary']
         sum_str += (' on ' + biosource)
         return sum_str
@@ -1038,8 +1039,8 @@ class ExperimentMic(Experiment):
         "type": "string",
     })
     def experiment_summary(self, request, experiment_type, biosample):
-        sum_str = request.embed(experiment_type, '@@object')['display_title']
-        biosamp_props = request.embed(biosample, '@@object')
+        sum_str = get_item_object(request, experiment_type)['display_title']
+        biosamp_props = get_item_object(request, biosample)
         biosource = biosamp_props['biosource_summary']
         sum_str += (' on ' + biosource)
         return sum_str
@@ -33,6 +33,20 @@ from .dependencies import DependencyEmbedder
 import datetime
 
 
+# Fields of ExperimentSet.rollup_counts, see calculate_rollup_counts
+ROLLUP_COUNT_FIELDS = [
+    'experiments',
+    'exp_raw_files',
+    'exp_processed_files',
+    'exp_other_processed_files',
+    'expset_processed_files',
+    'expset_other_processed_files',
+    'exp_raw_files_volume',
+    'exp_processed_files_volume',
+    'expset_processed_files_volume'
+]
+
+
 @collection(
     name='experiment-sets',
     unique_key='accession',
@@ -533,6 +547,61 @@ class ExperimentSet(Item):
         if experiments_in_set:
             return len(experiments_in_set)
 
+    @calculated_property(schema={
+        "title": "Rollup Counts",
+        "description": "Per-set file and experiment counts and volumes, precomputed at index time for statistics aggregations.",
+        "type": "object",
+        "properties": {
+            name: {"type": "number" if name.endswith('_volume') else "integer"}
+            for name in ROLLUP_COUNT_FIELDS
+        }
+    })
+    def rollup_counts(self, request, experiments_in_set=None, processed_files=None, other_processed_files=None):
+        # Only needed in the ES document; skip the extra lookups when rendering for API/UI.
+        if not getattr(request, '_indexing_view', False):
+            return None
+        return calculate_rollup_counts(request, experiments_in_set, processed_files, other_processed_files)
+
+
+def calculate_rollup_counts(request, experiments_in_set=None, processed_files=None, other_processed_files=None):
+    """
+    Counts the unique files (by @id) of an ExperimentSet and its Experiments, per category,
+    and sums the sizes of raw & processed files. Used by visualization endpoints as a cheap
+    `sum` alternative to `cardinality` aggregations over the embedded file accessions.
+    """
+    def flatten_opfs(opfs):
+        return {f for opf in (opfs or []) for f in opf.get('files', [])}
+
+    def total_size(file_ids):
+        total = 0
+        for file_id in file_ids:
+            file_obj = get_item_or_none(request, file_id, 'files')
+            if file_obj and file_obj.get('file_size'):
+                total += file_obj['file_size']
+        return total
+
+    exp_raw_files, exp_processed_files, exp_opf_files = set(), set(), set()
+    for exp_id in experiments_in_set or []:
+        exp = get_item_or_none(request, exp_id, 'experiments')
+        if not exp:
+            continue
+        exp_raw_files.update(exp.get('files', []))
+        exp_processed_files.update(exp.get('processed_files', []))
+        exp_opf_files.update(flatten_opfs(exp.get('other_processed_files')))
+    expset_processed_files = set(processed_files or [])
+
+    return {
+        'experiments': len(experiments_in_set or []),
+        'exp_raw_files': len(exp_raw_files),
+        'exp_processed_files': len(exp_processed_files),
+        'exp_other_processed_files': len(exp_opf_files),
+        'expset_processed_files': len(expset_processed_files),
+        'expset_other_processed_files': len(flatten_opfs(other_processed_files)),
+        'exp_raw_files_volume': total_size(exp_raw_files),
+        'exp_processed_files_volume': total_size(exp_processed_files),
+        'expset_processed_files_volume': total_size(expset_processed_files)
+    }
+
 
 def _build_experiment_set_replicate_embedded_list():
     """ Helper function intended to be used to create the embedded list for Replicate Experiment Sets.
@@ -56,12 +56,15 @@ from urllib.parse import (
 )
 from uuid import uuid4
 from ..authentication import session_properties
+from ..aws_clients import get_aws_client
 from ..search import make_search_subreq
 from ..util import check_user_is_logged_in
 from .base import (
     Item,
     ALLOW_SUBMITTER_ADD_ACL,
+    get_item_object,
     get_item_or_none,
+    get_memoized,
     lab_award_attribution_embed_list
 )
 from .dependencies import DependencyEmbedder
@@ -71,6 +74,11 @@ logging.getLogger('boto3').setLevel(logging.CRITICAL)
 
 log = structlog.getLogger(__name__)
 
+OPEN_DATA_BUCKET = '4dn-open-data-public'
+OPEN_DATA_KEY_PREFIX = 'fourfront-webprod'
+# folders of the Open Data bucket files are transferred to, in order of precedence
+OPEN_DATA_LOCATIONS = ('wfoutput', 'files')
+
 # XXX: Need expanding to cover display_title
 file_workflow_run_embeds = [
     'workflow_run_inputs.workflow.title',
@@ -100,7 +108,7 @@ def show_upload_credentials(request=None, context=None, status=None):
     return request.has_permission('edit', context)
 
 
-def external_creds(bucket, key, name=None, profile_name=None):
+def external_creds(bucket, key, name=None, profile_name=None, registry=None):
     """
     if name is None, we want the link to s3 but no need to generate
     an access token.  This is useful for linking metadata to files that
@@ -129,7 +137,7 @@ def external_creds(bucket, key, name=None, profile_name=None):
                 token = conn.get_federation_token(Name=name, Policy=json.dumps(policy))
         else:
             # boto.set_stream_logger('boto3')
-            conn = boto3.client('sts')
+            conn = get_aws_client(registry, 'sts') if registry is not None else boto3.client('sts')
             token = conn.get_federation_token(Name=name, Policy=json.dumps(policy))
         # 'access_key' 'secret_key' 'expiration' 'session_token'
         credentials = token.get('Credentials')
@@ -412,20 +420,18 @@ class File(Item):
         )
         return title.replace('  ', ' ').rstrip()
 
-    def _get_file_expt_bucket(self, request, item2check):
-        fatid = self.jsonld_id(request)
-        if 'files' in item2check:
-            if fatid in item2check.get('files'):
-                return 'raw file'
-        if 'processed_files' in item2check:
-            if fatid in item2check.get('processed_files'):
-                return 'processed file'
-        of_info = item2check.get('other_processed_files', [])
-        for obucket in of_info:
-            ofiles = obucket.get('files')
-            if [of for of in ofiles if of == fatid]:
-                return obucket.get('title')
-        return None
+    @staticmethod
+    def _get_expt_file_buckets(item2check):
+        """ Maps @ids of the files of an experiment or set to their bucket (raw, processed or other files title) """
+        buckets = {}
+        for fatid in item2check.get('files', []):
+            buckets.setdefault(fatid, 'raw file')
+        for fatid in item2check.get('processed_files', []):
+            buckets.setdefault(fatid, 'processed file')
+        for obucket in item2check.get('other_processed_files', []):
+            for fatid in obucket.get('files', []):
+                buckets.setdefault(fatid, obucket.get('title'))
+        return buckets
 
     def _get_ds_cond_lab_from_repset(self, request, repset):
         elab = get_item_or_none(request, repset.get('lab'))
@@ -464,11 +470,32 @@ class File(Item):
         else:
             return info
 
+        # the experiment context is the same for all files of the experiment (or set), so is
+        # memoized for the whole response or indexing batch; only the file bucket is per file
+        get_biosource = 'biosource_name' not in currinfo
+        context = get_memoized(
+            request, ('track_context', expid, repsetid, get_biosource),
+            lambda: self._get_experiment_track_context(request, expid, repsetid, get_biosource)
+        )
+        info.update(context['info'])
+        if context['file_buckets'] is not None:
+            info['experiment_bucket'] = context['file_buckets'].get(self.jsonld_id(request))
+        return {k: v for k, v in info.items() if v is not None}
+
+    def _get_experiment_track_context(self, request, expid, repsetid, get_biosource):
+        """
+        Track and facet info shared by the files of experiment `expid` or replicate set `repsetid`:
+        {'info': info, 'file_buckets': experiment buckets by file @id, or None if not found}.
+        Depends only on its arguments, as it is memoized by _get_file_experiment_info.
+        """
+        info = {}
+        context = {'info': info, 'file_buckets': None}
+
         # here we have either an expid or a repsetid
         if repsetid:  # get 2 fields and get an expt to get other info
             rep_set_info = get_item_or_none(request, repsetid)
             if not rep_set_info:
-                return info
+                return context
             # pieces of info to get from the repset if there is one
             ds, c, el = self._get_ds_cond_lab_from_repset(request, rep_set_info)
             info['dataset'] = ds
@@ -476,12 +503,12 @@ class File(Item):
             info['experimental_lab'] = el
             expts_in_set = rep_set_info.get('experiments_in_set', [])
             if not expts_in_set:
-                return info
+                return context
             elif len(expts_in_set) == 1:
                 info['replicate_info'] = 'unreplicated'
             else:
                 info['replicate_info'] = 'merged replicates'
-            info['experiment_bucket'] = self._get_file_expt_bucket(request, rep_set_info)
+            context['file_buckets'] = self._get_expt_file_buckets(rep_set_info)
 
             # get the first experiment of set and set to experiment of file shared info
             expid = expts_in_set[0]
@@ -489,7 +516,7 @@ class File(Item):
         if expid:
             exp_info = get_item_or_none(request, expid)
             if not exp_info:  # sonmethings fishy - abort
-                return info
+                return context
             # check to see if we have experimental lab
             if 'experimental_lab' not in info or info.get('experimental_lab') is None:
                 elab = get_item_or_none(request, exp_info.get('lab'))
@@ -498,8 +525,8 @@ class File(Item):
             exp_type = get_item_or_none(request, exp_info.get('experiment_type'))
             if exp_type is not None:
                 info['experiment_type'] = exp_type.get('title')
-            if 'experiment_bucket' not in info:  # did not get it from rep_set
-                info['experiment_bucket'] = self._get_file_expt_bucket(request, exp_info)
+            if context['file_buckets'] is None:  # did not get it from rep_set
+                context['file_buckets'] = self._get_expt_file_buckets(exp_info)
             assay_info = exp_info.get('experiment_categorizer')
             if assay_info:
                 info['assay_info'] = assay_info.get('value')
@@ -522,13 +549,13 @@ class File(Item):
                             if rep.get('replicate_exp') == expid:
                                 repstring = f"Biorep {rep.get('bio_rep_no')}, Techrep {rep.get('tec_rep_no')}"
                                 info['replicate_info'] = repstring
-            if 'biosource_name' not in currinfo:
+            if get_biosource:
                 sample_id = exp_info.get('biosample')
                 if sample_id is not None:
                     sample = get_item_or_none(request, sample_id)
                     if sample is not None:
                         info['biosource_name'] = sample.get('biosource_summary')
-        return {k: v for k, v in info.items() if v is not None}
+        return context
 
     @calculated_property(schema={
         "title": "Track and Facet Info",
@@ -669,7 +696,7 @@ class File(Item):
             if old_creds.get('key') != new_creds.get('key'):
                 try:
                     # delete the old sumabeach
-                    conn = boto3.client('s3')
+                    conn = get_aws_client(self.registry, 's3')
                     bname = old_creds['bucket']
                     conn.delete_object(Bucket=bname, Key=old_creds['key'])
                 except Exception as e:
@@ -823,7 +850,7 @@ class File(Item):
 
     def get_presigned_url_location(self, external, request, filename) -> str:
         """ Opens an S3 boto3 client and returns a presigned url for the requested file to be downloaded"""
-        conn = boto3.client('s3')
+        conn = get_aws_client(request.registry, 's3')
         param_get_object = {
             'Bucket': external['bucket'],
             'Key': external['key'],
@@ -843,16 +870,17 @@ class File(Item):
         """ Returns the Open Data S3 url for the file if present (as a calculated property), and otherwise returns
             a presigned S3 URL to a 4DN bucket. """
         open_data_url = None
+        open_data_location = self.properties.get('open_data_location')
         if datastore_is_database:  # view model came from DB - must compute calc prop
-            open_data_url = self._open_data_url(self.properties['status'], filename=filename)
+            open_data_url = self._open_data_url(self.properties['status'], filename, open_data_location)
         else:  # view model came from elasticsearch - calc props should be here
             if hasattr(self.model, 'source'):
                 es_model_props = self.model.source['embedded']
                 open_data_url = es_model_props.get('open_data_url', '')
                 if filename not in open_data_url:  # we requested an extra_file, so recompute with correct filename
-                    open_data_url = self._open_data_url(self.properties['status'], filename=filename)
+                    open_data_url = self._open_data_url(self.properties['status'], filename, open_data_location)
             if not open_data_url:  # fallback to DB
-                open_data_url = self._open_data_url(self.properties['status'], filename=filename)
+                open_data_url = self._open_data_url(self.properties['status'], filename, open_data_location)
         if open_data_url:
             return open_data_url
         else:
@@ -864,34 +892,17 @@ class File(Item):
         """ Helper for below method for mocking purposes. """
         return client.head_object(Bucket=bucket, Key=key)
 
-    def _open_data_url(self, status, filename):
-        """ Helper for below method containing core functionality. """
-        if not filename:
+    def _open_data_url(self, status, filename, open_data_location=None):
+        """ Helper for below method containing core functionality. No S3 requests are made: whether (and where)
+            the file was transferred to the Open Data bucket is recorded in `open_data_location` by the
+            reconcile-open-data command. """
+        if not filename or not open_data_location:
             return None
         if status in ['released', 'archived']:
-            open_data_bucket = '4dn-open-data-public'
-            bucket_type = 'wfoutput'  # almost always going to be wfoutput
-            open_data_key = 'fourfront-webprod/{bucket_type}/{uuid}/{filename}'.format(
-                bucket_type=bucket_type, uuid=self.uuid, filename=filename,
-            )
-            extra_open_data_key = 'fourfront-webprod/{bucket_type}/{uuid}/{filename}'.format(
-                bucket_type='files', uuid=self.uuid, filename=filename,
+            return 'https://{open_data_bucket}.s3.amazonaws.com/{key_prefix}/{location}/{uuid}/{filename}'.format(
+                open_data_bucket=OPEN_DATA_BUCKET, key_prefix=OPEN_DATA_KEY_PREFIX,
+                location=open_data_location, uuid=self.uuid, filename=filename,
             )
-            # Check if the file exists in the Open Data S3 bucket under both wfoutput and files paths
-            client = boto3.client('s3')
-            for key in [open_data_key, extra_open_data_key]:
-                # If the file exists in the Open Data S3 bucket, client.head_object will succeed (not throw ClientError)
-                # Returning a valid S3 URL to the public url of the file
-                try:
-                    self._head_s3(client, open_data_bucket, key)
-                except ClientError:
-                    continue  # try the other key
-                location = 'https://{open_data_bucket}.s3.amazonaws.com/{open_data_key}'.format(
-                    open_data_bucket=open_data_bucket, open_data_key=key,
-                )
-                return location
-            else:
-                return None  # got client error for both possibilities
         else:
             return None
 
@@ -900,11 +911,13 @@ class File(Item):
         "description": "Location of file on Open Data Bucket, if it exists",
         "type": "string"
     })
-    def open_data_url(self, request, accession, file_format, status=None):
-        """ Computes the open data URL and checks if it exists. """
-        fformat = get_item_or_none(request, file_format, frame='raw')  # no calc props needed
+    def open_data_url(self, request, accession, file_format, status=None, open_data_location=None):
+        """ Computes the open data URL from the recorded Open Data location of the file. """
+        if not open_data_location:
+            return None
+        fformat = get_item_or_none(request, file_format, 'file-formats')
         filename = "{}.{}".format(accession, fformat.get('standard_file_extension', ''))
-        return self._open_data_url(status, filename)
+        return self._open_data_url(status, filename, open_data_location)
 
     @classmethod
     def get_bucket(cls, registry):
@@ -938,7 +951,7 @@ class File(Item):
             that will give us nothing and we should fallback to the bucket associated
             with the type.
         """
-        conn = boto3.client('s3')
+        conn = get_aws_client(registry, 's3')
         bucket = None
         key = cls.build_key(registry, uuid, properties)
         # _head_s3 for both files and wfoutput buckets if we are doing a download
@@ -960,7 +973,7 @@ class File(Item):
             name = fname.split('/')[-1][:32]
 
         profile_name = registry.settings.get('file_upload_profile_name')
-        return external_creds(bucket, key, name, profile_name)
+        return external_creds(bucket, key, name, profile_name, registry=registry)
 
     @classmethod
     def create(cls, registry, uuid, properties, sheets=None):
@@ -1173,7 +1186,7 @@ class FileProcessed(File):
                    self.rev_link_atids(request, "other_experiments"))
         if not exps == []:
             for exp in exps:
-                exp_data = request.embed(exp, '@@object')
+                exp_data = get_item_object(request, exp)
                 if not exp_data['experiment_sets'] == []:
                     exp_sets.update(exp_data['experiment_sets'])
         return list(exp_sets)
@@ -1256,7 +1269,7 @@ class FileVistrack(File):
     })
     def override_biosource_name(self, request, biosource=None):
         if biosource:
-            return request.embed(biosource, '@@object').get('biosource_name')
+            return get_item_object(request, biosource).get('biosource_name')
 
     @calculated_property(schema={
         "title": "Display Title",
@@ -1419,7 +1432,7 @@ def post_upload(context, request):
     if properties.get('filename'):
         name = properties.get('filename').split('/')[-1][:32]
     profile_name = request.registry.settings.get('file_upload_profile_name')
-    creds = external_creds(bucket, key, name, profile_name)
+    creds = external_creds(bucket, key, name, profile_name, registry=request.registry)
     # in case we haven't uploaded a file before
     context.propsheets['external'] = creds
 
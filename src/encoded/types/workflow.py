@@ -2,26 +2,36 @@
 """
 
 import copy
-import boto3
 import cProfile
 import io
 import json
 import pstats
+import structlog
+import time
 
 from collections import OrderedDict, deque
 from dcicutils.env_utils import default_workflow_env
 from dcicutils.s3_utils import s3Utils
+from elasticsearch_dsl import Search
 from inspect import signature
 from pyramid.httpexceptions import HTTPUnprocessableEntity
 from pyramid.response import Response
 from pyramid.view import view_config
-from snovault import calculated_property, collection, load_schema, CONNECTION, TYPES
+from snovault import calculated_property, collection, load_schema, CONNECTION, DBSESSION, TYPES
+from snovault.elasticsearch import ELASTIC_SEARCH
+from snovault.elasticsearch.esstorage import CachedModel
+from snovault.elasticsearch.indexer_utils import get_namespaced_index
+from snovault.storage import Link
 from snovault.util import debug_log
 from time import sleep
+from ..aws_clients import get_aws_client
 from .base import Item, lab_award_attribution_embed_list
 from .dependencies import DependencyEmbedder
 from encoded.root import SettingsKey
 
+
+log = structlog.getLogger(__name__)
+
 TIBANNA_CODE_NAME = 'pony'
 TIBANNA_WORKFLOW_RUNNER_LAMBDA_FUNCTION = 'run_workflow_pony'
 TIBANNA_WORKFLOW_STATUS_LAMBDA_FUNCTION = 'status_wfr_pony'
@@ -81,6 +91,7 @@ DEFAULT_TRACING_OPTIONS = {
     'max_depth_future': 9,
     "group_similar_workflow_runs": True,
     "track_performance": False,
+    "track_stats": False,
     "trace_direction": ["history"]
 }
 
@@ -89,7 +100,7 @@ class WorkflowRunTracingException(Exception):
     pass
 
 
-def item_model_to_object(model, request):
+def item_model_to_object(model, request, rev_links=None):
     '''
     Converts a model fetched via either ESStorage or RDBStorage into a class instance and then returns partial/performant JSON representation.
     Used as a 'lite' performant version of request.subrequest(...) which avoids overhead of spinning up extra HTTP requests & (potentially recursive) embeds.
@@ -97,6 +108,7 @@ def item_model_to_object(model, request):
 
     :param model: Pyramid model instance as returned from e.g. RDBStorage.get_by_uuid(uuid), ESStorage.get_by_uuid(uuid), RDBStorage.get_by_unique_key(key, value), etc.
     :param request: Pyramid request object.
+    :param rev_links: Optional dict of rel to list of source UUIDs for the model, as returned by `get_rev_links_by_uuid`, to use instead of querying them.
     :returns: JSON/Dictionary representation of the Item.
     '''
     ClassForItem = request.registry[TYPES].by_item_type.get(model.item_type).factory
@@ -124,10 +136,14 @@ def item_model_to_object(model, request):
 
     # If not yet indexed, calculate on back-end. (Fallback).
     # Much of the time, the entirety of rev links aren't returned?? Always get back more from ES than from here o.o'.
-    if not dict_repr.get('workflow_run_outputs') and hasattr(item_instance, 'workflow_run_outputs') and hasattr(model, 'revs'):
-        dict_repr['workflow_run_outputs'] = [ str(uuid) for uuid in request.registry[CONNECTION].storage.write.get_rev_links(model, item_instance.rev['workflow_run_outputs'][1]) ]
-    if not dict_repr.get('workflow_run_inputs') and hasattr(item_instance, 'workflow_run_inputs') and hasattr(model, 'revs'):
-        dict_repr['workflow_run_inputs'] = [ str(uuid) for uuid in request.registry[CONNECTION].storage.write.get_rev_links(model, item_instance.rev['workflow_run_inputs'][1]) ]
+    for rev_name in ('workflow_run_outputs', 'workflow_run_inputs'):
+        if dict_repr.get(rev_name) or not hasattr(item_instance, rev_name) or not hasattr(model, 'revs'):
+            continue
+        rel = item_instance.rev[rev_name][1]
+        if rev_links is not None:
+            dict_repr[rev_name] = [ str(uuid) for uuid in rev_links.get(rel, []) ]
+        else:
+            dict_repr[rev_name] = [ str(uuid) for uuid in request.registry[CONNECTION].storage.write.get_rev_links(model, rel) ]
 
     # For files -- include download link/href (if available)
     if hasattr(item_instance, 'href'):
@@ -139,6 +155,155 @@ def item_model_to_object(model, request):
     return dict_repr
 
 
+def get_indexed_models_by_uuid(request, uuids):
+    '''
+    Fetches the ES models of several Items with a single search, rather than one ESStorage.get_by_uuid per Item.
+    Returns a dict of UUID to model; Items which are not indexed are left out. Returns an empty dict if
+    the request doesn't use the ES datastore.
+    '''
+    es = request.registry.get(ELASTIC_SEARCH)
+    if es is None or not uuids or getattr(request, 'datastore', None) != 'elasticsearch':
+        return {}
+    search = Search(using=es, index=get_namespaced_index(request, '*'))
+    search = search.filter('ids', values=list(uuids)).extra(size=len(uuids))
+    return { hit.meta.id : CachedModel(hit) for hit in search.execute() }
+
+
+def get_rev_links_by_uuid(request, uuids, rels):
+    '''
+    Bulk equivalent of RDBStorage.get_rev_links for several target Items and rels at once.
+    Returns a dict of target UUID to dict of rel to list of source UUIDs.
+    '''
+    rev_links = { uuid : {} for uuid in uuids }
+    if not uuids or not rels:
+        return rev_links
+    session = request.registry[DBSESSION]
+    query = session.query(Link.target_rid, Link.rel, Link.source_rid).filter(
+        Link.target_rid.in_(list(uuids)), Link.rel.in_(list(rels))
+    )
+    for target_rid, rel, source_rid in query:
+        rev_links[str(target_rid)].setdefault(rel, []).append(source_rid)
+    return rev_links
+
+
+class TracingStats(object):
+    '''
+    Counters and accumulated timings (in seconds) of a provenance trace.
+    Timings are named after the phase they cover: 'fetch', 'grouping' and 'total'.
+    '''
+
+    def __init__(self):
+        self.counters = OrderedDict()
+        self.timings = OrderedDict()
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_time(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0) + seconds
+
+    def as_dict(self):
+        timings = OrderedDict(self.timings)
+        if 'total' in timings:
+            # Whatever isn't fetching Items or grouping workflow runs is spent assembling steps.
+            timings['assembly'] = max(timings['total'] - timings.get('fetch', 0) - timings.get('grouping', 0), 0)
+        return {
+            'counters': dict(self.counters),
+            'timings_ms': { name : round(seconds * 1000, 2) for name, seconds in timings.items() }
+        }
+
+
+
+class TracingItemCache(object):
+    '''
+    Per-request cache of Item models and their `item_model_to_object` representations used while tracing
+    provenance. Models of a whole frontier of UUIDs are fetched together with `prefetch`: one ES search,
+    plus one rev-link query for those Items which had to be read from the database.
+    Use `get_tracing_item_cache(request)` to share an instance across a request.
+    '''
+
+    def __init__(self, request):
+        self.request = request
+        self.models = {}
+        self.objects = {}
+        self.rev_links = {}
+        self.stats = TracingStats()
+
+    def prefetch(self, uuids):
+        uuids = { str(uuid) for uuid in uuids if uuid and str(uuid) not in self.models }
+        if not uuids:
+            return
+        start = time.perf_counter()
+        indexed_models = get_indexed_models_by_uuid(self.request, uuids)
+        self.models.update(indexed_models)
+        self.stats.count('es_bulk_fetches')
+        self.stats.count('es_models_fetched', len(indexed_models))
+        storage = self.request.registry[CONNECTION].storage
+        db_models = {}
+        for uuid in uuids - set(self.models.keys()):
+            model = storage.get_by_uuid(uuid)
+            self.stats.count('storage_fetches')
+            self.models[uuid] = model
+            if model is not None and not hasattr(model, 'source'):
+                db_models[uuid] = model
+        rels = set()
+        for model in db_models.values():
+            item_class = self.request.registry[TYPES].by_item_type[model.item_type].factory
+            rels.update(rev[1] for rev_name, rev in item_class.rev.items() if rev_name in ('workflow_run_outputs', 'workflow_run_inputs'))
+        if db_models:
+            self.stats.count('rev_link_queries')
+        self.rev_links.update(get_rev_links_by_uuid(self.request, db_models.keys(), rels))
+        self.stats.add_time('fetch', time.perf_counter() - start)
+
+    def get_model(self, uuid, key=None):
+        cache_key = uuid if key is None else key + ':' + uuid
+        model = self.models.get(cache_key)
+        if model is not None:
+            self.stats.count('model_cache_hits')
+            return model
+        self.stats.count('model_cache_misses')
+        start = time.perf_counter()
+        if key is None:
+            model = self.request.registry[CONNECTION].storage.get_by_uuid(uuid)
+        else:
+            model = self.request.registry[CONNECTION].storage.get_by_unique_key(key, uuid)
+            self.models[str(model.uuid)] = model
+        self.stats.count('storage_fetches')
+        self.stats.add_time('fetch', time.perf_counter() - start)
+        self.models[cache_key] = model
+        return model
+
+    def get_object(self, uuid, key=None):
+        model = self.get_model(uuid, key)
+        if model is None:
+            return None
+        model_uuid = str(model.uuid)
+        if model_uuid not in self.objects:
+            start = time.perf_counter()
+            self.objects[model_uuid] = item_model_to_object(model, self.request, self.rev_links.get(model_uuid))
+            self.stats.add_time('fetch', time.perf_counter() - start)  # May query rev links
+        return self.objects[model_uuid]
+
+    def touched_uuids(self):
+        '''UUIDs of all Items looked up so far.'''
+        return { str(model.uuid) for model in self.models.values() if model is not None }
+
+    def get_embed(self, uuid, key=None):
+        '''Returns @@embedded representation of UUID. Uses cached model. Returns None if not yet indexed.'''
+        model = self.get_model(uuid, key)
+        if not hasattr(model, 'source'):
+            return None
+        return model.source.get('embedded')
+
+
+def get_tracing_item_cache(request):
+    ''' Returns the TracingItemCache shared by everything tracing provenance within this request '''
+    cache = getattr(request, '_tracing_item_cache', None)
+    if cache is None:
+        cache = request._tracing_item_cache = TracingItemCache(request)
+    return cache
+
+
 def get_step_io_for_argument_name(argument_name, workflow_model_obj):
     for step in workflow_model_obj.get('steps', []):
         for input_io in step.get('inputs', []):
@@ -205,16 +370,22 @@ def trace_workflows(original_file_set_to_trace, request, options=None):
     Returns:
         A chronological list of steps (as dictionaries)
 
+    If `options['track_stats']` is set, counters & timings of the trace (see TracingStats) are logged;
+    they are also available afterwards as `get_tracing_item_cache(request).stats`.
+
     '''
 
     if options is None:
         options = DEFAULT_TRACING_OPTIONS
 
+    trace_start = time.perf_counter()
+
     if options.get('track_performance'):
         pr = cProfile.Profile()
         pr.enable()
 
-    uuidCacheModels = {}
+    item_cache = get_tracing_item_cache(request)
+    stats = item_cache.stats
     uuidCacheTracedHistory = {}
     uuidCacheGroupSourcesByRun = {}
 
@@ -222,36 +393,17 @@ def trace_workflows(original_file_set_to_trace, request, options=None):
     steps = []                          # What we return
     current_step_route = []             # Intermediate structure to hold chronologically-ordered steps while tracing a connected route
 
-    def get_model(uuid, key=None):
-        model = None
-        cacheKey = uuid
-        if key is not None:
-            cacheKey = key + ':' + uuid
-
-        model = uuidCacheModels.get(cacheKey)
-        if model is not None:
-            return model
+    get_model_obj = item_cache.get_object
+    get_model_embed = item_cache.get_embed
 
-        if key is None:
-            model = request.registry[CONNECTION].storage.get_by_uuid(uuid)
-        else:
-            model = request.registry[CONNECTION].storage.get_by_unique_key(key, uuid)
-
-        if key is not None:
-            uuidCacheModels[str(model.uuid)] = model
-        uuidCacheModels[cacheKey] = model
-
-        return model
-
-    def get_model_obj(uuid, key=None):
-        return item_model_to_object(get_model(uuid, key), request)
-
-    def get_model_embed(uuid, key=None):
-        '''Returns @@embedded representation of UUID. Uses cached model. Returns None if not yet indexed.'''
-        model = get_model(uuid, key)
-        if not hasattr(model, 'source'):
+    def last_workflow_run_uuid_output_of(file_obj):
+        output_of_workflow_runs = file_obj.get('workflow_run_outputs', [])
+        if len(output_of_workflow_runs) == 0:
             return None
-        return model.source.get('embedded')
+        last_workflow_run_output_of = output_of_workflow_runs[-1]
+        if isinstance(last_workflow_run_output_of, dict): # Case if file_obj is @@embedded representation
+            return last_workflow_run_output_of['uuid']
+        return last_workflow_run_output_of # Case if file_obj is @@object representation
 
 
     def group_files_by_workflow_argument_name(set_of_files):
@@ -340,23 +492,22 @@ def trace_workflows(original_file_set_to_trace, request, options=None):
         # Gather all workflow_runs out of which our input files (1 run per file) come from
         all_workflow_runs = []
 
+        # Fetch the runs our input files came out of, and the input files' own models, in one go.
+        item_cache.prefetch(
+            [ last_workflow_run_uuid_output_of(f) for f in in_file_embeds if not uuidCacheTracedHistory.get(f['uuid']) ] +
+            [ f['uuid'] for f in in_file_embeds ]
+        )
+
         for in_file_embed in in_file_embeds:
             in_file_uuid = in_file_embed['uuid']
 
             if uuidCacheTracedHistory.get(in_file_uuid):
+                stats.count('traced_history_cache_hits')
                 sources = sources + uuidCacheTracedHistory[in_file_uuid]
                 continue
 
             # Get @ids from ES source.
-            output_of_workflow_runs = in_file_embed.get('workflow_run_outputs', [])
-            if len(output_of_workflow_runs) == 0:
-                continue
-
-            last_workflow_run_output_of = output_of_workflow_runs[-1]
-            if isinstance(last_workflow_run_output_of, dict): # Case if in_file_embed are @@embedded representation
-                workflow_run_uuid = last_workflow_run_output_of['uuid']
-            else: # Case if in_file_embed are @@object representation
-                workflow_run_uuid = last_workflow_run_output_of
+            workflow_run_uuid = last_workflow_run_uuid_output_of(in_file_embed)
             if not workflow_run_uuid:
                 continue
 
@@ -368,7 +519,10 @@ def trace_workflows(original_file_set_to_trace, request, options=None):
 
 
 
+        grouping_start = time.perf_counter()
         filtered_in_workflow_runs, filtered_out_workflow_runs = filter_workflow_runs(all_workflow_runs)
+        stats.add_time('grouping', time.perf_counter() - grouping_start)
+        stats.count('grouped_workflow_runs', len(filtered_out_workflow_runs))
 
         for workflow_run_embed, in_file_embed in filtered_in_workflow_runs:
             sources_for_in_file = try_match_input_with_workflow_run_output_to_generate_source(workflow_run_embed, in_file_embed)
@@ -423,6 +577,7 @@ def trace_workflows(original_file_set_to_trace, request, options=None):
                     if outfile['uuid'] == current_file_model_object['uuid']:
                         output['meta']['in_path'] = True
                         runs_current_file_goes_to = current_file_model_object.get('workflow_run_inputs', [])
+                        item_cache.prefetch([ (r['uuid'] if isinstance(r, dict) else r) for r in runs_current_file_goes_to ])
 
                         for target_workflow_run_uuid in runs_current_file_goes_to:
                             if isinstance(target_workflow_run_uuid, dict): # Case if current_file_model_object is embedded representation
@@ -454,6 +609,7 @@ def trace_workflows(original_file_set_to_trace, request, options=None):
         # If we've already traced inputs of this workflowrun, lets skip tracing it.
         # But, lets loop over its outputs and extend them with proper target reference to next step if our current file matches one of this already-traced runs output files.
         if uuidCacheTracedHistory.get(workflow_run_uuid):
+            stats.count('traced_history_cache_hits')
             if uuidCacheTracedHistory[workflow_run_uuid] is True:
                 raise WorkflowRunTracingException("Error -- WorkflowRun with UUID '" + workflow_run_uuid + "' has been RE-ENCOUNTERED while tracing file with UUID '" + current_file_model_object['uuid'] + "'. Likely this file appears on both input and output -side of a WorkflowRun (or chain of WorkflowRuns).")
             add_next_targets_to_step_from_file(uuidCacheTracedHistory[workflow_run_uuid], current_file_model_object)
@@ -462,12 +618,19 @@ def trace_workflows(original_file_set_to_trace, request, options=None):
         if uuidCacheGroupSourcesByRun.get(workflow_run_uuid) is not None:
             return
 
+        stats.count('nodes_visited')
         uuidCacheTracedHistory[workflow_run_uuid] = True # Placeholder, becomes reference to real step (dictionary defined below as variable 'step') upon completing tracing of files being input into this step/workflow_run.
 
         workflow_run_model_obj = get_model_obj(workflow_run_uuid)
         if not workflow_run_model_obj:
             return
 
+        # Fetch the Workflow and all input & output files of this run at once.
+        item_cache.prefetch(
+            [ workflow_run_model_obj.get('workflow') ] +
+            [ (f.get('value') or f.get('value_qc')) for f in workflow_run_model_obj.get('output_files', []) + workflow_run_model_obj.get('input_files', []) ]
+        )
+
         # We create the structure of our steps to emulate the structure of `Workflow.steps`,
         # as defined in the Workflow schema. This means we might wedge another field into the
         # `step.meta.analysis_step_types` property here.
@@ -579,6 +742,7 @@ def trace_workflows(original_file_set_to_trace, request, options=None):
     ###########################################
 
     # Initialize our stack (deque) of steps to process with WFR(s) that file(s) we received are output from.
+    item_cache.prefetch([ last_workflow_run_uuid_output_of(f) for f in original_file_set_to_trace ])
     for original_file in original_file_set_to_trace:
         file_item_output_of_workflow_run_uuids = original_file.get('workflow_run_outputs', [])
 
@@ -630,6 +794,11 @@ def trace_workflows(original_file_set_to_trace, request, options=None):
             break
         steps.append(curr_step)
 
+    stats.add_time('total', time.perf_counter() - trace_start)
+    stats.count('steps', len(steps))
+    if options.get('track_stats'):
+        log.info('Traced workflow runs', files_traced=len(original_file_set_to_trace), **stats.as_dict())
+
     if options.get('track_performance'):
         pr.disable()
         s = io.StringIO()
@@ -965,7 +1134,7 @@ def pseudo_run(context, request):
             input_json['input_files'][i]['bucket_name'] = 'elasticbeanstalk-%s-files' % env
 
     # hand-off to tibanna for further processing
-    aws_lambda = boto3.client('lambda', region_name='us-east-1')
+    aws_lambda = get_aws_client(request.registry, 'lambda', region_name='us-east-1')
     res = aws_lambda.invoke(FunctionName=TIBANNA_WORKFLOW_RUNNER_LAMBDA_FUNCTION,
                             Payload=json.dumps(input_json))
     res_decode = res['Payload'].read().decode()
@@ -985,7 +1154,7 @@ def pseudo_run(context, request):
 
     if res_dict['status'] == 'FAILED':
         # get error from execution and sent a 422 response
-        sfn = boto3.client('stepfunctions', region_name='us-east-1')
+        sfn = get_aws_client(request.registry, 'stepfunctions', region_name='us-east-1')
         hist = sfn.get_execution_history(executionArn=res_dict['executionArn'], reverseOrder=True)
         for event in hist['events']:
             if event.get('type') == 'ExecutionFailed':
@@ -1013,7 +1182,7 @@ def run_workflow(context, request):
     input_json['env_name'] = env
 
     # hand-off to tibanna for further processing
-    aws_lambda = boto3.client('lambda', region_name='us-east-1')
+    aws_lambda = get_aws_client(request.registry, 'lambda', region_name='us-east-1')
     res = aws_lambda.invoke(FunctionName=TIBANNA_WORKFLOW_RUNNER_LAMBDA_FUNCTION,
                             Payload=json.dumps(input_json))
     res_decode = res['Payload'].read().decode()
@@ -1031,7 +1200,7 @@ def run_workflow(context, request):
 
     if res_dict['status'] == 'FAILED':
         # get error from execution and sent a 422 response
-        sfn = boto3.client('stepfunctions', region_name='us-east-1')
+        sfn = get_aws_client(request.registry, 'stepfunctions', region_name='us-east-1')
         hist = sfn.get_execution_history(executionArn=res_dict['executionArn'], reverseOrder=True)
         for event in hist['events']:
             if event.get('type') == 'ExecutionFailed':
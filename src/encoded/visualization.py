@@ -1,7 +1,7 @@
 from pyramid.response import Response
 from pyramid.view import view_config
 from pyramid.httpexceptions import HTTPBadRequest
-from snovault import CONNECTION
+from pyramid.settings import asbool
 from snovault.util import debug_log
 from copy import (
     copy,
@@ -14,20 +14,40 @@ from urllib.parse import (
 )
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+from functools import wraps
+import hashlib
 import uuid
+from snovault.elasticsearch import ELASTIC_SEARCH
+from snovault.elasticsearch.indexer_utils import get_namespaced_index
 from .search import (
     DEFAULT_BROWSE_PARAM_LISTS,
     make_search_subreq,
     search as perform_search_request
 )
+from .provenance_cache import (
+    get_provenance_cache,
+    make_provenance_cache_key
+)
+from .search_cache import (
+    get_expiring_cache,
+    get_index_generation,
+    principals_fingerprint
+)
 from .types.base import Item
 from .types.workflow import (
     trace_workflows,
     DEFAULT_TRACING_OPTIONS,
     WorkflowRunTracingException,
+    TracingStats,
+    get_tracing_item_cache,
     item_model_to_object
 )
 from .types.base import get_item_or_none
+import structlog
+
+
+log = structlog.getLogger(__name__)
+
 
 def includeme(config):
     config.add_route('trace_workflow_runs',         '/trace_workflow_run_steps/{file_uuid}/', traverse='/{file_uuid}')
@@ -56,6 +76,10 @@ def trace_workflow_runs(context, request):
     URI Paramaters:
         all_runs            If true, will not group similar workflow_runs
         track_performance   If true, will record time it takes for execution
+        nocache             If true, will retrace even if a cached trace is available (see provenance_cache)
+        tracing_stats       If true, will log counters & timings of the trace and return them in the X-Tracing-Stats
+                            header (only a `cache_hit` counter if served from the provenance cache). Can be enabled
+                            for all requests with the `workflow_tracing.stats` setting.
 
     Returns:
         List of steps (JSON objects) with inputs and outputs representing IO nodes / files.
@@ -67,9 +91,24 @@ def trace_workflow_runs(context, request):
         options['group_similar_workflow_runs'] = False
     if request.params.get('track_performance'):
         options['track_performance'] = True
+    if request.params.get('tracing_stats') or asbool(request.registry.settings.get('workflow_tracing.stats', False)):
+        options['track_stats'] = True
+
+    provenance_cache = get_provenance_cache(request.registry) if not options['track_performance'] else None
+    if provenance_cache is not None:
+        cache_key = make_provenance_cache_key(context.uuid, options)
+        if not request.params.get('nocache'):
+            cached_steps = provenance_cache.get(cache_key)
+            if cached_steps is not None:
+                if options['track_stats']:
+                    stats = TracingStats()
+                    stats.count('cache_hit')
+                    request.response.headers['X-Tracing-Stats'] = json.dumps(stats.as_dict())
+                return cached_steps
 
     item_types = context.jsonld_type()
     item_model_obj = item_model_to_object(context.model, request)
+    item_cache = get_tracing_item_cache(request)  # Shared with trace_workflows
 
     files_objs_to_trace = []
 
@@ -77,34 +116,39 @@ def trace_workflow_runs(context, request):
         files_objs_to_trace.append(item_model_obj)
 
     elif 'Experiment' in item_types:
-        for file_uuid in item_model_obj.get('processed_files', []):
-            file_model = request.registry[CONNECTION].storage.get_by_uuid(file_uuid)
-            file_obj = item_model_to_object(file_model, request)
-            files_objs_to_trace.append(file_obj)
+        file_uuids = item_model_obj.get('processed_files', [])
+        item_cache.prefetch(file_uuids)
+        for file_uuid in file_uuids:
+            files_objs_to_trace.append(item_cache.get_object(file_uuid))
         files_objs_to_trace.reverse()
 
     elif 'ExperimentSet' in item_types:
         file_uuids_to_trace_from_experiment_set = item_model_obj.get('processed_files', [])
         file_uuids_to_trace_from_experiments    = []
+        item_cache.prefetch(item_model_obj.get('experiments_in_set', []) + file_uuids_to_trace_from_experiment_set)
         for exp_uuid in item_model_obj.get('experiments_in_set', []):
-            experiment_model    = request.registry[CONNECTION].storage.get_by_uuid(exp_uuid)
-            experiment_obj      = item_model_to_object(experiment_model, request)
+            experiment_obj      = item_cache.get_object(exp_uuid)
             file_uuids_to_trace_from_experiments.extend(experiment_obj.get('processed_files', []))
 
+        item_cache.prefetch(file_uuids_to_trace_from_experiments)
         for file_uuid in file_uuids_to_trace_from_experiments + file_uuids_to_trace_from_experiment_set:
-            file_model = request.registry[CONNECTION].storage.get_by_uuid(file_uuid)
-            file_obj = item_model_to_object(file_model, request)
-            files_objs_to_trace.append(file_obj)
+            files_objs_to_trace.append(item_cache.get_object(file_uuid))
         files_objs_to_trace.reverse()
 
     else:
         raise HTTPBadRequest(detail="This type of Item is not traceable: " + ', '.join(item_types))
 
     try:
-        return trace_workflows(files_objs_to_trace, request, options)
+        steps = trace_workflows(files_objs_to_trace, request, options)
     except WorkflowRunTracingException as e:
         raise HTTPBadRequest(detail=e.args[0])
 
+    if options['track_stats']:
+        request.response.headers['X-Tracing-Stats'] = json.dumps(item_cache.stats.as_dict())
+    if provenance_cache is not None:
+        provenance_cache.set(cache_key, steps, item_cache.touched_uuids() | { str(context.uuid) })
+    return steps
+
 
 
 # This must be same as can be used for search query, e.g. &?experiments_in_set.digestion_enzyme.name=No%20value, so that clicking on bar section to filter by this value works.
@@ -225,6 +269,47 @@ SUM_FILES_EXPS_AGGREGATION_DEFINITION = {
 }
 
 
+# Same aggregations as SUM_FILES_EXPS_AGGREGATION_DEFINITION, but as cheap "sum"s over the per-ExperimentSet
+# counts precomputed at index time into `rollup_counts` (see types.experiment_set.calculate_rollup_counts).
+# Note that these sum up per-set unique counts, so a file shared by several sets is counted once per set.
+ROLLUP_SUM_FILES_EXPS_AGGREGATION_DEFINITION = {
+    agg_name : (
+        { "sum" : { "field" : "embedded.rollup_counts." + agg_name[len("total_"):] } }
+        if ("cardinality" in agg_def or "value_count" in agg_def) else deepcopy(agg_def)
+    )
+    for agg_name, agg_def in SUM_FILES_EXPS_AGGREGATION_DEFINITION.items()
+}
+
+# Root-level agg used to check whether all searched ExperimentSets have been indexed with `rollup_counts`.
+ROLLUP_COUNTS_MISSING_AGG_NAME = "rollup_counts_missing"
+
+
+def use_rollup_counts(request):
+    """ Whether to aggregate over precomputed `rollup_counts`; enabled with `visualization.use_rollup_counts` """
+    return asbool(request.registry.settings.get('visualization.use_rollup_counts', False))
+
+
+def search_with_files_exps_aggregations(request, search_param_lists, make_aggregations):
+    """
+    Performs a /browse/ search with the custom aggregations returned by `make_aggregations(sum_files_exps_definition)`.
+
+    If enabled, the rollup (sum) definition is tried first; the search is repeated with the
+    (cardinality) SUM_FILES_EXPS_AGGREGATION_DEFINITION if any of the matched ExperimentSets
+    has no `rollup_counts` yet, e.g. while a reindex is in progress.
+    """
+    search_path = '{}?{}'.format('/browse/', urlencode(search_param_lists, True))
+    if use_rollup_counts(request):
+        aggregations = make_aggregations(deepcopy(ROLLUP_SUM_FILES_EXPS_AGGREGATION_DEFINITION))
+        aggregations[ROLLUP_COUNTS_MISSING_AGG_NAME] = { "missing" : { "field" : "embedded.rollup_counts.experiments" } }
+        search_result = perform_search_request(None, make_search_subreq(request, search_path), custom_aggregations=aggregations)
+        missing_count = search_result['aggregations'].pop(ROLLUP_COUNTS_MISSING_AGG_NAME)['doc_count']
+        if missing_count == 0:
+            return search_result
+        log.info('Falling back to cardinality aggregations, %s ExperimentSets not rolled up' % missing_count)
+    aggregations = make_aggregations(deepcopy(SUM_FILES_EXPS_AGGREGATION_DEFINITION))
+    return perform_search_request(None, make_search_subreq(request, search_path), custom_aggregations=aggregations)
+
+
 RECENTLY_RELEASED_EXPSETS_AGGREGATION_DEFINITION = {
     "all_labs" : {
         "terms" : {
@@ -240,8 +325,84 @@ RECENTLY_RELEASED_EXPSETS_AGGREGATION_DEFINITION = {
 }
 
 
+VISUALIZATION_RESPONSE_CACHE = 'encoded.visualization_response_cache'  # registry key
+DEFAULT_RESPONSE_CACHE_MAX_ENTRIES = 128
+DEFAULT_RESPONSE_CACHE_TTL = 600  # seconds
+DEFAULT_RESPONSE_MAX_AGE = 60  # seconds, for Cache-Control
+AUTH_VARY_HEADERS = ('Cookie', 'Authorization')
+
+
+def get_visualization_response_cache(registry):
+    """
+    Returns the cache of aggregate visualization responses, or None if not enabled via
+    `visualization.response_cache.enabled` (see also `.max_entries` and `.ttl`).
+    """
+    return get_expiring_cache(registry, VISUALIZATION_RESPONSE_CACHE, 'visualization.response_cache',
+                              DEFAULT_RESPONSE_CACHE_MAX_ENTRIES, DEFAULT_RESPONSE_CACHE_TTL)
+
+
+def make_visualization_cache_key(request):
+    """
+    Cache key of an aggregate visualization response: the route, query params & body, effective principals
+    and the generation of the searched indices, so that entries become unreachable once the indexer
+    has written a batch. Returns None while the index generation is not settled.
+    """
+    generation = get_index_generation(request, get_namespaced_index(request, '*'))
+    if generation is None:
+        return None
+    return (
+        request.matched_route.name if request.matched_route else request.path,
+        request.method,
+        json.dumps(sorted(request.GET.items())),
+        hashlib.sha1(request.body or b'').hexdigest(),
+        principals_fingerprint(request.effective_principals),
+        generation
+    )
+
+
+def cached_aggregate_response(view):
+    """
+    Decorator for views returning aggregate search JSON. Serves results from (and stores them in)
+    the visualization response cache, if enabled, and, for GET requests, sets ETag & Cache-Control
+    response headers so that repeat requests may be answered with 304s or by a CDN. Anonymous responses
+    are `public`, all others `private`, and all vary on credentials; max-age is configured by
+    `visualization.response_max_age`. The ETag ignores `time_generated`, which changes on each call.
+    """
+    @wraps(view)
+    def wrapper(context, request):
+        cache = get_visualization_response_cache(request.registry)
+        cache_key = make_visualization_cache_key(request) if cache is not None else None
+        result = cache.get(cache_key) if cache_key is not None else None
+        if result is None:
+            result = view(context, request)
+            if cache_key is not None:
+                cache.set(cache_key, result)
+        result = deepcopy(result)
+        if request.method not in ('GET', 'HEAD'):
+            return result
+
+        response = request.response
+        etag_content = result
+        if isinstance(result, dict):
+            etag_content = {k: v for k, v in result.items() if k != 'time_generated'}
+        response.etag = hashlib.sha1(json.dumps(etag_content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        response.conditional_response = True
+        # a shared cache must not serve anonymous (public) responses to logged in users
+        response.vary = tuple(v for v in (response.vary or ()) if v not in AUTH_VARY_HEADERS) + AUTH_VARY_HEADERS
+        max_age = int(request.registry.settings.get('visualization.response_max_age', DEFAULT_RESPONSE_MAX_AGE))
+        if request.authenticated_userid is None:
+            response.cache_control.public = True
+        else:
+            response.cache_control.private = True
+        response.cache_control.max_age = max_age
+        return result
+
+    return wrapper
+
+
 @view_config(route_name='bar_plot_chart', request_method=['GET', 'POST'])
 @debug_log
+@cached_aggregate_response
 def bar_plot_chart(context, request):
 
     MAX_BUCKET_COUNT = 30  # Max amount of bars or bar sections to return, excluding 'other'.
@@ -258,51 +419,54 @@ def bar_plot_chart(context, request):
     if len(fields_to_aggregate_for) == 0:
         raise HTTPBadRequest(detail="No fields supplied to aggregate for.")
 
-    primary_agg = {
-        "field_0": {
-            "terms": {
-                "field": "embedded." + fields_to_aggregate_for[0] + '.raw',
-                "missing": TERM_NAME_FOR_NO_VALUE,
-                "size": MAX_BUCKET_COUNT
-            },
-            "aggs": deepcopy(SUM_FILES_EXPS_AGGREGATION_DEFINITION)
+    def make_aggregations(sum_files_exps_definition):
+        primary_agg = {
+            "field_0": {
+                "terms": {
+                    "field": "embedded." + fields_to_aggregate_for[0] + '.raw',
+                    "missing": TERM_NAME_FOR_NO_VALUE,
+                    "size": MAX_BUCKET_COUNT
+                },
+                "aggs": deepcopy(sum_files_exps_definition)
+            }
         }
-    }
 
-    primary_agg.update(deepcopy(SUM_FILES_EXPS_AGGREGATION_DEFINITION))
-    del primary_agg['total_files']  # "bucket_script" not supported on root-level aggs
-    del primary_agg['total_processed_files']  # "bucket_script" not supported on root-level aggs
-    del primary_agg['total_opf_files']  # "bucket_script" not supported on root-level aggs
+        primary_agg.update(deepcopy(sum_files_exps_definition))
+        del primary_agg['total_files']  # "bucket_script" not supported on root-level aggs
+        del primary_agg['total_processed_files']  # "bucket_script" not supported on root-level aggs
+        del primary_agg['total_opf_files']  # "bucket_script" not supported on root-level aggs
 
-    # Nest in additional fields, if any
-    curr_field_aggs = primary_agg['field_0']['aggs']
-    for field_index, field in enumerate(fields_to_aggregate_for):
-        if field_index == 0:
-            continue
-        curr_field_aggs["field_" + str(field_index)] = {
-            "terms": {
-                "field": "embedded." + field + '.raw',
-                "missing": TERM_NAME_FOR_NO_VALUE,
-                "size": MAX_BUCKET_COUNT
-            },
-            "aggs": deepcopy(SUM_FILES_EXPS_AGGREGATION_DEFINITION)
-        }
-        curr_field_aggs = curr_field_aggs['field_' + str(field_index)]['aggs']
+        # Nest in additional fields, if any
+        curr_field_aggs = primary_agg['field_0']['aggs']
+        for field_index, field in enumerate(fields_to_aggregate_for):
+            if field_index == 0:
+                continue
+            curr_field_aggs["field_" + str(field_index)] = {
+                "terms": {
+                    "field": "embedded." + field + '.raw',
+                    "missing": TERM_NAME_FOR_NO_VALUE,
+                    "size": MAX_BUCKET_COUNT
+                },
+                "aggs": deepcopy(sum_files_exps_definition)
+            }
+            curr_field_aggs = curr_field_aggs['field_' + str(field_index)]['aggs']
+
+        return primary_agg
 
 
     search_param_lists['limit'] = search_param_lists['from'] = [0]
-    subreq = make_search_subreq(request, '{}?{}'.format('/browse/', urlencode(search_param_lists, True)) )
-    search_result = perform_search_request(None, subreq, custom_aggregations=primary_agg)
+    search_result = search_with_files_exps_aggregations(request, search_param_lists, make_aggregations)
 
     for field_to_delete in ['@context', '@id', '@type', '@graph', 'title', 'filters', 'facets', 'sort', 'clear_filters', 'actions', 'columns']:
         if search_result.get(field_to_delete) is None:
             continue
         del search_result[field_to_delete]
 
-    raw_count = search_result['aggregations']['total_exp_raw_files']['value']
-    processed_count = (search_result['aggregations']['total_expset_processed_files']['value'] + 
+    # "sum" aggs (rollup_counts) return floats
+    raw_count = int(search_result['aggregations']['total_exp_raw_files']['value'])
+    processed_count = int(search_result['aggregations']['total_expset_processed_files']['value'] +
                     search_result['aggregations']['total_exp_processed_files']['value'])
-    opf_count = (search_result['aggregations']['total_expset_other_processed_files']['value'] +
+    opf_count = int(search_result['aggregations']['total_expset_other_processed_files']['value'] +
                 search_result['aggregations']['total_exp_other_processed_files']['value'])
 
     ret_result = {  # We will fill up the "terms" here from our search_result buckets and then return this dictionary.
@@ -310,7 +474,7 @@ def bar_plot_chart(context, request):
         "terms": {},
         "total": {
             "experiment_sets"   : search_result['total'],
-            "experiments"       : search_result['aggregations']['total_experiments']['value'],
+            "experiments"       : int(search_result['aggregations']['total_experiments']['value']),
             "files"             : raw_count + processed_count + opf_count,
             "files_raw"         : raw_count,
             "files_processed"   : processed_count,
@@ -356,6 +520,7 @@ def bar_plot_chart(context, request):
 
 @view_config(route_name='recently_released_datasets', request_method=['GET'])
 @debug_log
+@cached_aggregate_response
 def recently_released_datasets(context, request):
 
     MAX_BUCKET_COUNT = 6 # default max rows
@@ -428,6 +593,7 @@ def recently_released_datasets(context, request):
 
 @view_config(route_name='date_histogram_aggregations', request_method=['GET', 'POST'])
 @debug_log
+@cached_aggregate_response
 def date_histogram_aggregations(context, request):
     '''PREDEFINED aggregations which run against type=ExperimentSet'''
 
@@ -478,79 +644,92 @@ def date_histogram_aggregations(context, request):
             search_param_lists = deepcopy(DEFAULT_BROWSE_PARAM_LISTS)
             del search_param_lists['award.project']
 
-    if 'ExperimentSet' in search_param_lists['type'] or 'ExperimentSetReplicate' in search_param_lists['type']:
-        # Add predefined sub-aggs to collect Exp and File counts from ExpSet items, in addition to getting own doc_count.
+    is_expset_search = 'ExperimentSet' in search_param_lists['type'] or 'ExperimentSetReplicate' in search_param_lists['type']
 
-        common_sub_agg = deepcopy(SUM_FILES_EXPS_AGGREGATION_DEFINITION)
+    def make_aggregations(sum_files_exps_definition):
+        if sum_files_exps_definition is not None:
+            # Add predefined sub-aggs to collect Exp and File counts from ExpSet items, in addition to getting own doc_count.
 
-        # Add on file_size_volume
-        for key_name in ['total_exp_raw_files', 'total_exp_processed_files', 'total_expset_processed_files']:
-            common_sub_agg[key_name + "_volume"] = {
-                "sum" : {
-                    "field" : common_sub_agg[key_name]["cardinality"]["field"].replace('.accession.raw', '.file_size')
-                }
-            }
-        common_sub_agg["total_files_volume"] = {
-            "bucket_script" : {
-                "buckets_path": {
-                    "expSetProcessedFilesVol": "total_expset_processed_files_volume",
-                    "expProcessedFilesVol": "total_exp_processed_files_volume",
-                    "expRawFilesVol": "total_exp_raw_files_volume"
-                },
-                "script" : "params.expSetProcessedFilesVol + params.expProcessedFilesVol + params.expRawFilesVol"
-            }
-        }
+            common_sub_agg = sum_files_exps_definition
 
-        if group_by_fields is not None:
-            group_by_agg_dict = {
-                group_by_field : {
-                    "terms" : {
-                        "field"     : "embedded." + group_by_field + ".raw",
-                        "missing"   : TERM_NAME_FOR_NO_VALUE,
-                        "size"      : 30
+            # Add on file_size_volume
+            for key_name in ['total_exp_raw_files', 'total_exp_processed_files', 'total_expset_processed_files']:
+                if "cardinality" in common_sub_agg[key_name]:
+                    volume_field = common_sub_agg[key_name]["cardinality"]["field"].replace('.accession.raw', '.file_size')
+                else:  # rollup_counts
+                    volume_field = common_sub_agg[key_name]["sum"]["field"] + "_volume"
+                common_sub_agg[key_name + "_volume"] = {
+                    "sum" : {
+                        "field" : volume_field
+                    }
+                }
+            common_sub_agg["total_files_volume"] = {
+                "bucket_script" : {
+                    "buckets_path": {
+                        "expSetProcessedFilesVol": "total_expset_processed_files_volume",
+                        "expProcessedFilesVol": "total_exp_processed_files_volume",
+                        "expRawFilesVol": "total_exp_raw_files_volume"
                     },
-                    "aggs" : common_sub_agg
+                    "script" : "params.expSetProcessedFilesVol + params.expProcessedFilesVol + params.expRawFilesVol"
                 }
-                for group_by_field in group_by_fields if group_by_field is not None
             }
-            histogram_sub_aggs = dict(common_sub_agg, **group_by_agg_dict)
-        else:
-            histogram_sub_aggs = common_sub_agg
 
-    else:
-        if group_by_fields is not None:
-            # Do simple date_histogram group_by sub agg, unless is set to 'None'
-            histogram_sub_aggs = {
-                group_by_field : {
-                    "terms" : {
-                        "field"     : "embedded." + group_by_field + ".raw",
-                        "missing"   : TERM_NAME_FOR_NO_VALUE,
-                        "size"      : 30
+            if group_by_fields is not None:
+                group_by_agg_dict = {
+                    group_by_field : {
+                        "terms" : {
+                            "field"     : "embedded." + group_by_field + ".raw",
+                            "missing"   : TERM_NAME_FOR_NO_VALUE,
+                            "size"      : 30
+                        },
+                        "aggs" : common_sub_agg
                     }
+                    for group_by_field in group_by_fields if group_by_field is not None
                 }
-                for group_by_field in group_by_fields if group_by_field is not None
-            }
+                histogram_sub_aggs = dict(common_sub_agg, **group_by_agg_dict)
+            else:
+                histogram_sub_aggs = common_sub_agg
+
         else:
-            histogram_sub_aggs = None
-
-    # Create an agg item for each interval in `date_histogram_intervals` x each date field in `date_histogram_fields`
-    # TODO: Figure out if we want to align these up instead of do each combination.
-    outer_date_histogram_agg = {}
-    for interval in date_histogram_intervals:
-        for dh_field in date_histogram_fields:
-            outer_date_histogram_agg[interval + '_interval_' + dh_field] = {
-                "date_histogram" : {
-                    "field": "embedded." + dh_field,
-                    "interval": interval_to_es_interval[interval],
-                    "format": "yyyy-MM-dd"
+            if group_by_fields is not None:
+                # Do simple date_histogram group_by sub agg, unless is set to 'None'
+                histogram_sub_aggs = {
+                    group_by_field : {
+                        "terms" : {
+                            "field"     : "embedded." + group_by_field + ".raw",
+                            "missing"   : TERM_NAME_FOR_NO_VALUE,
+                            "size"      : 30
+                        }
+                    }
+                    for group_by_field in group_by_fields if group_by_field is not None
                 }
-            }
-            if histogram_sub_aggs:
-                outer_date_histogram_agg[interval + '_interval_' + dh_field]['aggs'] = histogram_sub_aggs
+            else:
+                histogram_sub_aggs = None
+
+        # Create an agg item for each interval in `date_histogram_intervals` x each date field in `date_histogram_fields`
+        # TODO: Figure out if we want to align these up instead of do each combination.
+        outer_date_histogram_agg = {}
+        for interval in date_histogram_intervals:
+            for dh_field in date_histogram_fields:
+                outer_date_histogram_agg[interval + '_interval_' + dh_field] = {
+                    "date_histogram" : {
+                        "field": "embedded." + dh_field,
+                        "interval": interval_to_es_interval[interval],
+                        "format": "yyyy-MM-dd"
+                    }
+                }
+                if histogram_sub_aggs:
+                    outer_date_histogram_agg[interval + '_interval_' + dh_field]['aggs'] = histogram_sub_aggs
+
+        return outer_date_histogram_agg
+
 
     search_param_lists['limit'] = search_param_lists['from'] = [0]
-    subreq          = make_search_subreq(request, '{}?{}'.format('/browse/', urlencode(search_param_lists, True)))
-    search_result   = perform_search_request(None, subreq, custom_aggregations=outer_date_histogram_agg)
+    if is_expset_search:
+        search_result = search_with_files_exps_aggregations(request, search_param_lists, make_aggregations)
+    else:
+        subreq          = make_search_subreq(request, '{}?{}'.format('/browse/', urlencode(search_param_lists, True)))
+        search_result   = perform_search_request(None, subreq, custom_aggregations=make_aggregations(None))
 
     for field_to_delete in ['@context', '@id', '@type', '@graph', 'title', 'filters', 'facets', 'sort', 'clear_filters', 'actions', 'columns']:
         if search_result.get(field_to_delete) is None:
@@ -707,8 +886,46 @@ def add_files_to_higlass_viewconf(context, request):
         "new_genome_assembly" : genome_assembly
     }
 
+def get_indexed_objects_by_uuid(request, uuids):
+    """Retrieve the object frames of the given Items from ElasticSearch in a single request.
+    Only Items viewable by the request's effective principals are returned.
+
+    Args:
+        request         : Network request
+        uuids(list)     : A list of Item uuids.
+
+    Returns:
+        A dictionary of uuid to object frame. Items which are not indexed (or not
+        identified by uuid, e.g. by accession) are left out, as are all Items if
+        ElasticSearch is not available.
+    """
+    es = request.registry.get(ELASTIC_SEARCH)
+    if es is None or not uuids:
+        return {}
+    query = {
+        "query": {
+            "bool": {
+                "filter": [
+                    {"ids": {"values": list(uuids)}},
+                    {"terms": {"principals_allowed.view": request.effective_principals}}
+                ]
+            }
+        },
+        "_source": ["object"],
+        "size": len(uuids)
+    }
+    try:
+        es_results = es.search(index=get_namespaced_index(request, '*'), body=query)
+    except Exception as exc:
+        log.warning('Could not look up Items in ElasticSearch', error=str(exc))
+        return {}
+    return {hit['_id']: hit['_source']['object'] for hit in es_results['hits']['hits']}
+
 def get_file_higlass_information(request, file_uuids):
     """Retrieve the given file data and their formats.
+    Files are looked up in ElasticSearch with one request, falling back to
+    individual lookups for files which aren't found there.
+
     Args:
         request         : Network request
         file_uuids(list): A list of strings, where each string is a unique identifier to find a file.
@@ -720,12 +937,14 @@ def get_file_higlass_information(request, file_uuids):
             file_format(string) : The type of file present.
         A string containing an error.
     """
+    indexed_files = get_indexed_objects_by_uuid(request, list(set(file_uuids)))
+
     # Collect more info on each file.
     files_info = []
     for file_uuid in file_uuids:
         data = {
             "uuid" : file_uuid,
-            "data" : get_item_or_none(request, file_uuid),
+            "data" : indexed_files.get(file_uuid) or get_item_or_none(request, file_uuid),
         }
 
         if data["data"] == None:
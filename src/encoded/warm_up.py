@@ -0,0 +1,73 @@
+"""
+Optional warm-up of a newly created app (i.e. each new worker process, after a deploy or autoscaling event).
+
+Before the app serves any user request, a few requests are made to the hot endpoints (/search/, /browse/ and
+the search done by /metadata/) so that schema lookups, search skeletons and Elasticsearch connection pools are
+primed, and so that the "first result after bootup returns empty" issue is taken care of outside of user requests.
+
+Warm-up runs in a background thread, so that creating the app is not slowed down by it. It is enabled with
+`warm_up.enabled`, which is only passed by the entry points of web workers (pserve in supervisord.conf, and
+parts/production/wsgi), so that the indexer, ingestion listener and command line tools sharing the same ini file
+don't pay for it. Paths default to DEFAULT_WARM_UP_PATHS + the /metadata/ search, and can be overridden with
+`warm_up.paths` (one path per line).
+"""
+
+import threading
+import time
+from urllib.parse import urlencode
+from dcicutils.misc_utils import VirtualApp
+from pyramid.settings import asbool
+from .batch_download import get_metadata_header_and_fields
+
+import structlog
+
+
+log = structlog.getLogger(__name__)
+
+
+DEFAULT_WARM_UP_PATHS = [
+    '/profiles/',
+    '/search/?type=ExperimentSetReplicate&limit=10',
+    '/browse/?type=ExperimentSetReplicate&experimentset_type=replicate&limit=10',
+]
+
+
+def get_metadata_warm_up_path(search_type='ExperimentSetReplicate'):
+    """ Same search as is done by /metadata/ for `search_type`, for 10 results only """
+    _header, fields = get_metadata_header_and_fields(search_type)
+    return '/search/?' + urlencode({'type': search_type, 'field': fields, 'sort': 'accession', 'limit': 10}, True)
+
+
+def get_warm_up_paths(settings):
+    paths = settings.get('warm_up.paths')
+    if paths:
+        return [path.strip() for path in paths.strip().split('\n') if path.strip()]
+    return DEFAULT_WARM_UP_PATHS + [get_metadata_warm_up_path()]
+
+
+def warm_up_app(app, paths):
+    """
+    Requests each of `paths` from `app` as an anonymous user. Failures are logged and otherwise ignored,
+    as warm-up must never prevent the app from starting.
+    """
+    testapp = VirtualApp(app, {'HTTP_ACCEPT': 'application/json'})
+    for path in paths:
+        start = time.time()
+        try:
+            response = testapp.get(path, status='*')
+        except Exception as exc:
+            log.warning('Warm-up request failed', path=path, error=str(exc))
+            continue
+        log.info('Warm-up request done', path=path, status=response.status_int,
+                 duration_ms=int((time.time() - start) * 1000))
+
+
+def warm_up_if_enabled(app, settings):
+    """ Starts warming up `app` in a daemon thread, if enabled and Elasticsearch is configured; returns the thread """
+    if not asbool(settings.get('warm_up.enabled', False)):
+        return None
+    if 'elasticsearch.server' not in settings:
+        return None
+    thread = threading.Thread(target=warm_up_app, args=(app, get_warm_up_paths(settings)), name='warm-up', daemon=True)
+    thread.start()
+    return thread